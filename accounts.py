@@ -0,0 +1,251 @@
+"""Deleting accounts.
+
+`db.session.delete(user)` loaded a user's messages, follows and likes into
+the session before anything was deleted, then removed the lot in one
+transaction, so a prolific user took seconds and memory in proportion to
+their history while holding locks on everything they touched.
+
+Instead `delete()` soft-deletes: it sets `users.deleted_at`, after which
+the user can't log in and no longer shows as logged in, and queues the
+`purge_user` job (see jobs.py). Each run of the job does one step of
+`purge_batch()`: a single set-based `DELETE` of at most `batch_size` rows
+hanging off the user, along with the counter updates for the people and
+messages on the other side of those rows, and queues the next run. When
+nothing is left the user row goes too. So however much a user wrote, no
+transaction touches more than `batch_size` rows, memory stays flat, and a
+retried or repeated step just carries on from the last commit.
+
+With the inline executor only the first step runs, in the request, so
+deleting an account costs the same however much the user wrote; the rest
+is left to `flask purge-users` (run it from cron), which commits after
+every step. It also finishes any soft-deleted users whose jobs were lost.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, select, tuple_
+
+from models import (db, User, Message, Follows, Likes, TimelineEntry,
+                    MessageTag, Suggestion)
+import counters
+import jobs
+
+DEFAULT_BATCH_SIZE = 1000
+
+batch_size = DEFAULT_BATCH_SIZE
+
+
+def configure(size):
+    """Set the rows deleted per step (from app config)."""
+
+    global batch_size
+    batch_size = size
+
+
+def delete(user_id):
+    """Hide `user_id` now and queue the purge of everything they own.
+    Callers commit."""
+
+    (User
+     .query
+     .filter(User.id == user_id, User.deleted_at.is_(None))
+     .update({User.deleted_at: datetime.utcnow()},
+             synchronize_session=False))
+
+    jobs.enqueue('purge_user', key=f"purge_user:{user_id}:0",
+                 user_id=user_id)
+
+
+@jobs.task('purge_user')
+def purge_job(user_id, step=0):
+    """Purge one batch of `user_id`'s rows and queue the next (only with
+    the queue executor: inline, the rest waits for `flask purge-users`)."""
+
+    if purge_batch(user_id) or jobs.executor != jobs.QUEUE:
+        return
+
+    jobs.enqueue('purge_user', key=f"purge_user:{user_id}:{step + 1}",
+                 user_id=user_id, step=step + 1)
+
+
+def purge(user_id, commit=True):
+    """Purge `user_id` completely, committing after each batch; returns
+    the number of batches."""
+
+    batches = 1
+    while not purge_batch(user_id):
+        batches += 1
+        if commit:
+            db.session.commit()
+    if commit:
+        db.session.commit()
+    return batches
+
+
+def purge_batch(user_id, limit=None):
+    """Delete the next batch of rows hanging off `user_id`, or the user
+    once nothing is left; True when the user is gone."""
+
+    limit = limit or batch_size
+    for step in STEPS:
+        if step(user_id, limit):
+            return False
+
+    User.query.filter(User.id == user_id).delete(synchronize_session=False)
+    return True
+
+
+##############################################################################
+# Steps, in order. Each deletes up to `limit` rows and returns how many.
+
+
+def _following(user_id, limit):
+    """Users `user_id` follows lose a follower."""
+
+    followed = [row[0] for row in (db.session
+                                   .query(Follows.user_being_followed_id)
+                                   .filter(Follows.user_following_id == user_id)
+                                   .limit(limit))]
+    if followed:
+        counters.adjust_users(followed, followers_count=-1)
+        db.session.execute(Follows.__table__.delete().where(and_(
+            Follows.user_following_id == user_id,
+            Follows.user_being_followed_id.in_(followed))))
+    return len(followed)
+
+
+def _followers(user_id, limit):
+    """Followers lose a followed user. (`user_id`'s messages leave their
+    feeds later, in `_feeds`.)"""
+
+    followers = [row[0] for row in (db.session
+                                    .query(Follows.user_following_id)
+                                    .filter(Follows.user_being_followed_id ==
+                                            user_id)
+                                    .limit(limit))]
+    if followers:
+        counters.adjust_users(followers, following_count=-1)
+        db.session.execute(Follows.__table__.delete().where(and_(
+            Follows.user_being_followed_id == user_id,
+            Follows.user_following_id.in_(followers))))
+    return len(followers)
+
+
+def _likes(user_id, limit):
+    """Messages `user_id` liked lose a like."""
+
+    rows = (db.session
+            .query(Likes.id, Likes.message_id)
+            .filter(Likes.user_id == user_id)
+            .limit(limit)
+            .all())
+    if rows:
+        (Message
+         .query
+         .filter(Message.id.in_([message_id for _, message_id in rows]))
+         .update({Message.like_count: Message.like_count - 1},
+                 synchronize_session=False))
+        _delete_likes([like_id for like_id, _ in rows])
+    return len(rows)
+
+
+def _liked(user_id, limit):
+    """Users who liked `user_id`'s messages lose those likes."""
+
+    rows = (db.session
+            .query(Likes.id, Likes.user_id)
+            .join(Message, Message.id == Likes.message_id)
+            .filter(Message.user_id == user_id)
+            .limit(limit)
+            .all())
+    if rows:
+        by_count = defaultdict(list)
+        for liker_id, n in Counter(liker for _, liker in rows).items():
+            by_count[n].append(liker_id)
+        for n, likers in by_count.items():
+            counters.adjust_users(likers, likes_count=-n)
+        _delete_likes([like_id for like_id, _ in rows])
+    return len(rows)
+
+
+def _timeline(user_id, limit):
+    """`user_id`'s own feed."""
+
+    entries = [row[0] for row in (db.session
+                                  .query(TimelineEntry.message_id)
+                                  .filter(TimelineEntry.user_id == user_id)
+                                  .limit(limit))]
+    if entries:
+        db.session.execute(TimelineEntry.__table__.delete().where(and_(
+            TimelineEntry.user_id == user_id,
+            TimelineEntry.message_id.in_(entries))))
+    return len(entries)
+
+
+def _feeds(user_id, limit):
+    """`user_id`'s messages leave other users' feeds."""
+
+    entries = (select([TimelineEntry.user_id, TimelineEntry.message_id])
+               .select_from(TimelineEntry.__table__.join(
+                   Message.__table__,
+                   Message.id == TimelineEntry.message_id))
+               .where(Message.user_id == user_id)
+               .limit(limit))
+
+    return db.session.execute(TimelineEntry.__table__.delete().where(
+        tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+        .in_(entries))).rowcount
+
+
+def _messages(user_id, limit):
+    """`user_id`'s messages and their tags."""
+
+    rows = (db.session
+            .query(Message.id, Message.timestamp)
+            .filter(Message.user_id == user_id)
+            .limit(limit)
+            .all())
+    if rows:
+        ids = [message_id for message_id, _ in rows]
+        timestamps = [timestamp for _, timestamp in rows]
+        db.session.execute(MessageTag.__table__.delete().where(
+            MessageTag.message_id.in_(ids)))
+        # the timestamp range lets Postgres skip other partitions
+        (Message
+         .query
+         .filter(Message.id.in_(ids),
+                 Message.timestamp.between(min(timestamps), max(timestamps)))
+         .delete(synchronize_session=False))
+    return len(rows)
+
+
+def _suggestions(user_id, limit):
+    """`user_id`'s own suggestions (rows suggesting them cascade with the
+    user)."""
+
+    candidates = (select([Suggestion.candidate_id])
+                  .where(Suggestion.user_id == user_id)
+                  .limit(limit))
+
+    return db.session.execute(Suggestion.__table__.delete().where(and_(
+        Suggestion.user_id == user_id,
+        Suggestion.candidate_id.in_(candidates)))).rowcount
+
+
+def _delete_likes(like_ids):
+    db.session.execute(Likes.__table__.delete().where(
+        Likes.id.in_(like_ids)))
+
+
+STEPS = [_following, _followers, _likes, _liked, _timeline, _feeds,
+         _messages, _suggestions]
+
+
+def deleted_user_ids():
+    """Ids of soft-deleted users still waiting to be purged."""
+
+    return [row[0] for row in (db.session
+                               .query(User.id)
+                               .filter(User.deleted_at.isnot(None))
+                               .order_by(User.id))]
@@ -0,0 +1,229 @@
+"""Versioned JSON API for Warbler clients, mounted at /api/v1.
+
+Clients sign in through the site and send the same session cookie. List
+endpoints take the site's `before`/`after` cursors and return
+`{"items": [...], "before": ..., "after": ...}`; every endpoint takes an
+optional `fields=id,text,...` to return only the fields it needs. Errors
+come back as `{"error": ...}` with the matching status code.
+"""
+
+from flask import Blueprint, abort, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from models import db, User, Message, Follows
+import pagination
+import social
+import timeline
+import writes
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+##############################################################################
+# Serialization
+
+
+class Serializer:
+    """Turns objects into dicts of selected fields.
+
+    `fields` maps each field name to a function of the object; `default`
+    names the fields sent when the client doesn't pick any.
+    """
+
+    def __init__(self, fields, default):
+        self.fields = fields
+        self.default = default
+
+    def select(self):
+        """Field names asked for in `?fields=`; unknown names are a 400."""
+
+        requested = request.args.get('fields')
+        if not requested:
+            return self.default
+
+        names = [name.strip() for name in requested.split(',')
+                 if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            abort(400, f"Unknown fields: {', '.join(unknown)}")
+        return names
+
+    def dump(self, obj, names, **extra):
+        """Dict of `names` for `obj`; `extra` overrides field functions."""
+
+        return self.dump_many([obj], names, **extra)[0]
+
+    def dump_many(self, objs, names, **extra):
+        getters = [(name, extra.get(name) or self.fields[name])
+                   for name in names]
+        return [{name: get(obj) for name, get in getters} for obj in objs]
+
+
+def _author(user):
+    return {'id': user.id, 'username': user.username,
+            'image_url': user.image_url}
+
+
+users = Serializer({
+    'id': lambda u: u.id,
+    'username': lambda u: u.username,
+    'image_url': lambda u: u.image_url,
+    'header_image_url': lambda u: u.header_image_url,
+    'bio': lambda u: u.bio,
+    'location': lambda u: u.location,
+    'messages_count': lambda u: u.messages_count,
+    'following_count': lambda u: u.following_count,
+    'followers_count': lambda u: u.followers_count,
+    'likes_count': lambda u: u.likes_count,
+    'is_following': lambda u: None,
+}, default=['id', 'username', 'image_url', 'bio', 'is_following'])
+
+messages = Serializer({
+    'id': lambda m: m.id,
+    'text': lambda m: m.text,
+    'timestamp': lambda m: m.timestamp.isoformat(),
+    'user_id': lambda m: m.user_id,
+    'user': lambda m: _author(m.user),
+    'like_count': lambda m: m.like_count,
+    'liked': lambda m: None,
+}, default=['id', 'text', 'timestamp', 'user', 'like_count', 'liked'])
+
+
+def page_json(page, serializer, **extra):
+    """JSON response for one `pagination.Page`."""
+
+    names = serializer.select()
+    return jsonify(items=serializer.dump_many(page.items, names, **extra),
+                   before=page.before, after=page.after)
+
+
+def message_page_json(page):
+    """JSON for a page of messages, with the viewer's likes filled in."""
+
+    liked = set()
+    if g.user:
+        liked = social.liked_ids(g.user.id, [m.id for m in page.items])
+
+    return page_json(page, messages, liked=lambda m: m.id in liked)
+
+
+def user_page_json(page):
+    """JSON for a page of users, with the viewer's follows filled in."""
+
+    status = {}
+    if g.user:
+        status = g.user.following_status([u.id for u in page.items])
+
+    return page_json(page, users, is_following=lambda u: status.get(u.id))
+
+
+def cursors():
+    return {
+        'before': pagination.parse_message_cursor(request.args.get('before')),
+        'after': pagination.parse_message_cursor(request.args.get('after')),
+    }
+
+
+def user_cursors():
+    return {
+        'before': pagination.parse_user_cursor(request.args.get('before')),
+        'after': pagination.parse_user_cursor(request.args.get('after')),
+    }
+
+
+def login_required():
+    if not g.user:
+        abort(401, "Log in first.")
+
+
+@api.errorhandler(HTTPException)
+def api_error(e):
+    """JSON body for errors raised by API views."""
+
+    if e.code is None:
+        return e
+    return jsonify(error=e.description), e.code
+
+
+##############################################################################
+# Endpoints
+
+
+@api.route('/timeline')
+def home_timeline():
+    """A page of the logged-in user's home feed."""
+
+    login_required()
+    page = timeline.home_timeline(g.user.id, **cursors())
+    return message_page_json(page)
+
+
+@api.route('/users/<int:user_id>')
+def user_profile(user_id):
+    """A user's profile and counters."""
+
+    user = User.visible().filter_by(id=user_id).first_or_404()
+
+    following = None
+    if g.user:
+        following = g.user.following_status([user.id])[user.id]
+
+    return jsonify(users.dump(user, users.select(),
+                              is_following=lambda u: following))
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A page of a user's messages, newest first."""
+
+    User.visible().filter_by(id=user_id).first_or_404()
+    page = pagination.paginate_messages(
+        Message.query.filter(Message.user_id == user_id), **cursors())
+    return message_page_json(page)
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """A page of the users `user_id` follows."""
+
+    User.visible().filter_by(id=user_id).first_or_404()
+    query = (User
+             .visible()
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id))
+    return user_page_json(pagination.paginate_users(query, **user_cursors()))
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """A page of the users following `user_id`."""
+
+    User.visible().filter_by(id=user_id).first_or_404()
+    query = (User
+             .visible()
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id))
+    return user_page_json(pagination.paginate_users(query, **user_cursors()))
+
+
+@api.route('/messages/<int:message_id>/like', methods=['POST'])
+def toggle_like(message_id):
+    """Like or unlike a message; returns its new like state and count.
+
+    With the write buffer on, the state is the one that will be written and
+    the count doesn't include it yet.
+    """
+
+    login_required()
+    msg = Message.visible().filter(Message.id == message_id).first_or_404()
+
+    if msg.user_id == g.user.id:
+        abort(403, "You can't like your own warbles.")
+
+    liked = writes.toggle_like(g.user.id, msg.id)
+
+    like_count = (db.session
+                  .query(Message.like_count)
+                  .filter(Message.id == msg.id)
+                  .scalar())
+    return jsonify(id=msg.id, liked=liked, like_count=like_count)
@@ -1,14 +1,46 @@
 import os
+import signal
+import threading
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, url_for, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm,UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Follows
+import accounts
+import api
+import counters
+import fragments
+import hashing
+import http_cache
+import jobs
+import loader
+import metrics
+import pagination
+import partitions
+import routing
+import search
+import social
+import suggestions
+import tags
+import timeline
+import trending
+import user_cache
+import writes
 
 CURR_USER_KEY = "curr_user"
 
+
+def env_int(name):
+    """Integer setting from the environment, or None if it isn't set."""
+
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
 app = Flask(__name__)
 
 # Get DB_URI from environ variable (useful for production/testing) or,
@@ -20,9 +52,126 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Connection pools, for the primary and each replica; unset means
+# SQLAlchemy's defaults
+app.config['SQLALCHEMY_POOL_SIZE'] = env_int('DB_POOL_SIZE')
+app.config['SQLALCHEMY_MAX_OVERFLOW'] = env_int('DB_MAX_OVERFLOW')
+app.config['SQLALCHEMY_POOL_TIMEOUT'] = env_int('DB_POOL_TIMEOUT')
+app.config['SQLALCHEMY_POOL_RECYCLE'] = env_int('DB_POOL_RECYCLE')
+app.config['SQLALCHEMY_POOL_PRE_PING'] = (
+    os.environ.get('DB_POOL_PRE_PING') == '1')
+
+# Read replicas (comma-separated URLs) for views marked @routing.read_only;
+# a browser that wrote reads from the primary for REPLICA_STICKY_SECONDS.
+# See routing.py
+app.config['SQLALCHEMY_BINDS'] = {
+    f"replica{i}": url for i, url in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(',')))
+}
+app.config['READ_REPLICAS'] = list(app.config['SQLALCHEMY_BINDS'])
+app.config['REPLICA_STICKY_SECONDS'] = int(
+    os.environ.get('REPLICA_STICKY_SECONDS', routing.DEFAULT_STICKY_SECONDS))
+
+# Set once the partition_messages migration has run: creates monthly message
+# partitions on demand and reads recent ones first; see partitions.py
+app.config['MESSAGE_PARTITIONS'] = os.environ.get('MESSAGE_PARTITIONS') == '1'
+
+# Authors with at least this many followers are not fanned out on write;
+# their messages are merged into home timelines at read time instead.
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', timeline.DEFAULT_FANOUT_LIMIT))
+
+# Logged-in user snapshots cached per process; see user_cache.py
+app.config['USER_CACHE_SIZE'] = int(
+    os.environ.get('USER_CACHE_SIZE', user_cache.DEFAULT_MAXSIZE))
+app.config['USER_CACHE_TTL'] = int(
+    os.environ.get('USER_CACHE_TTL', user_cache.DEFAULT_TTL))
+# Rendered message items and user cards, per process; see fragments.py
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_SIZE', fragments.DEFAULT_MAXSIZE))
+# Buffer like/follow writes and commit them in batches; see writes.py for
+# what that trades away in durability.
+app.config['WRITE_BUFFER'] = os.environ.get('WRITE_BUFFER') == '1'
+app.config['WRITE_BUFFER_INTERVAL'] = float(
+    os.environ.get('WRITE_BUFFER_INTERVAL', writes.DEFAULT_INTERVAL))
+app.config['WRITE_BUFFER_SIZE'] = int(
+    os.environ.get('WRITE_BUFFER_SIZE', writes.DEFAULT_MAX_PENDING))
+# Trending tags and warbles over the last TRENDING_WINDOW_BUCKETS buckets of
+# TRENDING_BUCKET_SECONDS, saved and re-ranked every TRENDING_INTERVAL
+# seconds; see trending.py
+app.config['TRENDING'] = os.environ.get('TRENDING', '1') == '1'
+app.config['TRENDING_BUCKET_SECONDS'] = int(os.environ.get(
+    'TRENDING_BUCKET_SECONDS', trending.DEFAULT_BUCKET_SECONDS))
+app.config['TRENDING_WINDOW_BUCKETS'] = int(os.environ.get(
+    'TRENDING_WINDOW_BUCKETS', trending.DEFAULT_WINDOW))
+app.config['TRENDING_INTERVAL'] = float(os.environ.get(
+    'TRENDING_INTERVAL', trending.DEFAULT_INTERVAL))
+# Background jobs run inline by default; with JOBS_EXECUTOR=queue they are
+# queued in the `jobs` table for `flask jobs-worker`; see jobs.py
+app.config['JOBS_EXECUTOR'] = os.environ.get('JOBS_EXECUTOR', jobs.INLINE)
+app.config['JOBS_MAX_ATTEMPTS'] = int(
+    os.environ.get('JOBS_MAX_ATTEMPTS', jobs.DEFAULT_MAX_ATTEMPTS))
+app.config['JOBS_BACKOFF'] = float(
+    os.environ.get('JOBS_BACKOFF', jobs.DEFAULT_BACKOFF))
+app.config['JOBS_LEASE_SECONDS'] = int(
+    os.environ.get('JOBS_LEASE_SECONDS', jobs.DEFAULT_LEASE))
+# Deleted accounts are purged this many rows per transaction; with the inline
+# job executor run `flask purge-users` from cron to finish them. See accounts.py
+app.config['ACCOUNT_PURGE_BATCH'] = int(
+    os.environ.get('ACCOUNT_PURGE_BATCH', accounts.DEFAULT_BATCH_SIZE))
+app.config['EXPOSE_STATS'] = os.environ.get('EXPOSE_STATS') == '1'
+# Per-request SQL/template/bcrypt timings for /metrics, plus warnings for
+# slow requests and repeated statements (N+1); see metrics.py
+app.config['METRICS'] = os.environ.get('METRICS', '1') == '1'
+app.config['SLOW_REQUEST_MS'] = int(
+    os.environ.get('SLOW_REQUEST_MS', metrics.DEFAULT_SLOW_MS))
+app.config['REPEATED_STATEMENT_LIMIT'] = int(
+    os.environ.get('REPEATED_STATEMENT_LIMIT', metrics.DEFAULT_REPEAT_LIMIT))
+
+# Password hashing runs in a process pool; see hashing.py. Tests and dev can
+# set a low BCRYPT_LOG_ROUNDS (min 4) and HASHING_WORKERS=0 to hash inline.
+app.config['BCRYPT_LOG_ROUNDS'] = int(
+    os.environ.get('BCRYPT_LOG_ROUNDS', hashing.DEFAULT_ROUNDS))
+app.config['HASHING_WORKERS'] = int(
+    os.environ.get('HASHING_WORKERS', os.cpu_count() or 1))
+app.config['HASHING_MAX_PENDING'] = int(
+    os.environ.get('HASHING_MAX_PENDING', hashing.DEFAULT_MAX_PENDING))
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+migrate = Migrate(app, db)
+metrics.configure(app.config['METRICS'],
+                  app.config['SLOW_REQUEST_MS'],
+                  app.config['REPEATED_STATEMENT_LIMIT'])
+app.before_request(metrics.start_request)
+app.teardown_request(metrics.finish_request)
+routing.configure(app.config['READ_REPLICAS'],
+                  app.config['REPLICA_STICKY_SECONDS'])
+app.before_request(routing.route_request)
+app.register_blueprint(api.api)
+partitions.configure(app.config['MESSAGE_PARTITIONS'])
+user_cache.configure(app.config['USER_CACHE_SIZE'],
+                     app.config['USER_CACHE_TTL'])
+fragments.configure(app.config['FRAGMENT_CACHE_SIZE'])
+app.add_template_global(fragments.message_item)
+app.add_template_global(fragments.user_card)
+hashing.configure(app.config['HASHING_WORKERS'],
+                  app.config['HASHING_MAX_PENDING'],
+                  app.config['BCRYPT_LOG_ROUNDS'])
+trending.configure(app.config['TRENDING'],
+                   app.config['TRENDING_BUCKET_SECONDS'],
+                   app.config['TRENDING_WINDOW_BUCKETS'],
+                   app.config['TRENDING_INTERVAL'])
+app.add_template_filter(tags.linkify)
+jobs.configure(app.config['JOBS_EXECUTOR'],
+               app.config['JOBS_MAX_ATTEMPTS'],
+               app.config['JOBS_BACKOFF'],
+               app.config['JOBS_LEASE_SECONDS'])
+accounts.configure(app.config['ACCOUNT_PURGE_BATCH'])
+writes.configure(app.config['WRITE_BUFFER'],
+                 app.config['WRITE_BUFFER_INTERVAL'],
+                 app.config['WRITE_BUFFER_SIZE'])
 
 
 ##############################################################################
@@ -31,15 +180,44 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    Nothing is loaded until a view or template reads from g.user, and most
+    reads are served from user_cache.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = user_cache.CurrentUser(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def following_status(user_ids):
+    """Map `user_ids` to whether the logged-in user follows each of them.
+
+    Answers are cached on `g` for the rest of the request, so a view can
+    prime the cache with one bulk query for every card on the page and
+    templates then call `is_following()` per card for free.
+    """
+
+    if not g.user:
+        return {user_id: False for user_id in user_ids}
+
+    known = g.setdefault('following_status', {})
+    missing = [user_id for user_id in user_ids if user_id not in known]
+    known.update(g.user.following_status(missing))
+
+    return {user_id: known[user_id] for user_id in user_ids}
+
+
+@app.template_global()
+def is_following(user):
+    """Does the logged-in user follow `user`? (see `following_status`)"""
+
+    return following_status([user.id])[user.id]
+
+
 def do_login(user):
     """Log in user."""
 
@@ -76,6 +254,7 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            user_cache.invalidate(user.id)
 
         except IntegrityError:
             flash("Username already taken or email is registered", 'danger')
@@ -100,6 +279,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves a rehashed password, if authenticate() made one
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -122,48 +303,102 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@routing.read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Takes 'before'/'after' cursors to page through the listing. A 'q' param
+    (old search links) is sent on to /search.
     """
 
-    search = request.args.get('q')
+    if request.args.get('q'):
+        return redirect(url_for('site_search', q=request.args['q']))
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    page = pagination.paginate_users(
+        User.visible(),
+        before=pagination.parse_user_cursor(request.args.get('before')),
+        after=pagination.parse_user_cursor(request.args.get('after')))
+
+    following_status([u.id for u in page.items])
+    return render_template('users/index.html', users=page.items, page=page)
+
+
+@app.route('/users/suggested')
+@routing.read_only
+def suggested_users():
+    """Who to follow: users followed by people the current user follows
+    (see suggestions.py)."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template('users/suggested.html',
+                           suggestions=suggestions.for_user(g.user.id))
+
+
+@app.route('/search')
+def site_search():
+    """Search users and warbles.
+
+    Takes a 'q' param to search for and an optional 'page' number.
+    """
 
-    return render_template('users/index.html', users=users)
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+
+    if not q:
+        return render_template('search.html', q=q, users=None, messages=None)
+
+    users = search.search_users(q, page)
+    messages = search.search_messages(q, page)
+    following_status([u.id for u in users.items])
+
+    return render_template('search.html', q=q, users=users, messages=messages)
 
 
 @app.route('/users/<int:user_id>')
+@http_cache.public(max_age=60)
+@routing.read_only
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.visible().filter_by(id=user_id).first_or_404()
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages, likes_count=len(user.likes))
+    page = pagination.paginate_messages(
+        Message.query.filter(Message.user_id == user_id),
+        before=pagination.parse_message_cursor(request.args.get('before')),
+        after=pagination.parse_message_cursor(request.args.get('after')))
+
+    http_cache.check_etag(
+        'user', user.id, user.profile_version, user.location,
+        user.messages_count, user.following_count, user.followers_count,
+        user.likes_count, [m.id for m in page.items], page.before, page.after,
+        g.user and following_status([user.id])[user.id])
+
+    return render_template('users/show.html', user=user, messages=page.items, page=page)
 
 @app.route('/users/likes')
+@routing.read_only
 def users_likes():
-    """Display all the messages that the user liked"""
+    """Display the messages the user liked, most recently liked first."""
 
-    m_id=[l.id for l in g.user.likes]
-    
-    m=Message.query.filter(Message.id.in_(m_id)).all()
-    return render_template('messages/liked.html',messages=m)
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    page = social.liked_page(
+        g.user.id,
+        before=pagination.parse_message_cursor(request.args.get('before')),
+        after=pagination.parse_message_cursor(request.args.get('after')))
+
+    return render_template('messages/liked.html', messages=page.items,
+                           page=page)
 
 @app.route('/users/<int:user_id>/following')
+@routing.read_only
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -171,11 +406,19 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.visible().filter_by(id=user_id).first_or_404()
+    following = (User
+                 .visible()
+                 .join(Follows, Follows.user_being_followed_id == User.id)
+                 .filter(Follows.user_following_id == user_id)
+                 .all())
+    following_status([user.id] + [u.id for u in following])
+    return render_template('users/following.html', user=user,
+                           following=following)
 
 
 @app.route('/users/<int:user_id>/followers')
+@routing.read_only
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -183,8 +426,15 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.visible().filter_by(id=user_id).first_or_404()
+    followers = (User
+                 .visible()
+                 .join(Follows, Follows.user_following_id == User.id)
+                 .filter(Follows.user_being_followed_id == user_id)
+                 .all())
+    following_status([user.id] + [u.id for u in followers])
+    return render_template('users/followers.html', user=user,
+                           followers=followers)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -195,9 +445,9 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    followed_user = User.visible().filter_by(id=follow_id).first_or_404()
+
+    writes.follow(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -210,9 +460,7 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    writes.unfollow(g.user.id, follow_id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -235,8 +483,11 @@ def profile():
             g.user.image_url=form.image_url.data or g.user.image_url.default.arg
             g.user.header_image_url=form.header_image_url.data or g.user.header_image_url.default.arg
             g.user.bio=form.bio.data
-            db.session.add(g.user)
+            g.user.profile_version=User.profile_version + 1
+            db.session.add(g.user.model)
             db.session.commit()
+            user_cache.invalidate(g.user.id)
+            fragments.invalidate_user(g.user.id)
             flash("Profile updated!", "success")
             return redirect(f'/users/{g.user.id}')
         else:
@@ -248,19 +499,9 @@ def profile():
 @app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def like_warble(message_id):
     """Liking and unliking a warble"""
-    # determine if they are liking or unliking
-    l=Likes.query.filter(Likes.user_id==g.user.id, Likes.message_id==message_id).first()
-    if l:
-        # already liked, so we have to unlike
-        # remove the like
-        db.session.delete(l)
-        db.session.commit()
-    else:
-        # not yet liked so we like it
-        like=Likes(user_id=g.user.id, message_id=message_id)
-        db.session.add(like)
-        db.session.commit()
-    
+    # likes if not yet liked, unlikes if already liked
+    writes.toggle_like(g.user.id, message_id)
+
     if request.referrer.find('/users/likes'):
         return redirect('/users/likes')
     else:
@@ -275,8 +516,10 @@ def delete_user():
         return redirect("/")
 
     do_logout()
-    db.session.delete(g.user)
+    accounts.delete(g.user.id)
     db.session.commit()
+    user_cache.invalidate(g.user.id)
+    fragments.invalidate_user(g.user.id)
 
     return redirect("/signup")
 
@@ -298,8 +541,12 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.adjust_user(g.user.id, messages_count=1)
+        timeline.fan_out(msg)
+        tags.add(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -308,13 +555,61 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@http_cache.public(max_age=300)
+@routing.read_only
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.visible().filter(Message.id == message_id).first_or_404()
+
+    http_cache.check_etag(
+        'message', msg.id, msg.user.profile_version,
+        g.user and following_status([msg.user_id])[msg.user_id])
+
     return render_template('messages/show.html', message=msg)
 
 
+##############################################################################
+# Trending and tags
+
+
+@app.route('/trending')
+@http_cache.public(max_age=60)
+@routing.read_only
+def trending_page():
+    """Most used tags and most liked warbles lately (see trending.py)."""
+
+    ranked = trending.rankings()
+
+    ids = [message_id for message_id, count in ranked.messages]
+    found = ({msg.id: msg for msg in
+              Message.visible().filter(Message.id.in_(ids))} if ids else {})
+
+    return render_template(
+        'trending.html', hours=trending.window_hours(), tags=ranked.tags,
+        messages=[(found[message_id], count)
+                  for message_id, count in ranked.messages
+                  if message_id in found])
+
+
+@app.route('/tags/<tag>')
+@http_cache.public(max_age=60)
+@routing.read_only
+def tag_page(tag):
+    """Messages with a hashtag (`/tags/python`) or a mention
+    (`/tags/@alice`), newest first."""
+
+    tag = tags.normalize(tag)
+    page = tags.paginate(
+        tag,
+        before=pagination.parse_message_cursor(request.args.get('before')),
+        after=pagination.parse_message_cursor(request.args.get('after')))
+
+    return render_template('tags/show.html', tag=tag, messages=page.items,
+                           page=page, count=trending.tag_count(tag),
+                           hours=trending.window_hours())
+
+
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
@@ -324,55 +619,226 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    counters.message_deleted(msg)
     db.session.delete(msg)
     db.session.commit()
+    fragments.invalidate_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+##############################################################################
+# Maintenance commands (run with `flask <command>`)
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute message/follow/like counters from the source tables."""
+
+    counters.reconcile()
+    db.session.commit()
+    click.echo("Counters reconciled.")
+
+
+@app.cli.command('load-csvs')
+@click.argument('directory', default='generator')
+@click.option('--chunk-size', default=loader.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Rows per COPY / insert batch.")
+def load_csvs(directory, chunk_size):
+    """Bulk load users.csv, messages.csv and follows.csv from DIRECTORY."""
+
+    loader.load_csvs(directory, chunk_size, report=click.echo)
+
+
+@app.cli.command('create-partitions')
+@click.option('--ahead', default=partitions.DEFAULT_MONTHS_AHEAD,
+              show_default=True, help="Months past this one to create.")
+def create_partitions(ahead):
+    """Create message partitions for this month and the next few."""
+
+    for name in partitions.create_ahead(ahead):
+        click.echo(name)
+
+
+@app.cli.command('archive-messages')
+@click.option('--older-than', default=12, show_default=True,
+              help="Archive partitions at least this many months old.")
+@click.option('--tablespace',
+              help="Move them here (e.g. on compressed storage); they stay "
+                   "readable.")
+@click.option('--export', 'directory', type=click.Path(file_okay=False),
+              help="Write them to DIRECTORY as .csv.gz and drop them.")
+def archive_messages(older_than, tablespace, directory):
+    """Move or export cold monthly message partitions."""
+
+    if not partitions.enabled:
+        raise click.UsageError("message partitions are not enabled "
+                               "(MESSAGE_PARTITIONS=1)")
+    if bool(tablespace) == bool(directory):
+        raise click.UsageError("give exactly one of --tablespace, --export")
+
+    archived = partitions.archive(older_than, tablespace, directory,
+                                  report=click.echo)
+
+    if directory and archived:
+        counters.reconcile()
+        db.session.commit()
+        search.fallback.reset()
+        user_cache.clear()
+        fragments.clear()
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every materialized home timeline."""
+
+    timeline.rebuild()
+    db.session.commit()
+    click.echo("Timelines rebuilt.")
+
+
+@app.cli.command('rebuild-suggestions')
+@click.option('--top-k', default=suggestions.DEFAULT_TOP_K,
+              help="Suggestions kept per user.")
+def rebuild_suggestions(top_k):
+    """Recompute every user's follow suggestions (run nightly)."""
+
+    rows = suggestions.rebuild(top_k)
+    db.session.commit()
+    click.echo(f"{rows} suggestions written.")
+
+
+@app.cli.command('rebuild-tags')
+def rebuild_tags():
+    """Re-extract hashtags and mentions from every message."""
+
+    rows = tags.rebuild(report=click.echo)
+    db.session.commit()
+    click.echo(f"{rows} tags written.")
+
+
+@app.cli.command('purge-users')
+def purge_users():
+    """Finish purging deleted accounts (if their jobs were lost)."""
+
+    for user_id in accounts.deleted_user_ids():
+        batches = accounts.purge(user_id)
+        click.echo(f"user {user_id} purged in {batches} batches.")
+
+
+@app.cli.command('jobs-worker')
+@click.option('--concurrency', default=1, show_default=True,
+              help="Jobs run at once (threads).")
+@click.option('--poll', default=jobs.DEFAULT_POLL, show_default=True,
+              help="Seconds to sleep when nothing is due.")
+@click.option('--burst', is_flag=True,
+              help="Exit once nothing is due instead of waiting.")
+def jobs_worker(concurrency, poll, burst):
+    """Run queued background jobs until stopped (SIGTERM/Ctrl-C)."""
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: stop.set())
+
+    ran = jobs.work(app, concurrency, poll, burst, stop)
+    click.echo(f"{ran} jobs run.")
+
+
+@app.cli.command('jobs-prune')
+@click.option('--older-than', default=7, show_default=True,
+              help="Delete jobs finished at least this many days ago.")
+def jobs_prune(older_than):
+    """Delete old finished and failed jobs (and forget their keys)."""
+
+    pruned = jobs.prune(older_than)
+    db.session.commit()
+    click.echo(f"{pruned} jobs deleted.")
+
+
+##############################################################################
+# Operational stats (only served when EXPOSE_STATS=1)
+
+
+@app.route('/stats/user-cache')
+def user_cache_stats():
+    """Hit/miss counters for this process's user snapshot cache."""
+
+    if not app.config['EXPOSE_STATS']:
+        abort(404)
+
+    return jsonify(user_cache.stats())
+
+
+@app.route('/stats/fragment-cache')
+def fragment_cache_stats():
+    """Hit/miss counters for this process's rendered-fragment cache."""
+
+    if not app.config['EXPOSE_STATS']:
+        abort(404)
+
+    return jsonify(fragments.stats())
+
+
+@app.route('/metrics')
+def metrics_page():
+    """Request histograms and cache stats in the Prometheus text format."""
+
+    if not app.config['EXPOSE_STATS']:
+        abort(404)
+
+    text = (metrics.render()
+            + metrics.render_gauges('warbler_user_cache', user_cache.stats())
+            + metrics.render_gauges('warbler_fragment_cache',
+                                    fragments.stats()))
+    if writes.buffer is not None:
+        text += metrics.render_gauges('warbler_write_buffer',
+                                      writes.buffer.stats())
+    if jobs.executor == jobs.QUEUE:
+        text += metrics.render_gauges('warbler_jobs', jobs.stats())
+
+    return text, 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
 ##############################################################################
 # Homepage and error pages
 
 
 @app.route('/')
+@routing.read_only
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, paged with
+      'before'/'after' cursors
     """
 
     if g.user:
-        # get the id of users the logged in user is following
-        following=[u.id for u in g.user.following]
-        messages = (Message
-                    .query
-                    .filter((Message.user_id==g.user.id)|Message.user_id.in_(following))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # read the precomputed feed; see timeline.py
+        page = timeline.home_timeline(
+            g.user.id,
+            before=pagination.parse_message_cursor(request.args.get('before')),
+            after=pagination.parse_message_cursor(request.args.get('after')))
 
-        like_ids=[l.id for l in g.user.likes]
+        like_ids = social.liked_ids(g.user.id, [m.id for m in page.items])
 
-        return render_template('home.html', messages=messages, likes=like_ids)
+        return render_template('home.html', messages=page.items, page=page, likes=like_ids)
 
     else:
         return render_template('home-anon.html')
 
 
+@app.errorhandler(hashing.HashingBusy)
+def hashing_busy(e):
+    """Too many logins/signups already waiting on bcrypt: shed this one."""
+
+    return ("Too many requests right now; please try again shortly.", 429,
+            {'Retry-After': '1'})
+
+
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# HTTP caching: per-route Cache-Control, ETags and fingerprinted static URLs
+# (see http_cache.py)
+
+app.url_defaults(http_cache.add_fingerprint)
+app.after_request(http_cache.apply_policy)
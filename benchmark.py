@@ -0,0 +1,851 @@
+"""Load-test and benchmark the core Warbler routes.
+
+Seeds a dataset with the CSV generator (generator/create_csvs.py) and the
+bulk loader, then drives the login, home, profile, user list, like, follow and
+new message routes and reports p50/p95/p99 latency, throughput and queries per
+request for each:
+
+    python benchmark.py run --users 10000 --messages 100000 \\
+        --follows 500000 --requests 500 --concurrency 8 --out before.json
+    python benchmark.py compare before.json after.json
+
+Two drivers are run by default:
+
+- `client`: one virtual user after another through the Flask test client,
+  in-process. Cheapest per request, so it shows the cost of the view and
+  its queries on their own.
+- `http`: `--concurrency` virtual users, each with its own cookie session,
+  hitting a threaded server started in-process (or `--url`, an already
+  running server using the same database). This is the one to watch for
+  lock contention and pool exhaustion.
+
+Queries per request are counted on `db.engine` while each scenario runs, so
+they are only known when the app runs in this process.
+
+`run` and `servers` DROP AND RECREATE every table of `DATABASE_URL` unless
+`--no-seed` is given, so it defaults to its own `warbler-bench` database. All seeded
+users get the password `BENCH_PASSWORD`.
+
+`servers` runs serve.py once per mode (`threads`, a fixed pool of request
+threads, and `gevent`, a greenlet per connection) and drives the routes
+that mostly wait on the database with `--concurrency` virtual users while
+`--slow-clients` other connections trickle their requests in, so both
+modes see the same load:
+
+    python benchmark.py servers --no-seed --concurrency 100 \\
+        --slow-clients 300 --threads 16 --db-latency 5 --out servers.json
+
+`--db-latency` adds that many milliseconds to every statement, for a
+local database to behave like one across a network.
+
+`deletes` adds users with more and more messages (plus 200 followers,
+likes, and the messages in every follower's feed) and deletes them,
+batched by accounts.py (`purge`) or with one cascading DELETE
+(`cascade`), reporting the time, peak Python memory and longest
+transaction of each; the purge's memory and longest transaction should
+stay flat as the sizes grow:
+
+    python benchmark.py deletes --sizes 1000,10000,50000
+
+`compare` prints old -> new for each scenario and exits with status 1 if
+p95 latency or throughput got worse by more than `--threshold` or any page
+now issues more queries, so it can gate a release.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-bench")
+
+from sqlalchemy import func
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from app import app, CURR_USER_KEY
+from models import db, User, Message, Follows, Likes, TimelineEntry
+from query_counter import QueryCounter
+import accounts
+import counters
+import hashing
+import loader
+import serve
+
+BENCH_PASSWORD = 'benchmark'
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GENERATOR = os.path.join(HERE, 'generator', 'create_csvs.py')
+SERVE = os.path.join(HERE, 'serve.py')
+
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+##############################################################################
+# Dataset
+
+
+def seed_dataset(users, messages, follows, seed='warbler', report=print):
+    """Generate a snapshot of the given size and load it into a fresh
+    database."""
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, GENERATOR,
+                        '--users', str(users), '--messages', str(messages),
+                        '--follows', str(follows), '--seed', seed,
+                        '--out', directory], check=True)
+
+        db.drop_all()
+        db.create_all()
+        loader.load_csvs(directory, report=report)
+
+    # the generated hash is for an unknown password; logins need a real one
+    User.query.update(
+        {'password': hashing.generate_password_hash(BENCH_PASSWORD)},
+        synchronize_session=False)
+    db.session.commit()
+
+
+class Dataset:
+    """Ids to aim requests at, drawn from what is in the database."""
+
+    def __init__(self, seed='warbler'):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.max_user_id = db.session.query(func.max(User.id)).scalar()
+        self.max_message_id = db.session.query(func.max(Message.id)).scalar()
+        if not self.max_user_id or not self.max_message_id:
+            raise SystemExit("no users or messages: run without --no-seed")
+
+    def counts(self):
+        return {
+            'users': User.query.count(),
+            'messages': Message.query.count(),
+            'follows': db.session.execute(
+                "SELECT count(*) FROM follows").scalar(),
+        }
+
+    def viewers(self, n):
+        """`n` distinct users to log in as."""
+
+        ids = [u for u, in db.session.query(User.id)
+               .order_by(User.id).limit(max(n * 10, 100))]
+        picked = self.rng.sample(ids, min(n, len(ids)))
+        return [(user_id, username) for user_id, username in
+                db.session.query(User.id, User.username)
+                .filter(User.id.in_(picked)).order_by(User.id)]
+
+    def user_id(self):
+        with self.lock:
+            return self.rng.randint(1, self.max_user_id)
+
+    def message_id(self):
+        with self.lock:
+            return self.rng.randint(1, self.max_message_id)
+
+    def flip(self):
+        with self.lock:
+            return self.rng.random() < 0.5
+
+
+##############################################################################
+# Scenarios
+#
+# Each returns (method, path, form data) for one request by `viewer`, a
+# (user id, username) pair.
+
+
+def login(data, viewer):
+    return 'POST', '/login', {'username': viewer[1],
+                              'password': BENCH_PASSWORD}
+
+
+def homepage(data, viewer):
+    return 'GET', '/', None
+
+
+def users_show(data, viewer):
+    return 'GET', f"/users/{data.user_id()}", None
+
+
+def list_users(data, viewer):
+    return 'GET', '/users', None
+
+
+def like_warble(data, viewer):
+    return 'POST', f"/users/add_like/{data.message_id()}", {}
+
+
+def follow_toggle(data, viewer):
+    action = 'follow' if data.flip() else 'stop-following'
+    followed = data.user_id()
+    if followed == viewer[0]:
+        # the site never offers to follow yourself
+        followed = followed % data.max_user_id + 1
+    return 'POST', f"/users/{action}/{followed}", {}
+
+
+def messages_add(data, viewer):
+    return 'POST', '/messages/new', {'text': f"benchmark warble {time.time()}"}
+
+
+SCENARIOS = {
+    'login': login,
+    'homepage': homepage,
+    'users_show': users_show,
+    'list_users': list_users,
+    'like_warble': like_warble,
+    'follow_toggle': follow_toggle,
+    'messages_add': messages_add,
+}
+
+# the routes that mostly wait on the database, for `servers`
+IO_BOUND = ['homepage', 'users_show', 'list_users', 'like_warble',
+            'follow_toggle']
+
+
+##############################################################################
+# Drivers
+
+
+class ClientDriver:
+    """Sequential requests through the Flask test client."""
+
+    name = 'client'
+    counts_queries = True
+
+    def __init__(self, viewers):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.sessions = []
+        for user_id, username in viewers:
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            self.sessions.append(((user_id, username), client))
+
+    def run(self, scenario, data, requests):
+        """Returns (latencies in seconds, errors, wall time)."""
+
+        latencies, errors = [], 0
+        start = time.perf_counter()
+
+        for i in range(requests):
+            viewer, client = self.sessions[i % len(self.sessions)]
+            method, path, form = scenario(data, viewer)
+
+            began = time.perf_counter()
+            res = client.open(path, method=method, data=form,
+                              headers={'Referer': '/'})
+            latencies.append(time.perf_counter() - began)
+            errors += res.status_code >= 400
+
+        return latencies, errors, time.perf_counter() - start
+
+    def close(self):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+
+class HTTPSession:
+    """One virtual user: a cookie jar and the CSRF token for its session."""
+
+    def __init__(self, base_url, viewer):
+        self.base_url = base_url
+        self.viewer = viewer
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect())
+
+        status, body = self.open('GET', '/login')
+        match = CSRF_INPUT.search(body)
+        self.csrf_token = match.group(1) if match else ''
+
+        self.open(*login(None, viewer))
+
+    def open(self, method, path, form=None):
+        """Returns (status, body)."""
+
+        body = None
+        if method == 'POST':
+            body = urllib.parse.urlencode(
+                dict(form or {}, csrf_token=self.csrf_token)).encode()
+
+        request = urllib.request.Request(self.base_url + path, data=body,
+                                         method=method,
+                                         headers={'Referer': '/'})
+        try:
+            with self.opener.open(request) as res:
+                return res.status, res.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, ''
+
+
+class HTTPDriver:
+    """Concurrent virtual users over real HTTP."""
+
+    name = 'http'
+
+    def __init__(self, viewers, url=None):
+        self.server = None
+        self.counts_queries = url is None
+
+        if url is None:
+            app.config['WTF_CSRF_ENABLED'] = False
+            self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                      request_handler=_QuietHandler)
+            threading.Thread(target=self.server.serve_forever,
+                             daemon=True).start()
+            url = f"http://127.0.0.1:{self.server.server_port}"
+
+        self.sessions = [HTTPSession(url.rstrip('/'), viewer)
+                         for viewer in viewers]
+
+    def _worker(self, session, scenario, data, requests):
+        latencies, errors = [], 0
+        for i in range(requests):
+            method, path, form = scenario(data, session.viewer)
+            began = time.perf_counter()
+            status, body = session.open(method, path, form)
+            latencies.append(time.perf_counter() - began)
+            errors += status >= 400
+        return latencies, errors
+
+    def run(self, scenario, data, requests):
+        """Returns (latencies in seconds, errors, wall time)."""
+
+        n = len(self.sessions)
+        shares = [requests // n + (i < requests % n) for i in range(n)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(n) as pool:
+            results = list(pool.map(
+                lambda args: self._worker(args[0], scenario, data, args[1]),
+                zip(self.sessions, shares)))
+        wall = time.perf_counter() - start
+
+        latencies = [t for ts, errors in results for t in ts]
+        return latencies, sum(errors for ts, errors in results), wall
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+##############################################################################
+# Measuring
+
+
+def percentile(values, p):
+    """Nearest-rank percentile `p` (0-100) of `values`."""
+
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def measure(driver, scenario, data, requests, warmup=10):
+    """Run `scenario` on `driver`; returns its stats."""
+
+    if warmup:
+        driver.run(scenario, data, warmup)
+
+    with QueryCounter() as counter:
+        latencies, errors, wall = driver.run(scenario, data, requests)
+
+    ms = [t * 1000 for t in latencies]
+    return {
+        'requests': len(ms),
+        'errors': errors,
+        'p50_ms': round(percentile(ms, 50), 3),
+        'p95_ms': round(percentile(ms, 95), 3),
+        'p99_ms': round(percentile(ms, 99), 3),
+        'mean_ms': round(sum(ms) / len(ms), 3),
+        'throughput_rps': round(len(ms) / wall, 1) if wall else None,
+        'queries_per_request': (round(counter.count / len(ms), 2)
+                                if driver.counts_queries else None),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              cwd=HERE).stdout.strip()
+    except OSError:
+        return None
+
+
+def bench(driver, name, scenarios, data, requests, warmup=10, report=print):
+    """Measure each of `scenarios` on `driver`; returns {scenario: stats}."""
+
+    results = {}
+    for scenario in scenarios:
+        stats = measure(driver, SCENARIOS[scenario], data, requests, warmup)
+        results[scenario] = stats
+        report(f"{name:7} {scenario:13} p50 {stats['p50_ms']:8.1f}ms"
+               f"  p95 {stats['p95_ms']:8.1f}ms"
+               f"  p99 {stats['p99_ms']:8.1f}ms"
+               f"  {stats['throughput_rps']:8.1f} req/s"
+               f"  {stats['queries_per_request']} queries"
+               f"  {stats['errors']} errors")
+    return results
+
+
+def _meta(data, requests, concurrency, warmup, url=None):
+    return {
+        'started': datetime.utcnow().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'database': db.engine.dialect.name,
+        'dataset': data.counts(),
+        'requests': requests,
+        'concurrency': concurrency,
+        'warmup': warmup,
+        'url': url,
+    }
+
+
+def run(drivers, scenarios, requests, concurrency, warmup=10, url=None,
+        seed='warbler', report=print):
+    """Benchmark `scenarios` on each of `drivers`; returns the report."""
+
+    data = Dataset(seed)
+    viewers = data.viewers(concurrency)
+    results = {}
+
+    for name in drivers:
+        if name == 'client':
+            driver = ClientDriver(viewers)
+        else:
+            driver = HTTPDriver(viewers, url)
+
+        try:
+            results[name] = bench(driver, name, scenarios, data, requests,
+                                  warmup, report)
+        finally:
+            driver.close()
+            db.session.remove()
+
+    return {
+        'meta': _meta(data, requests, len(viewers), warmup, url),
+        'results': results,
+    }
+
+
+##############################################################################
+# Thread-per-request vs gevent
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """serve.py in a subprocess, on the same database as we are."""
+
+    def __init__(self, mode, threads=serve.DEFAULT_THREADS,
+                 connections=serve.DEFAULT_CONNECTIONS, db_latency=0,
+                 timeout=30):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen([
+            sys.executable, SERVE, '--mode', mode, '--port', str(self.port),
+            '--threads', str(threads), '--connections', str(connections),
+            '--db-latency', str(db_latency), '--quiet',
+        ])
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"serve.py --mode {mode} exited "
+                                   f"with {self.process.returncode}")
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise RuntimeError(f"serve.py --mode {mode} did not "
+                                       f"start within {timeout}s")
+                time.sleep(0.1)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+class SlowClients:
+    """Connections that take `seconds` to send each request (a header line
+    at a time) before reading the response, over and over.
+
+    Each one ties up a request thread of a thread-per-request server for
+    the whole time; under gevent it is an idle greenlet.
+    """
+
+    def __init__(self, url, n, seconds=2.0):
+        parsed = urllib.parse.urlsplit(url)
+        self.address = (parsed.hostname, parsed.port)
+        self.seconds = seconds
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self._client, daemon=True)
+                        for i in range(n)]
+        for thread in self.threads:
+            thread.start()
+
+    def _client(self):
+        lines = [b"GET /login HTTP/1.0\r\n", b"Host: localhost\r\n",
+                 b"User-Agent: slow-client\r\n", b"Accept: */*\r\n"]
+        while not self.stopping.is_set():
+            try:
+                with socket.create_connection(self.address) as sock:
+                    for line in lines:
+                        sock.sendall(line)
+                        self.stopping.wait(self.seconds / len(lines))
+                    sock.sendall(b"\r\n")
+                    while sock.recv(65536):
+                        pass
+            except OSError:
+                self.stopping.wait(0.1)
+
+    def close(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_servers(modes, scenarios, requests, concurrency, warmup=10,
+                threads=serve.DEFAULT_THREADS,
+                connections=serve.DEFAULT_CONNECTIONS, slow_clients=0,
+                slow_seconds=2.0, db_latency=0, seed='warbler',
+                report=print):
+    """Benchmark `scenarios` against serve.py in each of `modes`, under the
+    same load; returns the report, with a result per mode."""
+
+    data = Dataset(seed)
+    viewers = data.viewers(concurrency)
+    results = {}
+
+    for mode in modes:
+        server = Server(mode, threads, connections, db_latency)
+        try:
+            driver = HTTPDriver(viewers, server.url)
+            slow = SlowClients(server.url, slow_clients, slow_seconds)
+            try:
+                results[mode] = bench(driver, mode, scenarios, data,
+                                      requests, warmup, report)
+            finally:
+                slow.close()
+        finally:
+            server.close()
+
+    meta = _meta(data, requests, len(viewers), warmup)
+    meta.update(threads=threads, connections=connections,
+                slow_clients=slow_clients, slow_seconds=slow_seconds,
+                db_latency_ms=db_latency)
+    return {'meta': meta, 'results': results}
+
+
+##############################################################################
+# Account deletion
+
+DELETE_METHODS = ['purge', 'cascade']
+
+# every message lands in this many feeds, so the feed rows (not the
+# messages) are most of what a purge deletes
+DELETE_FOLLOWERS = 200
+
+
+def make_prolific_user(messages, followers, name, chunk_size=10000):
+    """Add a user with `messages` messages, each liked by one of
+    `followers` new users who follow them (and are followed back) and have
+    every message in their feeds; returns the user's and followers' ids."""
+
+    users = User.__table__
+    now = datetime.utcnow()
+    ids = []
+    for i in range(followers + 1):
+        ids.append(db.session.execute(users.insert().values(
+            username=f"{name}-{i}", email=f"{name}-{i}@bench.test",
+            password='x')).inserted_primary_key[0])
+    user_id, follower_ids = ids[0], ids[1:]
+
+    db.session.execute(Follows.__table__.insert(), [
+        dict(user_being_followed_id=a, user_following_id=b)
+        for f in follower_ids for a, b in ((user_id, f), (f, user_id))])
+
+    first = (db.session.query(func.max(Message.id)).scalar() or 0) + 1
+    for start in range(0, messages, chunk_size):
+        rows = [dict(id=first + i, text=f"prolific {i}", user_id=user_id,
+                     timestamp=now - timedelta(minutes=i))
+                for i in range(start, min(start + chunk_size, messages))]
+        db.session.execute(Message.__table__.insert(), rows)
+        if follower_ids:
+            db.session.execute(Likes.__table__.insert(), [
+                dict(user_id=follower_ids[row['id'] % len(follower_ids)],
+                     message_id=row['id']) for row in rows])
+        db.session.execute(TimelineEntry.__table__.insert(), [
+            dict(user_id=reader, message_id=row['id'], author_id=user_id,
+                 timestamp=row['timestamp'])
+            for row in rows for reader in [user_id] + follower_ids])
+        db.session.commit()
+
+    counters.reconcile()
+    db.session.commit()
+    return user_id, follower_ids
+
+
+def measure_delete(method, user_id, batch_size):
+    """Delete `user_id` with `method` (`purge`: accounts.purge_batch() until
+    done, committing each; `cascade`: one DELETE of the user row, leaving
+    the rest to the database's cascades); returns time and peak Python
+    memory."""
+
+    batches, longest = 0, 0.0
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    if method == 'purge':
+        done = False
+        while not done:
+            batch_started = time.perf_counter()
+            done = accounts.purge_batch(user_id, batch_size)
+            db.session.commit()
+            batches += 1
+            longest = max(longest, time.perf_counter() - batch_started)
+    else:
+        db.session.execute(User.__table__.delete().where(User.id == user_id))
+        db.session.commit()
+        batches = 1
+        longest = time.perf_counter() - started
+
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds': round(seconds, 3),
+        'peak_kb': round(peak / 1024, 1),
+        'batches': batches,
+        'longest_batch_ms': round(longest * 1000, 1),
+    }
+
+
+def run_deletes(sizes, methods=DELETE_METHODS, followers=DELETE_FOLLOWERS,
+                batch_size=accounts.DEFAULT_BATCH_SIZE, report=print):
+    """Time deleting users with each of `sizes` messages, by each of
+    `methods`; returns the report. Only touches the users it adds."""
+
+    results = {method: {} for method in methods}
+    for size in sizes:
+        for method in methods:
+            user_id, follower_ids = make_prolific_user(
+                size, followers, f"bench-delete-{method}-{size}-{time.time()}")
+            stats = measure_delete(method, user_id, batch_size)
+            db.session.execute(User.__table__.delete().where(
+                User.id.in_(follower_ids)))
+            db.session.commit()
+            db.session.remove()
+            results[method][str(size)] = stats
+            report(f"{method:7} {size:9} messages  {stats['seconds']:8.3f}s"
+                   f"  peak {stats['peak_kb']:10.1f}KB"
+                   f"  {stats['batches']:6} batches"
+                   f"  longest {stats['longest_batch_ms']:8.1f}ms")
+
+    return {
+        'meta': {
+            'started': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'database': db.engine.dialect.name,
+            'followers': followers,
+            'batch_size': batch_size,
+        },
+        'results': results,
+    }
+
+
+##############################################################################
+# Comparing runs
+
+# (stat, higher is worse)
+COMPARED = [
+    ('p50_ms', True),
+    ('p95_ms', True),
+    ('p99_ms', True),
+    ('throughput_rps', False),
+    ('queries_per_request', True),
+]
+
+
+def compare(old, new, threshold=0.2):
+    """Differences between two reports; returns (lines, regressions)."""
+
+    lines, regressions = [], []
+
+    for driver, scenarios in new['results'].items():
+        for scenario, stats in scenarios.items():
+            before = old['results'].get(driver, {}).get(scenario)
+            if before is None:
+                lines.append(f"{driver} {scenario}: new")
+                continue
+
+            for stat, higher_is_worse in COMPARED:
+                a, b = before.get(stat), stats.get(stat)
+                if a is None or b is None:
+                    continue
+
+                change = (b - a) / a if a else 0
+                worse = change if higher_is_worse else -change
+                lines.append(f"{driver} {scenario} {stat}: {a} -> {b} "
+                             f"({change:+.0%})")
+
+                # any extra query is a regression; timings get some slack
+                if stat == 'queries_per_request':
+                    regressed = b > a
+                elif stat in ('p95_ms', 'throughput_rps'):
+                    regressed = worse > threshold
+                else:
+                    regressed = False
+
+                if regressed:
+                    regressions.append(lines[-1])
+
+    return lines, regressions
+
+
+##############################################################################
+# Command line
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    dataset = argparse.ArgumentParser(add_help=False)
+    dataset.add_argument('--users', type=int, default=1000)
+    dataset.add_argument('--messages', type=int, default=10000)
+    dataset.add_argument('--follows', type=int, default=20000)
+    dataset.add_argument('--seed', default='warbler')
+    dataset.add_argument('--no-seed', action='store_true',
+                         help="benchmark the data already in the database")
+    dataset.add_argument('--requests', type=int, default=200,
+                         help="requests per scenario and driver")
+    dataset.add_argument('--warmup', type=int, default=10)
+    dataset.add_argument('--out', help="write the JSON report here")
+
+    bench = commands.add_parser('run', parents=[dataset],
+                                help="seed and benchmark")
+    bench.add_argument('--concurrency', type=int, default=4)
+    bench.add_argument('--drivers', default='client,http')
+    bench.add_argument('--scenarios', default=','.join(SCENARIOS))
+    bench.add_argument('--url', help="benchmark a running server instead")
+
+    servers = commands.add_parser(
+        'servers', parents=[dataset],
+        help="seed and compare serve.py's modes under the same load")
+    servers.add_argument('--modes', default=','.join(serve.MODES))
+    servers.add_argument('--scenarios', default=','.join(IO_BOUND))
+    servers.add_argument('--concurrency', type=int, default=50)
+    servers.add_argument('--threads', type=int, default=serve.DEFAULT_THREADS)
+    servers.add_argument('--connections', type=int,
+                         default=serve.DEFAULT_CONNECTIONS)
+    servers.add_argument('--slow-clients', type=int, default=200,
+                         help="connections sending requests slowly")
+    servers.add_argument('--slow-seconds', type=float, default=2.0,
+                         help="how long each slow request takes to send")
+    servers.add_argument('--db-latency', type=float, default=0,
+                         help="milliseconds to add to every SQL statement")
+
+    deletes = commands.add_parser(
+        'deletes', help="time deleting users with more and more messages")
+    deletes.add_argument('--sizes', default='1000,10000,50000',
+                         help="messages per deleted user")
+    deletes.add_argument('--methods', default=','.join(DELETE_METHODS))
+    deletes.add_argument('--followers', type=int, default=DELETE_FOLLOWERS)
+    deletes.add_argument('--batch-size', type=int,
+                         default=accounts.DEFAULT_BATCH_SIZE)
+    deletes.add_argument('--out', help="write the JSON report here")
+
+    diff = commands.add_parser('compare', help="compare two JSON reports")
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=0.2,
+                      help="allowed slowdown before failing (default 0.2)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+
+        lines, regressions = compare(old, new, args.threshold)
+        print('\n'.join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            print('\n'.join(regressions))
+            return 1
+        return 0
+
+    if args.command == 'deletes':
+        result = run_deletes([int(size) for size in args.sizes.split(',')],
+                             args.methods.split(','), args.followers,
+                             args.batch_size)
+    else:
+        scenarios = args.scenarios.split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise SystemExit(
+                f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+        if not args.no_seed:
+            seed_dataset(args.users, args.messages, args.follows, args.seed)
+
+        if args.command == 'servers':
+            result = run_servers(args.modes.split(','), scenarios,
+                                 args.requests, args.concurrency,
+                                 args.warmup, args.threads, args.connections,
+                                 args.slow_clients, args.slow_seconds,
+                                 args.db_latency, args.seed)
+        else:
+            result = run(args.drivers.split(','), scenarios, args.requests,
+                         args.concurrency, args.warmup, args.url, args.seed)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Denormalized counters for Warbler.
+
+`User.messages_count`, `following_count`, `followers_count`, `likes_count`
+and `Message.like_count` let stat blocks render without loading whole
+relationship collections. Views adjust them with `UPDATE ... SET n = n + 1`
+in the same transaction as the write they describe; `reconcile()` recomputes
+everything from the source tables to repair any drift.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, Likes
+import user_cache
+
+
+def adjust_user(user_id, **deltas):
+    """Add `deltas` (e.g. `messages_count=1`) to one user's counters."""
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+
+    (User
+     .query
+     .filter(User.id == user_id)
+     .update(values, synchronize_session=False))
+
+    user_cache.invalidate_on_commit(user_id)
+
+
+def adjust_users(user_ids, **deltas):
+    """Add `deltas` to the counters of every user in `user_ids`."""
+
+    values = {getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()}
+
+    (User
+     .query
+     .filter(User.id.in_(user_ids))
+     .update(values, synchronize_session=False))
+
+    for user_id in user_ids:
+        user_cache.invalidate_on_commit(user_id)
+
+
+def adjust_message_likes(message_id, delta):
+    """Add `delta` to a message's like count."""
+
+    (Message
+     .query
+     .filter(Message.id == message_id)
+     .update({Message.like_count: Message.like_count + delta},
+             synchronize_session=False))
+
+
+def message_deleted(message):
+    """Adjust counters for `message` and the likes that cascade with it."""
+
+    adjust_user(message.user_id, messages_count=-1)
+
+    likers = [row[0] for row in (db.session
+                                 .query(Likes.user_id)
+                                 .filter(Likes.message_id == message.id))]
+    if likers:
+        adjust_users(likers, likes_count=-1)
+
+
+def reconcile():
+    """Recompute every counter from the source tables in bulk."""
+
+    def count(column, where):
+        return (select([func.count()])
+                .select_from(column.table)
+                .where(where)
+                .as_scalar())
+
+    (User
+     .query
+     .update({
+         User.messages_count: count(Message.id, Message.user_id == User.id),
+         User.following_count: count(Follows.user_following_id,
+                                     Follows.user_following_id == User.id),
+         User.followers_count: count(Follows.user_being_followed_id,
+                                     Follows.user_being_followed_id == User.id),
+         User.likes_count: count(Likes.id, Likes.user_id == User.id),
+     }, synchronize_session=False))
+
+    (Message
+     .query
+     .update({Message.like_count: count(Likes.id,
+                                        Likes.message_id == Message.id)},
+             synchronize_session=False))
+
+    user_cache.clear()
@@ -0,0 +1,175 @@
+"""Cache of rendered HTML for message list items and user cards.
+
+A warble's text never changes after it is posted, and a user card only
+changes when its owner edits their profile, so the markup for both is
+rendered once per process and reused. Entries are keyed by message or user
+id and carry the author's `User.profile_version`; `profile()` bumps the
+version, so another process's stale copy is simply re-rendered on next use.
+
+Per-viewer parts (like and follow buttons) are never cached: templates pass
+them as the body of a call block, which is spliced into the cached markup
+at its `slot`::
+
+    {% call message_item(msg) %} ...like button... {% endcall %}
+"""
+
+import threading
+from collections import OrderedDict, defaultdict
+
+from flask import current_app
+from markupsafe import Markup
+from sqlalchemy import event
+
+from models import db, User, Message
+
+DEFAULT_MAXSIZE = 20000
+
+SLOT = Markup('<!-- slot -->')
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments, indexed by owning user."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.owned = defaultdict(set)
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, version):
+        """Cached fragment for `key` at `version`, or None on a miss."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[1] != version:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, owner, version, fragment):
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (owner, version, fragment)
+            self.owned[owner].add(key)
+
+            while len(self.entries) > self.maxsize:
+                self._pop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def invalidate_owner(self, owner):
+        """Drop every fragment belonging to user `owner`."""
+
+        with self.lock:
+            for key in list(self.owned.get(owner, ())):
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.owned[entry[0]]
+            keys.discard(key)
+            if not keys:
+                del self.owned[entry[0]]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.owned.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+            }
+
+
+cache = FragmentCache()
+
+
+def configure(maxsize):
+    """Resize the cache (from app config); drops anything cached."""
+
+    global cache
+    cache = FragmentCache(maxsize)
+
+
+def invalidate_message(message_id):
+    """Forget a deleted message's markup."""
+
+    cache.invalidate(('message', message_id))
+
+
+def invalidate_user(user_id):
+    """Forget a user's card and the markup of all their messages."""
+
+    cache.invalidate_owner(user_id)
+
+
+def clear():
+    cache.clear()
+
+
+def stats():
+    return cache.stats()
+
+
+def _render(key, owner, version, template, **context):
+    """Cached (head, tail) of `template`, split at its slot."""
+
+    parts = cache.get(key, version)
+    if parts is None:
+        html = (current_app
+                .jinja_env
+                .get_template(template)
+                .render(slot=SLOT, **context))
+        head, tail = html.split(SLOT, 1)
+        parts = (Markup(head), Markup(tail))
+        cache.set(key, owner, version, parts)
+    return parts
+
+
+def _splice(parts, caller):
+    head, tail = parts
+    return head + (caller() if caller else '') + tail
+
+
+def message_item(msg, caller=None):
+    """`<li>` for `msg` in a message list (template global)."""
+
+    parts = _render(('message', msg.id), msg.user_id,
+                    msg.user.profile_version, 'messages/item.html', msg=msg)
+    return _splice(parts, caller)
+
+
+def user_card(user, caller=None):
+    """Card for `user` in a user grid (template global)."""
+
+    parts = _render(('user', user.id), user.id, user.profile_version,
+                    'users/card.html', user=user)
+    return _splice(parts, caller)
+
+
+@event.listens_for(db.session, 'after_bulk_delete')
+def _clear_on_bulk_delete(delete_context):
+    if delete_context.mapper.class_ in (User, Message):
+        clear()
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    clear()
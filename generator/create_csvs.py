@@ -2,15 +2,39 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows, e.g. for load testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --workers 8 --out /tmp/snapshot
+
+Rows are generated in blocks of `--block-size`, each from its own RNG seeded
+by `--seed`, the file and the block number, so the output only depends on
+the seed and the sizes, never on how many `--workers` processes share the
+work. Each block is written to a part file and the parts are joined in
+order, so memory use stays at one block per worker. Nothing is fetched from
+the network.
+
+Popularity is skewed the way real social graphs are: users are ranked in a
+fixed shuffled order, and both whom people follow and who writes messages
+are drawn from a power law over that ranking (`--alpha`). How many people
+each user follows is drawn from a Pareto distribution (`--out-alpha`) and
+scaled so the total comes to `--follows` (a user capped at following
+everyone passes their excess on to the next). Follow pairs are never enumerated; each
+follower's picks are de-duplicated as they are drawn.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import shutil
+from datetime import datetime
+from math import gcd
+from multiprocessing import Pool
+
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import (get_random_datetime, power_law_rank, PROFILE_IMAGE_URLS,
+                     HEADER_IMAGE_URLS)
 
 MAX_WARBLER_LENGTH = 140
 
@@ -22,56 +46,178 @@ NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
 
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+BLOCK_SIZE = 10000
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+
+class Generator:
+    """Writes one block of one CSV at a time (picklable for the pool)."""
+
+    def __init__(self, args):
+        self.args = args
+        self.num_users = args.users
+        self.end = datetime.strptime(args.end, '%Y-%m-%d')
+
+        # rank -> user id: a fixed pseudo-random shuffle needing no memory
+        rng = random.Random(f"{args.seed}-ranking")
+        self.offset = rng.randrange(self.num_users)
+        self.stride = rng.randrange(1, self.num_users + 1)
+        while gcd(self.stride, self.num_users) != 1:
+            self.stride += 1
+
+    def rng(self, name, block):
+        return random.Random(f"{self.args.seed}-{name}-{block}")
+
+    def faker(self, name, block):
+        fake = Faker()
+        fake.seed_instance(f"{self.args.seed}-{name}-{block}-faker")
+        return fake
+
+    def popular_user(self, rng):
+        """A user id, with low ranks much likelier than high ones."""
+
+        rank = power_law_rank(rng, self.num_users, self.args.alpha)
+        return ((rank - 1) * self.stride + self.offset) % self.num_users + 1
+
+    def block_range(self, total, block):
+        start = block * self.args.block_size
+        return start, min(start + self.args.block_size, total)
+
+    def users(self, block):
+        rng, fake = self.rng('users', block), self.faker('users', block)
+        start, stop = self.block_range(self.num_users, block)
+
+        for user_id in range(start + 1, stop + 1):
+            # the id suffix keeps usernames and emails unique at any size
+            local, domain = fake.email().split('@')
+            yield dict(
+                email=f"{local}.{user_id}@{domain}",
+                username=f"{fake.user_name()}_{user_id}",
+                image_url=rng.choice(PROFILE_IMAGE_URLS),
+                password=PASSWORD,
+                bio=fake.sentence(),
+                header_image_url=rng.choice(HEADER_IMAGE_URLS),
+                location=fake.city()
+            )
+
+    def messages(self, block):
+        rng, fake = self.rng('messages', block), self.faker('messages', block)
+        start, stop = self.block_range(self.args.messages, block)
+
+        for i in range(start, stop):
+            yield dict(
+                text=fake.paragraph()[:MAX_WARBLER_LENGTH],
+                timestamp=get_random_datetime(rng=rng, end=self.end),
+                user_id=self.popular_user(rng)
+            )
+
+    def follows(self, block):
+        """Follows made by one block of users (as followers)."""
+
+        rng = self.rng('follows', block)
+        n, total = self.num_users, self.args.follows
+        start, stop = self.block_range(n, block)
+
+        # this block's exact share of the total, split by Pareto weights
+        share = total * stop // n - total * start // n
+        weights = [rng.paretovariate(self.args.out_alpha)
+                   for i in range(start, stop)]
+        scale = share / sum(weights)
+
+        # a follower capped at everyone else passes the rest down the line
+        owed, made = 0.0, 0
+        for follower, weight in zip(range(start + 1, stop + 1), weights):
+            owed += weight * scale
+            count = min(round(owed) - made, n - 1)
+            made += count
+
+            if count > n // 2:
+                picks = set(rng.sample(range(1, n + 1), count + 1))
+                picks.discard(follower)
+                picks = sorted(picks)[:count]
+            else:
+                # skewed draws; past 3x tries we'd only be collecting rare
+                # tail users one at a time, so fill the rest uniformly
+                picks = set()
+                for attempt in range(3 * count):
+                    if len(picks) == count:
+                        break
+                    picks.add(self.popular_user(rng))
+                picks.discard(follower)
+                while len(picks) < count:
+                    followed = rng.randint(1, n)
+                    if followed != follower:
+                        picks.add(followed)
+
+            for followed in sorted(picks):
+                yield dict(user_being_followed_id=followed,
+                           user_following_id=follower)
+
+    def write_block(self, task):
+        """Write one block to its part file; returns the part's path."""
+
+        name, block = task
+        path = os.path.join(self.args.out, f".{name}.{block:08d}.part")
+        fieldnames = HEADERS[name]
+
+        with open(path, 'w', newline='') as part:
+            writer = csv.DictWriter(part, fieldnames=fieldnames)
+            writer.writerows(getattr(self, name)(block))
+
+        return path
+
+
+HEADERS = {
+    'users': USERS_CSV_HEADERS,
+    'messages': MESSAGES_CSV_HEADERS,
+    'follows': FOLLOWS_CSV_HEADERS,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS)
+    parser.add_argument('--seed', default='warbler',
+                        help="same seed and sizes, same files")
+    parser.add_argument('--alpha', type=float, default=1.1,
+                        help="power-law skew of popularity (default 1.1)")
+    parser.add_argument('--out-alpha', type=float, default=1.5,
+                        help="Pareto shape of follows per user (default 1.5)")
+    parser.add_argument('--end', default='2020-01-01',
+                        help="messages fall in the two years before this")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    parser.add_argument('--out', default='generator')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    generator = Generator(args)
+
+    sizes = {'users': args.users, 'messages': args.messages,
+             'follows': args.users}
+    tasks = [(name, block) for name in HEADERS
+             for block in range(-(-sizes[name] // args.block_size))]
+
+    if args.workers > 1:
+        with Pool(args.workers) as pool:
+            parts = pool.map(generator.write_block, tasks, chunksize=1)
+    else:
+        parts = [generator.write_block(task) for task in tasks]
+
+    for name in HEADERS:
+        with open(os.path.join(args.out, f"{name}.csv"), 'w',
+                  newline='') as out:
+            csv.DictWriter(out, fieldnames=HEADERS[name]).writeheader()
+            for (task_name, block), path in zip(tasks, parts):
+                if task_name == name:
+                    with open(path) as part:
+                        shutil.copyfileobj(part, out)
+                    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Password hashing off the request thread.
+
+bcrypt at cost 12 burns ~250ms of CPU per call, so hashing and checking run
+in a small process pool instead of on the thread serving the request. At most
+`max_pending` calls may be queued or running; past that, callers get
+`HashingBusy` straight away (the app answers 429) instead of piling up behind
+a burst of logins. A caller that waits longer than `timeout` seconds gets
+`HashingBusy` too; its call keeps its slot until the pool has finished (or
+dropped) it, so the limit counts the work actually in the pool.
+
+`rounds` is the bcrypt cost for new hashes. Stored hashes with a lower cost
+are upgraded on the next successful login (see `User.authenticate`).
+
+With `workers=0` hashing runs inline, which is what tests and one-off
+scripts get unless the app configures a pool. Under gevent (serve.py) the
+pool is of native threads instead: bcrypt releases the GIL while it works.
+"""
+
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+import metrics
+
+DEFAULT_ROUNDS = 12
+DEFAULT_MAX_PENDING = 32
+DEFAULT_TIMEOUT = 10
+
+
+class HashingBusy(Exception):
+    """Too many hashing calls are already queued, or this one timed out."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+class HashingService:
+    """Runs bcrypt calls in a worker pool with a bounded queue."""
+
+    def __init__(self, workers=0, max_pending=DEFAULT_MAX_PENDING,
+                 rounds=DEFAULT_ROUNDS, timeout=DEFAULT_TIMEOUT,
+                 executor=ProcessPoolExecutor):
+        self.workers = workers
+        self.executor = executor
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def _pool(self):
+        # created on first use, so each forked web worker gets its own
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = self.executor(self.workers)
+            return self.pool
+
+    def _run(self, fn, *args):
+        if self.max_pending <= 0 or not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+
+        started = time.perf_counter()
+        try:
+            if not self.workers:
+                try:
+                    return fn(*args)
+                finally:
+                    self.slots.release()
+
+            try:
+                future = self._pool().submit(fn, *args)
+            except Exception:
+                self.slots.release()
+                raise
+            # freed when the pool is done with the call, not when we stop
+            # waiting for it
+            future.add_done_callback(lambda future: self.slots.release())
+
+            try:
+                return future.result(self.timeout)
+            except FutureTimeout:
+                future.cancel()
+                raise HashingBusy()
+        finally:
+            metrics.add_time('bcrypt', time.perf_counter() - started)
+
+    def generate_password_hash(self, password):
+        """bcrypt hash of `password` at the configured cost."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a lower cost than we now use?"""
+
+        try:
+            return int(pw_hash.split('$')[2]) < self.rounds
+        except (IndexError, ValueError):
+            return False
+
+    def shutdown(self):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+service = HashingService()
+
+
+def configure(workers, max_pending, rounds, executor=ProcessPoolExecutor):
+    """Replace the service (from app config)."""
+
+    global service
+    service.shutdown()
+    service = HashingService(workers, max_pending, rounds,
+                             executor=executor)
+
+
+def generate_password_hash(password):
+    return service.generate_password_hash(password)
+
+
+def check_password_hash(pw_hash, password):
+    return service.check_password_hash(pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    return service.needs_rehash(pw_hash)
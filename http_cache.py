@@ -0,0 +1,137 @@
+"""HTTP caching policy for Warbler responses.
+
+`apply_policy()` runs after every request and picks a `Cache-Control`:
+
+- static files linked through `url_for('static', ...)` carry a content
+  fingerprint (`?v=...`, see `add_fingerprint()`) and are cached for a year;
+  unfingerprinted static URLs (image URLs stored on users) revalidate;
+- views marked `@public(max_age)` may be stored by shared caches, but only
+  for anonymous visitors with nothing in their session;
+- everything else is `private, no-cache`, with `Vary: Cookie` because
+  pages depend on who is logged in.
+
+Views whose output depends on a few known row versions call `check_etag()`
+with them before rendering: the client gets `304 Not Modified` without the
+template ever running if it already has that version, otherwise a strong
+ETag is attached to the rendered page.
+"""
+
+import hashlib
+import os
+
+from flask import abort, current_app, g, make_response, request, session
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+_fingerprints = {}
+_release = None
+
+
+def public(max_age):
+    """Mark a view as cacheable by shared caches for `max_age` seconds
+    when served to anonymous visitors."""
+
+    def decorator(view):
+        view.public_max_age = max_age
+        return view
+    return decorator
+
+
+def viewer():
+    """The parts of `g.user` every page renders (the navbar)."""
+
+    if not g.user:
+        return None
+    return (g.user.id, g.user.profile_version)
+
+
+def release():
+    """Digest of the templates and static fingerprints, so a deploy that
+    changes either (and with it a page's `?v=` asset URLs) changes every
+    ETag."""
+
+    global _release
+    if _release is None:
+        digest = hashlib.sha1()
+        root = current_app.jinja_loader.searchpath[0]
+        for dirpath, dirnames, filenames in sorted(os.walk(root)):
+            for name in sorted(filenames):
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    digest.update(f.read())
+
+        static = current_app.static_folder
+        for dirpath, dirnames, filenames in sorted(os.walk(static)):
+            for name in sorted(filenames):
+                filename = os.path.relpath(os.path.join(dirpath, name), static)
+                digest.update(f"{filename}={fingerprint(filename)}\n"
+                              .encode('utf-8'))
+        _release = digest.hexdigest()
+    return _release
+
+
+def check_etag(*parts):
+    """ETag the response by `parts`; 304 now if the client already has it.
+
+    Pending flash messages are never skipped over, since they are only shown
+    once.
+    """
+
+    etag = hashlib.sha1(repr((release(), viewer()) + parts)
+                        .encode('utf-8')).hexdigest()
+    g.etag = etag
+
+    if etag in request.if_none_match and '_flashes' not in session:
+        abort(make_response('', 304))
+
+
+def fingerprint(filename):
+    """Short content hash of a static file, or None if there is none."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    key = (filename, mtime)
+    if key not in _fingerprints:
+        with open(path, 'rb') as f:
+            _fingerprints[key] = hashlib.md5(f.read()).hexdigest()[:12]
+    return _fingerprints[key]
+
+
+def add_fingerprint(endpoint, values):
+    """`url_defaults` hook adding `v=<fingerprint>` to static URLs."""
+
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        version = fingerprint(values['filename'])
+        if version:
+            values['v'] = version
+
+
+def apply_policy(response):
+    """Set caching headers on `response` (an `after_request` hook)."""
+
+    if request.endpoint == 'static':
+        if request.args.get('v'):
+            response.headers['Cache-Control'] = (
+                f"public, max-age={STATIC_MAX_AGE}, immutable")
+        else:
+            response.headers['Cache-Control'] = 'public, no-cache'
+        return response
+
+    etag = g.get('etag')
+    if etag and response.status_code in (200, 304):
+        response.set_etag(etag)
+
+    view = current_app.view_functions.get(request.endpoint)
+    max_age = getattr(view, 'public_max_age', None)
+
+    if (max_age is not None and response.status_code in (200, 304)
+            and not g.get('user') and not session and not session.modified):
+        response.headers['Cache-Control'] = f"public, max-age={max_age}"
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    response.vary.add('Cookie')
+    return response
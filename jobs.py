@@ -0,0 +1,321 @@
+"""Background jobs, queued in the database.
+
+Side effects that don't have to finish before the response (deleting an
+account and everything hanging off it, fanning a message out to
+followers' timelines) are registered as tasks with `@task(name)` and
+requested with `enqueue(name, key=..., **kwargs)`.
+
+With `JOBS_EXECUTOR=inline` (the default) `enqueue()` simply runs the task
+there and then, in the caller's transaction, which is what tests and
+development get.
+
+With `JOBS_EXECUTOR=queue` it adds a row to `jobs` instead, in the
+caller's transaction, so a job exists exactly when the request's own
+writes were committed. `flask jobs-worker` runs them:
+
+- Each worker thread claims the oldest due job with `SELECT ... FOR UPDATE
+  SKIP LOCKED`, so any number of threads and processes share the table
+  without a broker and without waiting on each other's rows. The claim
+  marks the job `running` and commits.
+- The task then runs, and the job is marked `done` in the same
+  transaction, so a task's database writes happen once even if the worker
+  dies halfway (the job is then retried).
+- A task that raises is rolled back and retried after an exponential,
+  jittered backoff (`backoff` seconds, doubling, capped at `MAX_BACKOFF`),
+  up to `max_attempts` tries; then it stays `failed` for someone to look
+  at. A job left `running` for longer than `lease` seconds (its worker
+  died) is claimed again.
+- `key` is an idempotency key: while a job with that key is in the table,
+  enqueueing it again does nothing. Finished jobs are kept for `flask
+  jobs-prune` to remove, which is how long keys are remembered.
+
+Tasks take JSON-serializable keyword arguments, must not commit, and
+should expect to be retried: a job whose work turns out to be done
+already should just return.
+
+`stats()` (queue depth, age of the oldest due job, recent wait and run
+times) is served on /metrics.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, Job
+
+INLINE = 'inline'
+QUEUE = 'queue'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF = 5.0
+DEFAULT_LEASE = 600
+DEFAULT_POLL = 1.0
+MAX_BACKOFF = 3600.0
+RECENT_SECONDS = 300
+
+TASKS = {}
+
+_inline = threading.local()
+
+executor = INLINE
+max_attempts = DEFAULT_MAX_ATTEMPTS
+backoff = DEFAULT_BACKOFF
+lease = DEFAULT_LEASE
+
+logger = logging.getLogger(__name__)
+
+
+def configure(mode, attempts=DEFAULT_MAX_ATTEMPTS, backoff_seconds=DEFAULT_BACKOFF,
+              lease_seconds=DEFAULT_LEASE):
+    """Pick the executor and retry settings (from app config)."""
+
+    global executor, max_attempts, backoff, lease
+    if mode not in (INLINE, QUEUE):
+        raise ValueError(f"unknown job executor {mode!r}")
+    executor, max_attempts, backoff, lease = (
+        mode, attempts, backoff_seconds, lease_seconds)
+
+
+def task(name):
+    """Register the decorated function as the task `name`."""
+
+    def register(fn):
+        TASKS[name] = fn
+        return fn
+    return register
+
+
+def enqueue(name, key=None, delay=0, **kwargs):
+    """Run task `name` with `kwargs` now (inline) or queue it to run after
+    `delay` seconds once the caller commits; False if a job with `key` is
+    already queued."""
+
+    if name not in TASKS:
+        raise KeyError(f"no task {name!r}")
+    args = json.dumps(kwargs, sort_keys=True)
+
+    if executor == INLINE:
+        _run_inline(name, args)
+        return True
+
+    values = dict(task=name, args=args, idempotency_key=key, status=QUEUED,
+                  attempts=0, max_attempts=max_attempts,
+                  run_at=datetime.utcnow() + timedelta(seconds=delay),
+                  created_at=datetime.utcnow())
+    table = Job.__table__
+    if db.engine.dialect.name == 'postgresql':
+        stmt = pg_insert(table).values(**values).on_conflict_do_nothing()
+    else:
+        stmt = table.insert().values(**values).prefix_with('OR IGNORE')
+
+    return db.session.execute(stmt).rowcount == 1
+
+
+def _run_inline(name, args):
+    pending = getattr(_inline, 'pending', None)
+    if pending is not None:
+        # enqueued by a task running inline: run it once that one returns,
+        # so a task that queues its own next step doesn't recurse
+        pending.append((name, args))
+        return
+
+    _inline.pending = pending = [(name, args)]
+    try:
+        while pending:
+            name, args = pending.pop(0)
+            TASKS[name](**json.loads(args))
+    finally:
+        _inline.pending = None
+
+
+##############################################################################
+# Running jobs
+
+
+def claim(now=None):
+    """Take the oldest due job (or one whose worker died) for this thread;
+    None if there is nothing to do. Commits."""
+
+    now = now or datetime.utcnow()
+
+    job = (Job
+           .query
+           .filter(Job.status == QUEUED, Job.run_at <= now)
+           .order_by(Job.run_at, Job.id)
+           .with_for_update(skip_locked=True)
+           .first())
+    if job is None:
+        job = (Job
+               .query
+               .filter(Job.status == RUNNING,
+                       Job.started_at < now - timedelta(seconds=lease))
+               .order_by(Job.started_at, Job.id)
+               .with_for_update(skip_locked=True)
+               .first())
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = RUNNING
+    job.started_at = now
+    job.attempts += 1
+    db.session.commit()
+    return job
+
+
+def retry_delay(attempts):
+    """Seconds to wait before try `attempts + 1`."""
+
+    delay = min(backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def run(job):
+    """Run a claimed job; returns its new status."""
+
+    started = time.perf_counter()
+    try:
+        fn = TASKS.get(job.task)
+        if fn is None:
+            raise KeyError(f"no task {job.task!r}")
+        fn(**json.loads(job.args))
+
+        job.status = DONE
+        job.finished_at = datetime.utcnow()
+        job.error = None
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()
+
+        job = db.session.query(Job).get(job.id)
+        job.error = error
+        if job.attempts >= job.max_attempts or job.task not in TASKS:
+            job.status = FAILED
+            job.finished_at = datetime.utcnow()
+            logger.error("job %s %s failed for good after %s attempts:\n%s",
+                         job.id, job.task, job.attempts, error)
+        else:
+            job.status = QUEUED
+            job.run_at = (datetime.utcnow()
+                          + timedelta(seconds=retry_delay(job.attempts)))
+            logger.warning("job %s %s failed (attempt %s), retrying at %s",
+                           job.id, job.task, job.attempts, job.run_at)
+        db.session.commit()
+
+    logger.info("job %s %s %s in %.0fms", job.id, job.task, job.status,
+                (time.perf_counter() - started) * 1000)
+    return job.status
+
+
+def run_next():
+    """Claim and run one job; returns its status, or None if idle."""
+
+    job = claim()
+    return None if job is None else run(job)
+
+
+def work(app, concurrency=1, poll=DEFAULT_POLL, burst=False, stop=None):
+    """Run jobs on `concurrency` threads until `stop` (an Event) is set, or
+    with `burst` until nothing is due. Returns how many jobs ran."""
+
+    stop = stop or threading.Event()
+    ran = []
+
+    def worker():
+        with app.app_context():
+            try:
+                while not stop.is_set():
+                    try:
+                        status = run_next()
+                    except Exception:
+                        logger.exception("job worker error")
+                        db.session.rollback()
+                        status = None
+
+                    if status is not None:
+                        ran.append(status)
+                    elif burst:
+                        break
+                    else:
+                        stop.wait(poll)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker, name=f"jobs-{i}")
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return len(ran)
+
+
+def prune(older_than_days):
+    """Delete jobs finished more than `older_than_days` ago, done or failed;
+    returns how many. Callers commit."""
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    return (Job
+            .query
+            .filter(Job.status.in_([DONE, FAILED]), Job.finished_at < cutoff)
+            .delete(synchronize_session=False))
+
+
+##############################################################################
+# Metrics
+
+
+def stats(now=None):
+    """Queue depth by status, age of the oldest due job, and average wait
+    and run times of jobs finished in the last `RECENT_SECONDS`."""
+
+    now = now or datetime.utcnow()
+
+    counts = dict(db.session
+                  .query(Job.status, db.func.count())
+                  .group_by(Job.status))
+
+    oldest = (db.session
+              .query(db.func.min(Job.run_at))
+              .filter(Job.status == QUEUED, Job.run_at <= now)
+              .scalar())
+
+    recent = (db.session
+              .query(Job.run_at, Job.started_at, Job.finished_at)
+              .filter(Job.status == DONE,
+                      Job.finished_at >= now - timedelta(
+                          seconds=RECENT_SECONDS))
+              .all())
+
+    def average(values):
+        return round(sum(values) / len(values), 3) if values else 0
+
+    return {
+        'queued': counts.get(QUEUED, 0),
+        'running': counts.get(RUNNING, 0),
+        'failed': counts.get(FAILED, 0),
+        'done': counts.get(DONE, 0),
+        'oldest_due_seconds': (round((now - oldest).total_seconds(), 3)
+                               if oldest else 0),
+        'recent_done': len(recent),
+        'recent_wait_seconds': average(
+            [max((started - run_at).total_seconds(), 0)
+             for run_at, started, finished in recent]),
+        'recent_run_seconds': average(
+            [(finished - started).total_seconds()
+             for run_at, started, finished in recent]),
+    }
@@ -0,0 +1,264 @@
+"""Bulk loader for Warbler CSV snapshots (users, messages, follows).
+
+Rows are streamed from the CSV files in chunks of `chunk_size` and each
+chunk is committed on its own, so memory stays flat and no transaction
+grows with the file. On Postgres each chunk goes through `COPY ... FROM
+STDIN`; other databases (SQLite) get an `executemany` insert.
+
+Secondary indexes (not primary keys or unique constraints) are dropped for
+the load and rebuilt afterwards, id sequences are moved past the loaded
+rows, and then everything derived from the loaded rows is rebuilt: the
+denormalized counters, home timelines, message tags and follow
+suggestions.
+`report` is called with a line per step giving rows and rows/sec.
+
+Run it with `flask load-csvs` (see app.py) or `python seed.py`.
+"""
+
+import csv
+import io
+import os
+import re
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import DDL, DateTime, Integer
+
+from models import (db, User, Message, Follows, TimelineEntry, MessageTag,
+                    Suggestion)
+import counters
+import fragments
+import partitions
+import search
+import suggestions
+import tags
+import timeline
+import user_cache
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# loaded in this order, so foreign keys always point at loaded rows
+FILES = [
+    ('users.csv', User.__table__),
+    ('messages.csv', Message.__table__),
+    ('follows.csv', Follows.__table__),
+]
+
+
+def _use_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _chunks(reader, size):
+    while True:
+        chunk = list(islice(reader, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+##############################################################################
+# Loading one table
+
+
+def _copy_chunk(connection, table, columns, rows):
+    """`COPY` one chunk into `table` (Postgres)."""
+
+    buf = io.StringIO()
+    csv.writer(buf, quoting=csv.QUOTE_ALL).writerows(rows)
+    buf.seek(0)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table.name} ({', '.join(columns)}) FROM STDIN "
+        f"WITH (FORMAT csv)", buf)
+
+
+def _parse_timestamp(value):
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.strptime(value, fmt)
+
+
+def _converter(column):
+    """Turn a CSV string into a value `column` accepts."""
+
+    if isinstance(column.type, DateTime):
+        return lambda v: _parse_timestamp(v) if v else None
+    if isinstance(column.type, Integer):
+        return lambda v: int(v) if v else None
+    return lambda v: v
+
+
+def _insert_chunk(connection, table, columns, rows):
+    """`executemany` insert of one chunk into `table`."""
+
+    convert = [_converter(table.c[name]) for name in columns]
+    connection.execute(table.insert(), [
+        {name: conv(value) for name, conv, value in zip(columns, convert, row)}
+        for row in rows
+    ])
+
+
+def load_csv(path, table, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream the CSV at `path` into `table`; returns the row count."""
+
+    load_chunk = _copy_chunk if _use_postgres() else _insert_chunk
+    count = 0
+
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+
+        # COPY skips the mapper event that creates message partitions
+        stamp = (columns.index('timestamp')
+                 if table is Message.__table__ and partitions.enabled
+                 else None)
+
+        for rows in _chunks(reader, chunk_size):
+            with db.engine.begin() as connection:
+                if stamp is not None:
+                    partitions.ensure(connection, {
+                        _parse_timestamp(row[stamp]) for row in rows})
+                load_chunk(connection, table, columns, rows)
+            count += len(rows)
+
+    return count
+
+
+##############################################################################
+# Around the load
+
+
+def _search_indexes(tables):
+    """(name, CREATE statement) of search.py's Postgres-only indexes on
+    `tables`."""
+
+    names = {table.name for table in tables}
+    found = []
+    for statement in search.SEARCH_INDEXES:
+        match = re.match(r"CREATE INDEX IF NOT EXISTS (\w+) ON (\w+)",
+                         statement)
+        if match and match.group(2) in names:
+            found.append((match.group(1), statement))
+    return found
+
+
+def drop_indexes(tables):
+    """Drop the non-unique indexes of `tables`; returns what to pass to
+    `create_indexes` afterwards."""
+
+    indexes = [index for table in tables for index in table.indexes
+               if not index.unique]
+    extra = _search_indexes(tables) if _use_postgres() else []
+
+    with db.engine.begin() as connection:
+        for index in indexes:
+            index.drop(bind=connection)
+        for name, statement in extra:
+            connection.execute(DDL(f"DROP INDEX IF EXISTS {name}"))
+
+    return indexes, extra
+
+
+def create_indexes(dropped):
+    """Rebuild indexes removed by `drop_indexes`."""
+
+    indexes, extra = dropped
+    with db.engine.begin() as connection:
+        for index in indexes:
+            index.create(bind=connection)
+        for name, statement in extra:
+            connection.execute(DDL(statement))
+
+
+def reset_sequences(tables):
+    """Point each table's id sequence past its largest id (Postgres)."""
+
+    if not _use_postgres():
+        return
+
+    with db.engine.begin() as connection:
+        for table in tables:
+            if 'id' in table.c:
+                connection.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                    f"'id'), COALESCE((SELECT MAX(id) FROM {table.name}), 0) "
+                    f"+ 1, false)")
+
+
+class _Step:
+    """Times one step of the load and reports it."""
+
+    def __init__(self, name, report):
+        self.name = name
+        self.report = report
+        self.rows = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if self.rows is None:
+            self.report(f"{self.name}: {seconds:.1f}s")
+        else:
+            rate = self.rows / seconds if seconds else 0
+            self.report(f"{self.name}: {self.rows} rows in {seconds:.1f}s "
+                        f"({rate:,.0f} rows/s)")
+
+
+def load_csvs(directory, chunk_size=DEFAULT_CHUNK_SIZE, report=print):
+    """Load users.csv, messages.csv and follows.csv from `directory`,
+    then rebuild counters, timelines, tags and suggestions. Returns the
+    rows loaded."""
+
+    tables = [table for name, table in FILES]
+
+    with _Step("total", report) as total:
+        total.rows = 0
+        derived_indexes = drop_indexes([TimelineEntry.__table__,
+                                        MessageTag.__table__,
+                                        Suggestion.__table__])
+
+        try:
+            dropped = drop_indexes(tables)
+            try:
+                for name, table in FILES:
+                    with _Step(name, report) as step:
+                        step.rows = load_csv(os.path.join(directory, name),
+                                             table, chunk_size)
+                    total.rows += step.rows
+            finally:
+                with _Step("indexes", report):
+                    create_indexes(dropped)
+
+            reset_sequences(tables)
+
+            with _Step("counters", report):
+                counters.reconcile()
+                db.session.commit()
+
+            with _Step("timelines", report):
+                timeline.rebuild()
+                db.session.commit()
+
+            with _Step("tags", report) as step:
+                step.rows = tags.rebuild(report=lambda line: None)
+                db.session.commit()
+
+            with _Step("suggestions", report) as step:
+                step.rows = suggestions.rebuild()
+                db.session.commit()
+
+        finally:
+            db.session.rollback()
+            create_indexes(derived_indexes)
+
+        # the loaded rows bypassed the session, so drop anything cached
+        search.fallback.reset()
+        user_cache.clear()
+        fragments.clear()
+
+    return total.rows
@@ -0,0 +1,280 @@
+"""Per-request instrumentation, served as Prometheus metrics.
+
+For every request this records the endpoint, how long it took, how many SQL
+statements it ran and how long they took, time spent rendering templates,
+and time spent in bcrypt (see hashing.py). Those go into per-endpoint
+histograms, which `/metrics` serves in the Prometheus text format.
+
+Two things are logged as warnings as well:
+
+- a request slower than `slow_ms`, with its breakdown and the statements it
+  ran most often;
+- a request that ran the same statement `repeat_limit` times or more. Our
+  statements are parameterized, so identical SQL text repeated per row is
+  almost always an N+1 lazy load.
+
+SQL is timed from engine events and templates from Flask's template
+signals; both only count inside a request, so CLI commands and the
+write-behind thread are left out. Queries run by lazy loads during a render
+count towards both the database and the template time.
+
+Like the caches, the numbers are per process: each web worker reports its
+own since it started.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from flask import g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_MS = 500
+DEFAULT_REPEAT_LIMIT = 10
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """A Prometheus histogram with one series per endpoint."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, endpoint, value):
+        counts = self.series.get(endpoint)
+        if counts is None:
+            # one count per bucket, then +Inf, then the sum
+            counts = self.series[endpoint] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for endpoint, counts in sorted(self.series.items()):
+            label = f'endpoint="{endpoint}"'
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                total += count
+                yield f'{self.name}_bucket{{{label},le="{bound}"}} {total}'
+            yield f"{self.name}_sum{{{label}}} {counts[-1]:.6f}"
+            yield f"{self.name}_count{{{label}}} {total}"
+
+
+class Metrics:
+    """Aggregates finished requests; safe to share between threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {
+            'seconds': Histogram('warbler_request_seconds',
+                                 "Time to serve a request.",
+                                 SECONDS_BUCKETS),
+            'db_seconds': Histogram('warbler_request_db_seconds',
+                                    "Time spent in SQL statements.",
+                                    SECONDS_BUCKETS),
+            'template_seconds': Histogram('warbler_request_template_seconds',
+                                          "Time spent rendering templates.",
+                                          SECONDS_BUCKETS),
+            'bcrypt_seconds': Histogram('warbler_request_bcrypt_seconds',
+                                        "Time spent hashing passwords.",
+                                        SECONDS_BUCKETS),
+            'statements': Histogram('warbler_request_sql_statements',
+                                    "SQL statements run per request.",
+                                    STATEMENT_BUCKETS),
+        }
+        self.slow = Counter()
+        self.repeated = Counter()
+
+    def record(self, stats, slow, repeated):
+        with self.lock:
+            for key, histogram in self.histograms.items():
+                histogram.observe(stats.endpoint, getattr(stats, key))
+            self.slow[stats.endpoint] += slow
+            self.repeated[stats.endpoint] += repeated
+
+    def render(self):
+        with self.lock:
+            for histogram in self.histograms.values():
+                yield from histogram.render()
+            for name, help, counter in [
+                    ('warbler_slow_requests_total',
+                     "Requests slower than the slow-request threshold.",
+                     self.slow),
+                    ('warbler_repeated_statement_requests_total',
+                     "Requests that repeated one statement past the limit "
+                     "(likely N+1).", self.repeated)]:
+                yield f"# HELP {name} {help}"
+                yield f"# TYPE {name} counter"
+                for endpoint, count in sorted(counter.items()):
+                    yield f'{name}{{endpoint="{endpoint}"}} {count}'
+
+
+class RequestStats:
+    """What one request has done so far."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.bcrypt_seconds = 0.0
+        self.statement_counts = Counter()
+        self.rendering = []
+
+
+enabled = True
+slow_ms = DEFAULT_SLOW_MS
+repeat_limit = DEFAULT_REPEAT_LIMIT
+registry = Metrics()
+
+
+def configure(enable, slow, repeats):
+    """Set up instrumentation (from app config)."""
+
+    global enabled, slow_ms, repeat_limit
+    enabled, slow_ms, repeat_limit = enable, slow, repeats
+
+
+def reset():
+    global registry
+    registry = Metrics()
+
+
+def current():
+    """Stats of the request being served, or None."""
+
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+def add_time(kind, seconds):
+    """Charge `seconds` of `kind` (e.g. 'bcrypt') to the current request."""
+
+    stats = current()
+    if stats is not None:
+        setattr(stats, f"{kind}_seconds",
+                getattr(stats, f"{kind}_seconds") + seconds)
+
+
+##############################################################################
+# Request hooks (registered in app.py)
+
+
+def start_request():
+    if enabled:
+        g.request_stats = RequestStats(request.endpoint or 'unmatched')
+
+
+def finish_request(exc=None):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return
+
+    stats.seconds = time.perf_counter() - stats.started
+
+    slow = stats.seconds * 1000 >= slow_ms
+    top = stats.statement_counts.most_common(3)
+    repeated = bool(top) and top[0][1] >= repeat_limit
+
+    if repeated:
+        statement, count = top[0]
+        logger.warning("%s ran the same statement %d times (N+1?): %s",
+                       stats.endpoint, count, _shorten(statement))
+
+    if slow:
+        logger.warning(
+            "slow request %s %s: %.0fms, %d statements in %.0fms, "
+            "templates %.0fms, bcrypt %.0fms; most run: %s",
+            request.method, request.path, stats.seconds * 1000,
+            stats.statements, stats.db_seconds * 1000,
+            stats.template_seconds * 1000, stats.bcrypt_seconds * 1000,
+            "; ".join(f"{count}x {_shorten(statement)}"
+                      for statement, count in top))
+
+    registry.record(stats, slow, repeated)
+
+
+def _shorten(statement, length=200):
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+
+def render():
+    """Everything recorded, in the Prometheus text format."""
+
+    return "\n".join(registry.render()) + "\n"
+
+
+def render_gauges(prefix, values):
+    """Numeric `values` (a stats() dict) as Prometheus gauges."""
+
+    lines = []
+    for key, value in sorted(values.items()):
+        if isinstance(value, (int, float)):
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+##############################################################################
+# SQL and template timing
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current() is not None:
+        conn.info.setdefault('metrics_started', []).append(
+            time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = current()
+    started = conn.info.get('metrics_started')
+    if stats is None or not started:
+        return
+
+    stats.db_seconds += time.perf_counter() - started.pop()
+    stats.statements += 1
+    stats.statement_counts[statement] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    started = context.connection.info.get('metrics_started')
+    if started:
+        started.pop()
+
+
+@before_render_template.connect
+def _before_render(sender, template, context, **extra):
+    stats = current()
+    if stats is not None:
+        stats.rendering.append(time.perf_counter())
+
+
+@template_rendered.connect
+def _after_render(sender, template, context, **extra):
+    stats = current()
+    if stats is not None and stats.rendering:
+        started = stats.rendering.pop()
+        # a render_template() inside another is already in the outer time
+        if not stats.rendering:
+            stats.template_seconds += time.perf_counter() - started
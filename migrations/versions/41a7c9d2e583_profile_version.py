@@ -0,0 +1,26 @@
+"""profile version
+
+Revision ID: 41a7c9d2e583
+Revises: e3f90b6d1a47
+Create Date: 2026-10-18 11:26:48.517230
+
+Adds users.profile_version, which keys the rendered-fragment cache.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '41a7c9d2e583'
+down_revision = 'e3f90b6d1a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('profile_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'profile_version')
@@ -0,0 +1,37 @@
+"""suggestions
+
+Revision ID: 5e8c2a7d3f91
+Revises: 9b2d4f6e1c08
+Create Date: 2026-10-18 16:03:21.540817
+
+Adds the precomputed "who to follow" table. It is filled by application
+code; run `flask rebuild-suggestions` after upgrading, and nightly.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8c2a7d3f91'
+down_revision = '9b2d4f6e1c08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('suggestions',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('candidate_id', sa.Integer(), nullable=False),
+    sa.Column('mutuals', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['candidate_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'candidate_id')
+    )
+    op.create_index('ix_suggestions_user_score', 'suggestions', ['user_id', 'score', 'candidate_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_suggestions_user_score', table_name='suggestions')
+    op.drop_table('suggestions')
@@ -0,0 +1,67 @@
+"""timelines and counters
+
+Revision ID: 7d1c3e5b8a20
+Revises: 2b4e6f1a9c3d
+Create Date: 2026-10-18 09:14:37.402915
+
+Adds the materialized home timeline table and the denormalized counter
+columns, and fills the counters in. Timelines are built by application
+code; run `flask rebuild-timelines` after upgrading.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1c3e5b8a20'
+down_revision = '2b4e6f1a9c3d'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ['messages_count', 'following_count', 'followers_count',
+            'likes_count']
+
+
+def upgrade():
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+    op.create_index('ix_timeline_entries_user_timestamp', 'timeline_entries', ['user_id', 'timestamp', 'message_id'], unique=False)
+
+    for name in COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+    op.add_column('messages', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""
+        UPDATE users SET
+            messages_count = (SELECT COUNT(*) FROM messages
+                              WHERE messages.user_id = users.id),
+            following_count = (SELECT COUNT(*) FROM follows
+                               WHERE follows.user_following_id = users.id),
+            followers_count = (SELECT COUNT(*) FROM follows
+                               WHERE follows.user_being_followed_id = users.id),
+            likes_count = (SELECT COUNT(*) FROM likes
+                           WHERE likes.user_id = users.id)
+    """)
+    op.execute("""
+        UPDATE messages SET
+            like_count = (SELECT COUNT(*) FROM likes
+                          WHERE likes.message_id = messages.id)
+    """)
+
+
+def downgrade():
+    op.drop_column('messages', 'like_count')
+    for name in reversed(COUNTERS):
+        op.drop_column('users', name)
+
+    op.drop_index('ix_timeline_entries_user_timestamp', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
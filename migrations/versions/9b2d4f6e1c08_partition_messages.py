@@ -0,0 +1,168 @@
+"""partition messages
+
+Revision ID: 9b2d4f6e1c08
+Revises: 41a7c9d2e583
+Create Date: 2026-10-18 14:12:40.118342
+
+Turns messages into a table range-partitioned by month of timestamp, with
+partitions from the oldest message through two months from now (see
+partitions.py for the rest). Postgres only.
+
+The primary key becomes (id, timestamp), as the partition key must be part
+of it, so likes and timeline_entries can no longer have foreign keys to
+messages. Triggers take their place: deleting messages deletes their likes
+and timeline entries, and inserting a like for a missing message fails
+with a foreign key violation.
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4f6e1c08'
+down_revision = '41a7c9d2e583'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 2
+
+COLUMNS = 'id, text, "timestamp", user_id, like_count'
+
+
+def month_after(month, n=1):
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("ALTER TABLE likes DROP CONSTRAINT likes_message_id_fkey")
+    op.execute("ALTER TABLE timeline_entries "
+               "DROP CONSTRAINT timeline_entries_message_id_fkey")
+
+    op.execute("DROP INDEX ix_messages_user_timestamp")
+    op.execute("DROP INDEX IF EXISTS ix_search_messages_text")
+    op.execute("ALTER TABLE messages RENAME TO messages_unpartitioned")
+    op.execute("ALTER TABLE messages_unpartitioned "
+               "RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey")
+
+    op.execute("""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            text varchar(140) NOT NULL,
+            "timestamp" timestamp without time zone NOT NULL,
+            user_id integer NOT NULL
+                REFERENCES users (id) ON DELETE CASCADE,
+            like_count integer NOT NULL DEFAULT 0,
+            PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+
+    oldest = op.get_bind().execute(
+        'SELECT min("timestamp") FROM messages_unpartitioned').scalar()
+    now = datetime.utcnow()
+    month = datetime((oldest or now).year, (oldest or now).month, 1)
+    last = month_after(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE messages_y{month.year:04d}m{month.month:02d} "
+            f"PARTITION OF messages FOR VALUES FROM ('{month:%Y-%m-%d}') "
+            f"TO ('{month_after(month):%Y-%m-%d}')")
+        month = month_after(month)
+
+    op.execute(f"INSERT INTO messages ({COLUMNS}) "
+               f"SELECT {COLUMNS} FROM messages_unpartitioned")
+    op.execute("DROP TABLE messages_unpartitioned")
+
+    op.execute('CREATE INDEX ix_messages_user_timestamp ON messages '
+               '(user_id, "timestamp" DESC, id DESC)')
+    op.execute("CREATE INDEX ix_search_messages_text ON messages "
+               "USING gin (to_tsvector('english', text))")
+
+    # ON DELETE CASCADE, for the foreign keys that had to go
+    op.execute("""
+        CREATE FUNCTION messages_delete_dependents() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM likes USING deleted_messages
+                WHERE likes.message_id = deleted_messages.id;
+            DELETE FROM timeline_entries USING deleted_messages
+                WHERE timeline_entries.message_id = deleted_messages.id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER messages_delete_dependents AFTER DELETE ON messages
+            REFERENCING OLD TABLE AS deleted_messages
+            FOR EACH STATEMENT EXECUTE PROCEDURE messages_delete_dependents()
+    """)
+
+    # and the check half of the foreign key on likes (timeline entries are
+    # only ever copied from existing messages)
+    op.execute("""
+        CREATE FUNCTION likes_message_exists() RETURNS trigger AS $$
+        BEGIN
+            PERFORM 1 FROM messages WHERE id = NEW.message_id FOR KEY SHARE;
+            IF NOT FOUND THEN
+                RAISE foreign_key_violation USING MESSAGE = format(
+                    'message %s does not exist', NEW.message_id);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER likes_message_exists
+            BEFORE INSERT OR UPDATE OF message_id ON likes
+            FOR EACH ROW EXECUTE PROCEDURE likes_message_exists()
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("DROP TRIGGER likes_message_exists ON likes")
+    op.execute("DROP FUNCTION likes_message_exists()")
+
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("""
+        CREATE TABLE messages (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            text varchar(140) NOT NULL,
+            "timestamp" timestamp without time zone NOT NULL,
+            user_id integer NOT NULL
+                REFERENCES users (id) ON DELETE CASCADE,
+            like_count integer NOT NULL DEFAULT 0
+        )
+    """)
+    op.execute(f"INSERT INTO messages ({COLUMNS}) "
+               f"SELECT {COLUMNS} FROM messages_partitioned")
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+
+    # drops the partitions, their indexes and the delete trigger
+    op.execute("DROP TABLE messages_partitioned")
+    op.execute("DROP FUNCTION messages_delete_dependents()")
+
+    op.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey "
+               "PRIMARY KEY (id)")
+    op.execute('CREATE INDEX ix_messages_user_timestamp ON messages '
+               '(user_id, "timestamp" DESC, id DESC)')
+    op.execute("CREATE INDEX ix_search_messages_text ON messages "
+               "USING gin (to_tsvector('english', text))")
+
+    op.execute("DELETE FROM likes WHERE message_id NOT IN "
+               "(SELECT id FROM messages)")
+    op.execute("DELETE FROM timeline_entries WHERE message_id NOT IN "
+               "(SELECT id FROM messages)")
+    op.create_foreign_key('likes_message_id_fkey', 'likes', 'messages',
+                          ['message_id'], ['id'], ondelete='cascade')
+    op.create_foreign_key('timeline_entries_message_id_fkey',
+                          'timeline_entries', 'messages',
+                          ['message_id'], ['id'], ondelete='cascade')
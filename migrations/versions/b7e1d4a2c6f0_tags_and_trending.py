@@ -0,0 +1,74 @@
+"""tags and trending
+
+Revision ID: b7e1d4a2c6f0
+Revises: 5e8c2a7d3f91
+Create Date: 2026-10-18 17:21:09.338164
+
+Adds message_tags (hashtags and mentions per message) and trend_counts
+(time-bucketed counts behind /trending). Run `flask rebuild-tags` after
+upgrading to tag existing messages.
+
+On Postgres messages is partitioned by now (9b2d4f6e1c08), so
+message_tags.message_id can't have a foreign key there; the trigger that
+stands in for ON DELETE CASCADE deletes message tags too.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d4a2c6f0'
+down_revision = '5e8c2a7d3f91'
+branch_labels = None
+depends_on = None
+
+DELETE_DEPENDENTS = """
+    CREATE OR REPLACE FUNCTION messages_delete_dependents() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM likes USING deleted_messages
+            WHERE likes.message_id = deleted_messages.id;
+        DELETE FROM timeline_entries USING deleted_messages
+            WHERE timeline_entries.message_id = deleted_messages.id;
+        {}
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+DELETE_TAGS = """DELETE FROM message_tags USING deleted_messages
+            WHERE message_tags.message_id = deleted_messages.id;"""
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+
+    op.create_table('message_tags',
+    sa.Column('tag', sa.String(length=65), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    *([] if postgres else [
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade')]),
+    sa.PrimaryKeyConstraint('tag', 'message_id')
+    )
+    op.create_index('ix_message_tags_tag_timestamp', 'message_tags', ['tag', 'timestamp', 'message_id'], unique=False)
+
+    op.create_table('trend_counts',
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=8), nullable=False),
+    sa.Column('name', sa.String(length=65), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('bucket', 'kind', 'name')
+    )
+
+    if postgres:
+        op.execute(DELETE_DEPENDENTS.format(DELETE_TAGS))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(DELETE_DEPENDENTS.format(''))
+
+    op.drop_table('trend_counts')
+    op.drop_index('ix_message_tags_tag_timestamp', table_name='message_tags')
+    op.drop_table('message_tags')
@@ -0,0 +1,48 @@
+"""hot query indexes
+
+Revision ID: c58a9e07f4b6
+Revises: 7d1c3e5b8a20
+Create Date: 2026-10-18 09:21:50.664071
+
+Indexes for the profile/timeline message scan, the reverse follows lookup,
+and like toggles. Duplicate likes (possible before this revision) are
+removed (and like counters recomputed) so the unique index can be built.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58a9e07f4b6'
+down_revision = '7d1c3e5b8a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_user_timestamp', 'messages', ['user_id', sa.text('timestamp DESC'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_follows_user_following_id', 'follows', ['user_following_id', 'user_being_followed_id'], unique=False)
+
+    op.execute("""
+        DELETE FROM likes WHERE id NOT IN (
+            SELECT MIN(id) FROM likes GROUP BY user_id, message_id
+        )
+    """)
+    op.execute("""
+        UPDATE users SET likes_count = (SELECT COUNT(*) FROM likes
+                                        WHERE likes.user_id = users.id)
+    """)
+    op.execute("""
+        UPDATE messages SET like_count = (SELECT COUNT(*) FROM likes
+                                          WHERE likes.message_id = messages.id)
+    """)
+    op.create_index('uq_likes_user_message', 'likes', ['user_id', 'message_id'], unique=True)
+    op.create_index('ix_likes_message_id', 'likes', ['message_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_likes_message_id', table_name='likes')
+    op.drop_index('uq_likes_user_message', table_name='likes')
+    op.drop_index('ix_follows_user_following_id', table_name='follows')
+    op.drop_index('ix_messages_user_timestamp', table_name='messages')
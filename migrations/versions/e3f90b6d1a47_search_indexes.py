@@ -0,0 +1,38 @@
+"""search indexes
+
+Revision ID: e3f90b6d1a47
+Revises: c58a9e07f4b6
+Create Date: 2026-10-18 10:02:11.905372
+
+Trigram indexes for user search and a full-text index for message search.
+Postgres only; other databases use search.py's in-process fallback.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f90b6d1a47'
+down_revision = 'c58a9e07f4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_search_users_username ON users USING gin (username gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_search_users_bio ON users USING gin (bio gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_search_messages_text ON messages USING gin (to_tsvector('english', text))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.drop_index('ix_search_messages_text', table_name='messages')
+    op.drop_index('ix_search_users_bio', table_name='users')
+    op.drop_index('ix_search_users_username', table_name='users')
@@ -0,0 +1,32 @@
+"""account purge
+
+Revision ID: e4a9c7b2f518
+Revises: c3f8a1e6d2b4
+Create Date: 2026-10-18 19:52:37.104628
+
+Adds `users.deleted_at` for soft-deleted accounts waiting to be purged
+(see accounts.py), and `message_id` indexes so deleting messages finds
+their feed entries and tags without scanning those tables.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c7b2f518'
+down_revision = 'c3f8a1e6d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_timeline_entries_message_id', 'timeline_entries', ['message_id'], unique=False)
+    op.create_index('ix_message_tags_message_id', 'message_tags', ['message_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_message_tags_message_id', table_name='message_tags')
+    op.drop_index('ix_timeline_entries_message_id', table_name='timeline_entries')
+    op.drop_column('users', 'deleted_at')
@@ -0,0 +1,38 @@
+"""likes created_at
+
+Revision ID: f1b6d3a8c9e2
+Revises: e4a9c7b2f518
+Create Date: 2026-10-18 21:07:45.318260
+
+Adds when each like was made, indexed per user, for the liked-messages
+page (see social.liked_page()). Likes made before this revision all get
+the upgrade time; among them the page falls back to like id order.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b6d3a8c9e2'
+down_revision = 'e4a9c7b2f518'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # now() is stable, so existing rows get it without a table rewrite
+        op.add_column('likes', sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    else:
+        # SQLite can't add a column with a non-constant default
+        op.add_column('likes', sa.Column('created_at', sa.DateTime(), nullable=True))
+        op.execute("UPDATE likes SET created_at = CURRENT_TIMESTAMP")
+        with op.batch_alter_table('likes') as batch_op:
+            batch_op.alter_column('created_at', nullable=False, server_default=sa.text('CURRENT_TIMESTAMP'))
+    op.create_index('ix_likes_user_created', 'likes', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_likes_user_created', table_name='likes')
+    op.drop_column('likes', 'created_at')
@@ -2,11 +2,10 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+import hashing
+from routing import RoutingSQLAlchemy
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +25,12 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key covers "who follows X"; this covers "who does X follow"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -42,11 +47,172 @@ class Likes(db.Model):
         db.ForeignKey('users.id', ondelete='cascade')
     )
 
+    # on Postgres with partitioned messages this is enforced by triggers
+    # instead (see partitions.py)
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade')
         )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # a user likes a message at most once; the unique index also serves the
+    # per-user lookup in like_warble() and social.liked_ids()
+    __table_args__ = (
+        db.Index('uq_likes_user_message', 'user_id', 'message_id',
+                 unique=True),
+        db.Index('ix_likes_message_id', 'message_id'),
+        # a user's likes newest first (social.liked_page())
+        db.Index('ix_likes_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+
+class TimelineEntry(db.Model):
+    """Materialized home-timeline row: `message_id` shows on `user_id`'s feed.
+
+    Rows are written when a message is posted (fan-out-on-write) and when a
+    follow is added, and pruned on unfollow. `timestamp` and `author_id` are
+    copied from the message so a feed page is one range scan on the
+    `(user_id, timestamp)` index.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # see Likes.message_id about partitioned messages
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # deleting messages deletes their entries from every feed
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+
+class MessageTag(db.Model):
+    """A `#hashtag` or `@mention` (with its sigil, lowercased) in a message.
+
+    `timestamp` is copied from the message so a tag page is one range scan
+    on the `(tag, timestamp)` index; see tags.py.
+    """
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.String(65),
+        primary_key=True,
+    )
+
+    # see Likes.message_id about partitioned messages
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_message_tags_tag_timestamp',
+                 'tag', 'timestamp', 'message_id'),
+        # deleting messages deletes their tags
+        db.Index('ix_message_tags_message_id', 'message_id'),
+    )
+
+
+class TrendCount(db.Model):
+    """Posts per tag or likes per message in one time bucket, summed over
+    every web process; see trending.py."""
+
+    __tablename__ = 'trend_counts'
+
+    bucket = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    kind = db.Column(
+        db.String(8),
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.String(65),
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Suggestion(db.Model):
+    """Precomputed "who to follow" row: `candidate_id` for `user_id`.
+
+    `mutuals` counts the users `user_id` follows who follow the candidate;
+    `score` adds a bonus for the candidate's recent activity. Written by
+    suggestions.py and read top-down through the `(user_id, score)` index.
+    """
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    candidate_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    mutuals = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_suggestions_user_score',
+                 'user_id', 'score', 'candidate_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -93,25 +259,74 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # bumped on every profile edit; keys cached HTML, see fragments.py
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # denormalized counts; kept up to date by the views, see counters.py
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # set when the account is deleted, until it is purged; see accounts.py
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # passive_deletes: never load these just to delete a user; the database
+    # cascades (and accounts.purge() deletes them in batches first)
+
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -120,14 +335,38 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return self.following_status([other_user.id])[other_user.id]
+
+    def following_status(self, user_ids):
+        """Map each id in `user_ids` to whether this user follows it.
+
+        One indexed query however many ids are asked about, for pages that
+        render a follow button per user.
+        """
+
+        if not user_ids:
+            return {}
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids))
+                .all())
+        followed = {r[0] for r in rows}
+
+        return {user_id: user_id in followed for user_id in user_ids}
+
+    @classmethod
+    def visible(cls):
+        """Query for users who haven't deleted their account (soft-deleted
+        users stay in the table until accounts.py purges them)."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -136,7 +375,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hashing.generate_password_hash(password)
 
         user = User(
             username=username,
@@ -157,20 +396,29 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with a lower bcrypt cost than we now use is replaced with
+        a fresh one; the caller commits it along with the login.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hashing.check_password_hash(user.password, password)
             if is_auth:
+                if hashing.needs_rehash(user.password):
+                    user.password = hashing.generate_password_hash(password)
                 return user
 
         return False
 
 
 class Message(db.Model):
-    """An individual message ("warble")."""
+    """An individual message ("warble").
+
+    On Postgres the table is partitioned by month of `timestamp`, with
+    `(id, timestamp)` as its primary key; see partitions.py.
+    """
 
     __tablename__ = 'messages'
 
@@ -187,7 +435,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -196,7 +444,102 @@ class Message(db.Model):
         nullable=False,
     )
 
-    user = db.relationship('User')
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # eager: every listing renders the author next to the message
+    user = db.relationship('User', lazy='joined')
+
+    @classmethod
+    def visible(cls):
+        """Query for messages whose author hasn't deleted their account."""
+
+        return (cls
+                .query
+                .join(User, User.id == cls.user_id)
+                .filter(User.deleted_at.is_(None)))
+
+
+# profile pages and read-time timeline pulls: one user's messages, newest first
+db.Index('ix_messages_user_timestamp',
+         Message.user_id, Message.timestamp.desc(), Message.id.desc())
+
+
+class Job(db.Model):
+    """A side effect waiting for (or done by) a worker; see jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    task = db.Column(
+        db.String(64),
+        nullable=False,
+    )
+
+    # JSON keyword arguments for the task
+    args = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # enqueueing the same key again while the job exists does nothing
+    idempotency_key = db.Column(
+        db.String(200),
+        unique=True,
+    )
+
+    status = db.Column(
+        db.String(16),
+        nullable=False,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    error = db.Column(
+        db.Text,
+    )
+
+    # workers take the oldest due job of a status
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at', 'id'),
+    )
 
 
 def connect_db(app):
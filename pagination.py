@@ -0,0 +1,203 @@
+"""Keyset (cursor) pagination for Warbler listings.
+
+Pages are selected with `WHERE key < cursor` / `WHERE key > cursor` on an
+indexed sort key instead of `OFFSET`, so every page costs the same no matter
+how deep the reader has scrolled.
+
+Messages are keyed by `(timestamp, id)` and listed newest first; users are
+keyed by `id` and listed in ascending order. A page exposes two cursors:
+`before` (keys lower than anything on the page) and `after` (keys higher),
+which views pass back as `?before=` / `?after=` query parameters.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import and_, or_
+
+from models import Message, User
+import partitions
+
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 60
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+Page = namedtuple('Page', ['items', 'before', 'after'])
+
+
+##############################################################################
+# Cursor encoding
+
+
+def message_cursor(message):
+    """Cursor string for a message's `(timestamp, id)` key."""
+
+    return f"{message.timestamp.strftime(CURSOR_TIME_FORMAT)}-{message.id}"
+
+
+def parse_message_cursor(cursor):
+    """Turn a message cursor back into a `(timestamp, id)` key.
+
+    Returns None for a missing cursor; a malformed one is a 400.
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        stamp, msg_id = cursor.split('-')
+        return (datetime.strptime(stamp, CURSOR_TIME_FORMAT), int(msg_id))
+    except ValueError:
+        abort(400)
+
+
+def user_cursor(user):
+    """Cursor string for a user's `id` key."""
+
+    return str(user.id)
+
+
+def parse_user_cursor(cursor):
+    """Turn a user cursor back into an `(id,)` key."""
+
+    if not cursor:
+        return None
+
+    try:
+        return (int(cursor),)
+    except ValueError:
+        abort(400)
+
+
+##############################################################################
+# Keyset queries
+
+
+def _compare(columns, values, lower):
+    """Lexicographic `columns < values` (or `>` when not `lower`)."""
+
+    column, value = columns[0], values[0]
+    strict = column < value if lower else column > value
+
+    if len(columns) == 1:
+        return strict
+
+    return or_(strict,
+               and_(column == value, _compare(columns[1:], values[1:], lower)))
+
+
+def keyset_query(query, columns, before=None, after=None,
+                 per_page=MESSAGES_PER_PAGE, descending=True):
+    """Restrict and order `query` to the rows `fetch` would return."""
+
+    if before is not None:
+        query = query.filter(_compare(columns, before, lower=True))
+        order = [c.desc() for c in columns]
+    elif after is not None:
+        query = query.filter(_compare(columns, after, lower=False))
+        order = list(columns)
+    elif descending:
+        order = [c.desc() for c in columns]
+    else:
+        order = list(columns)
+
+    return query.order_by(*order).limit(per_page + 1)
+
+
+def fetch(query, columns, before=None, after=None, per_page=MESSAGES_PER_PAGE,
+          descending=True, windows=()):
+    """Fetch up to `per_page + 1` rows of `query` around a cursor.
+
+    Rows come back in travel order (away from the cursor); pass them to
+    `make_page` to trim the look-ahead row and build the next cursors.
+
+    `windows` (month counts, see `partitions.windows()`) makes a
+    newest-first fetch keyed by timestamp look only at that many recent
+    months first, widening until a full page turns up.
+    """
+
+    if windows and descending and after is None:
+        newest = before[0] if before is not None else datetime.utcnow()
+        for months in windows:
+            recent = query.filter(
+                columns[0] >= partitions.window_start(newest, months))
+            rows = keyset_query(recent, columns, before, after, per_page,
+                                descending).all()
+            if len(rows) > per_page:
+                return rows
+
+    return keyset_query(query, columns, before, after, per_page,
+                        descending).all()
+
+
+def make_page(rows, key, encode, before=None, after=None,
+              per_page=MESSAGES_PER_PAGE, descending=True):
+    """Build a `Page` from rows returned by `fetch` (or merged fetches).
+
+    `key` maps an item to its sort key and `encode` turns an item into its
+    cursor string.
+    """
+
+    more = len(rows) > per_page
+    items = rows[:per_page]
+
+    if before is not None:
+        has_lower, has_higher = more, True
+    elif after is not None:
+        has_lower, has_higher = True, more
+    elif descending:
+        has_lower, has_higher = more, False
+    else:
+        has_lower, has_higher = False, more
+
+    items.sort(key=key, reverse=descending)
+
+    if not items:
+        return Page(items, None, None)
+
+    if descending:
+        lowest, highest = items[-1], items[0]
+    else:
+        lowest, highest = items[0], items[-1]
+
+    return Page(items,
+                encode(lowest) if has_lower else None,
+                encode(highest) if has_higher else None)
+
+
+def paginate(query, columns, key, encode, before=None, after=None,
+             per_page=MESSAGES_PER_PAGE, descending=True, windows=()):
+    """Return one `Page` of `query` keyed on `columns`."""
+
+    rows = fetch(query, columns, before, after, per_page, descending, windows)
+    return make_page(rows, key, encode, before, after, per_page, descending)
+
+
+def message_key(message):
+    """Sort key for a message."""
+
+    return (message.timestamp, message.id)
+
+
+def user_key(user):
+    """Sort key for a user."""
+
+    return (user.id,)
+
+
+def paginate_messages(query, before=None, after=None,
+                      per_page=MESSAGES_PER_PAGE):
+    """Page through a `Message` query newest first."""
+
+    return paginate(query, [Message.timestamp, Message.id], message_key,
+                    message_cursor, before, after, per_page,
+                    windows=partitions.windows())
+
+
+def paginate_users(query, before=None, after=None, per_page=USERS_PER_PAGE):
+    """Page through a `User` query in id order."""
+
+    return paginate(query, [User.id], user_key, user_cursor, before, after,
+                    per_page, descending=False)
@@ -0,0 +1,263 @@
+"""Monthly partitions of `messages` (Postgres) and their archival.
+
+The `partition_messages` migration turns `messages` into a table
+partitioned by range of `timestamp`, with one partition per calendar month
+named `messages_yYYYYmMM`. Set `MESSAGE_PARTITIONS=1` once it has run;
+`db.create_all()` (tests, seed.py) still makes a plain table, and nothing
+here does anything unless it is turned on.
+
+- Partitions are created as they are needed: before a message is inserted
+  (`ensure()` from a mapper event, and from the bulk loader), each new
+  month also gets the next month's partition, so a request rarely pays for
+  the DDL. `flask create-partitions` creates them ahead of time from cron.
+- Newest-first message listings (profiles, home timelines) are read
+  through `windows()`: `pagination.fetch()` first looks only at the
+  partitions of the most recent month, then 3, then 12, and only scans
+  everything when a page is still short. Timeline entries carry the
+  message's timestamp, so joining on it lets Postgres prune partitions
+  there too.
+- `flask archive-messages` deals with cold partitions: it either moves
+  them to another tablespace (e.g. on a compressed filesystem) where they
+  stay readable, or exports each to a gzipped CSV and drops it.
+
+Postgres cannot point a foreign key at a partitioned table's `id` alone,
+so the migration replaces the `likes` and `timeline_entries` foreign keys
+to `messages` with triggers (`message_tags` gets the same treatment in its
+own migration): deleting messages deletes their likes, timeline entries
+and tags, and a like for a missing message is refused.
+"""
+
+import csv
+import gzip
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import event
+
+from models import db, Message, Likes, MessageTag, TimelineEntry
+
+DEFAULT_WINDOWS = (1, 3, 12)
+DEFAULT_MONTHS_AHEAD = 2
+
+NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+enabled = False
+window_months = DEFAULT_WINDOWS
+
+# months seen to have a partition, per process
+_created = set()
+
+
+def configure(enable, windows=DEFAULT_WINDOWS):
+    """Turn partition handling on or off (from app config)."""
+
+    global enabled, window_months
+    enabled, window_months = enable, tuple(windows)
+    _created.clear()
+
+
+##############################################################################
+# Months
+
+
+def month_start(when):
+    """First moment of `when`'s month."""
+
+    return datetime(when.year, when.month, 1)
+
+
+def add_months(month, n):
+    """The month `n` months after (or before, if negative) `month`."""
+
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+
+def partition_month(name):
+    """The month a partition covers, from its name (None if not one)."""
+
+    match = NAME.match(name)
+    if match is None:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+##############################################################################
+# Creating partitions
+
+
+def _create(connection, month):
+    connection.execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} "
+        f"PARTITION OF messages FOR VALUES "
+        f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')")
+
+
+def ensure(connection, timestamps):
+    """Make sure every month in `timestamps` (and the one after each) has
+    a partition.
+
+    Runs on the caller's connection: a separate transaction would wait on
+    locks the caller may already hold on `messages`. A month is only
+    remembered once it is seen committed, so a rollback can't leave us
+    believing in a partition that isn't there.
+    """
+
+    if not enabled or connection.dialect.name != 'postgresql':
+        return
+
+    for month in {month_start(t) for t in timestamps} - _created:
+        for m in (month, add_months(month, 1)):
+            if m in _created:
+                continue
+            exists = connection.execute(
+                f"SELECT to_regclass('{partition_name(m)}')").scalar()
+            if exists is None:
+                _create(connection, m)
+            else:
+                _created.add(m)
+
+
+def create_ahead(months_ahead=DEFAULT_MONTHS_AHEAD, now=None):
+    """Create this month's partition and the next `months_ahead`; returns
+    their names."""
+
+    this_month = month_start(now or datetime.utcnow())
+    months = [add_months(this_month, n) for n in range(months_ahead + 1)]
+
+    with db.engine.begin() as connection:
+        for month in months:
+            _create(connection, month)
+    _created.update(months)
+
+    return [partition_name(month) for month in months]
+
+
+@event.listens_for(Message, 'before_insert')
+def _before_insert(mapper, connection, message):
+    if enabled:
+        # the column default would only fill it in after this
+        if message.timestamp is None:
+            message.timestamp = datetime.utcnow()
+        ensure(connection, [message.timestamp])
+
+
+##############################################################################
+# Reading recent partitions first
+
+
+def windows():
+    """Months to try, newest first, before reading every partition (see
+    `pagination.fetch`)."""
+
+    return window_months if enabled else ()
+
+
+def window_start(newest, months):
+    """Lower bound of a window of `months` partitions ending with
+    `newest`'s month."""
+
+    return add_months(month_start(newest), 1 - months)
+
+
+##############################################################################
+# Archival
+
+
+def partitions():
+    """Names of the existing monthly partitions, oldest first."""
+
+    rows = db.session.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages'
+    """)
+    return sorted(name for name, in rows if partition_month(name))
+
+
+def cold_partitions(older_than_months, now=None):
+    """Partitions whose whole month is more than `older_than_months` ago."""
+
+    cutoff = add_months(month_start(now or datetime.utcnow()),
+                        -older_than_months)
+    return [name for name in partitions() if partition_month(name) < cutoff]
+
+
+def move_to_tablespace(name, tablespace):
+    """Move a partition and its indexes to `tablespace`; its rows stay
+    readable."""
+
+    with db.engine.begin() as connection:
+        indexes = [index for index, in connection.execute(
+            "SELECT indexrelid::regclass::text FROM pg_index "
+            f"WHERE indrelid = '{name}'::regclass")]
+
+        connection.execute(f"ALTER TABLE {name} SET TABLESPACE {tablespace}")
+        for index in indexes:
+            connection.execute(
+                f"ALTER INDEX {index} SET TABLESPACE {tablespace}")
+
+
+def export_and_drop(name, directory):
+    """Write a partition to `directory`/`name`.csv.gz (CSV with a header),
+    then drop it along with its likes and timeline entries. Returns the
+    number of messages archived.
+
+    Run `counters.reconcile()` afterwards.
+    """
+
+    path = os.path.join(directory, f"{name}.csv.gz")
+    columns = ['id', 'text', 'timestamp', 'user_id', 'like_count']
+
+    with db.engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        with gzip.open(path, 'wt', newline='') as f:
+            cursor.copy_expert(
+                f"COPY (SELECT {', '.join(columns)} FROM {name} ORDER BY id) "
+                f"TO STDOUT WITH (FORMAT csv, HEADER)", f)
+
+        with gzip.open(path, 'rt', newline='') as f:
+            exported = sum(1 for row in csv.reader(f)) - 1
+
+        count = connection.execute(f"SELECT count(*) FROM {name}").scalar()
+        if exported != count:
+            raise RuntimeError(f"{path} has {exported} rows, {name} {count}")
+
+        # dropping a partition deletes no rows, so the cleanup triggers
+        # don't run; do their work here
+        for table in (Likes.__table__, TimelineEntry.__table__,
+                      MessageTag.__table__):
+            connection.execute(
+                f"DELETE FROM {table.name} WHERE message_id IN "
+                f"(SELECT id FROM {name})")
+
+        connection.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        connection.execute(f"DROP TABLE {name}")
+
+    _created.discard(partition_month(name))
+    return count
+
+
+def archive(older_than_months, tablespace=None, directory=None,
+            report=print):
+    """Move or export every partition older than `older_than_months`;
+    returns the names handled."""
+
+    cold = cold_partitions(older_than_months)
+    db.session.rollback()
+
+    for name in cold:
+        if tablespace:
+            move_to_tablespace(name, tablespace)
+            report(f"{name}: moved to {tablespace}")
+        else:
+            count = export_and_drop(name, directory)
+            report(f"{name}: {count} messages exported to {directory}")
+
+    return cold
@@ -0,0 +1,68 @@
+"""Count the SQL statements a block of code sends to the database.
+
+Used by the view tests to keep page renders at a constant number of
+queries:
+
+    with QueryCounter() as counter:
+        client.get('/')
+    assert counter.count <= 6
+"""
+
+from sqlalchemy import event
+
+from models import db
+import user_cache
+
+
+class QueryCounter:
+    """Context manager recording every statement run on `db.engine`."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryCountAssertions:
+    """TestCase mixin for asserting how many queries a view issues."""
+
+    def count_queries(self, url):
+        """Number of statements issued while GETting `url`."""
+
+        # start from an empty identity map and a cold user cache, so runs
+        # are comparable
+        db.session.remove()
+        user_cache.clear()
+
+        with QueryCounter() as counter:
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        return counter.count
+
+    def assertConstantQueries(self, url, grow):
+        """Assert `url` costs the same number of queries after `grow()`.
+
+        `grow` should add rows that the page renders (more messages, more
+        users), so a per-row lazy load shows up as a difference.
+        """
+
+        before = self.count_queries(url)
+        grow()
+        after = self.count_queries(url)
+
+        self.assertEqual(before, after,
+                         f"{url} went from {before} to {after} queries")
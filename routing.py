@@ -0,0 +1,97 @@
+"""Connection pools and read-replica routing.
+
+`db` (models.py) is a `RoutingSQLAlchemy`: Flask-SQLAlchemy plus a
+`pool_pre_ping` setting (`SQLALCHEMY_POOL_PRE_PING`) alongside the pool
+size/overflow/timeout/recycle settings it already reads, and a session
+that can read from a replica.
+
+Replicas are ordinary Flask-SQLAlchemy binds (`SQLALCHEMY_BINDS`) named in
+`configure()`. A request to a view marked `@read_only` picks one of them at
+random and all of its ORM queries go there. Everything else goes to the
+primary: other views, flushes, and INSERT/UPDATE/DELETE statements run
+through the session, even inside a read-only view.
+
+Replicas lag behind the primary, so a user who has just written would not
+see their own follow or warble on the next page. Any write in a request
+therefore keeps that browser's reads on the primary for `sticky_seconds`
+(kept in the session cookie). With the write-behind buffer (writes.py) the
+write only reaches the database at the next flush, so keep `sticky_seconds`
+above the buffer interval.
+
+Code using `db.engine` directly (loader, counters, CLI commands) always
+talks to the primary.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+DEFAULT_STICKY_SECONDS = 10
+
+STICKY_KEY = 'db_primary_until'
+
+replicas = []
+sticky_seconds = DEFAULT_STICKY_SECONDS
+
+
+def configure(replica_binds, sticky):
+    """Set the replica bind names and the stickiness window (from app
+    config)."""
+
+    global replicas, sticky_seconds
+    replicas, sticky_seconds = list(replica_binds), sticky
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica."""
+
+    view.read_replica = True
+    return view
+
+
+def route_request():
+    """Pick a replica for this request, if its view allows one."""
+
+    view = current_app.view_functions.get(request.endpoint)
+    if (replicas and getattr(view, 'read_replica', False)
+            and session.get(STICKY_KEY, 0) <= time.time()):
+        g.db_replica = random.choice(replicas)
+
+
+def stick_to_primary():
+    """Send this browser's reads to the primary for a while."""
+
+    if replicas and has_request_context():
+        session[STICKY_KEY] = time.time() + sticky_seconds
+        g.pop('db_replica', None)
+
+
+class RoutingSession(SignallingSession):
+    """Session sending a read-only request's queries to its replica."""
+
+    def get_bind(self, mapper=None, clause=None):
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if writing:
+            stick_to_primary()
+
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is not None and not writing:
+            return get_state(self.app).db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with pool pre-ping and `RoutingSession`."""
+
+    def apply_pool_defaults(self, app, options):
+        super().apply_pool_defaults(app, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
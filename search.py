@@ -0,0 +1,343 @@
+"""User and message search for Warbler.
+
+On Postgres, user search matches usernames and bios with `ILIKE`, served by
+`pg_trgm` GIN indexes and ranked by trigram similarity, and message search
+is a `tsvector` full-text match ranked with `ts_rank`. The indexes live in
+the `search indexes` migration and are also created by `db.create_all()`
+(see `SEARCH_INDEXES` below).
+
+Other databases (SQLite test runs) fall back to an in-process inverted index
+built from the tables on first use and kept current from session flushes:
+each flush's changes are held until its transaction commits, and a
+rollback that drops some resets the index.
+
+Results are ranked, so they are paged by page number rather than keyset; the
+depth is capped at `MAX_PAGE`.
+"""
+
+import re
+import threading
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import DDL, event, func, or_
+
+from models import db, User, Message
+
+USERS_PER_PAGE = 12
+MESSAGES_PER_PAGE = 20
+MAX_PAGE = 20
+
+SearchPage = namedtuple('SearchPage', ['items', 'page', 'has_next'])
+
+SEARCH_INDEXES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_search_users_username ON users "
+    "USING gin (username gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_search_users_bio ON users "
+    "USING gin (bio gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_search_messages_text ON messages "
+    "USING gin (to_tsvector('english', text))",
+]
+
+for statement in SEARCH_INDEXES:
+    event.listen(db.metadata, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+
+def _use_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _clamp_page(page):
+    return min(max(page, 1), MAX_PAGE)
+
+
+def _escape_like(text):
+    return re.sub(r'([\\%_])', r'\\\1', text)
+
+
+##############################################################################
+# Public API
+
+
+def search_users(q, page=1, per_page=USERS_PER_PAGE):
+    """Users whose username or bio matches `q`, best match first."""
+
+    page = _clamp_page(page)
+
+    if _use_postgres():
+        pattern = f"%{_escape_like(q)}%"
+        rows = (User
+                .visible()
+                .filter(or_(User.username.ilike(pattern, escape='\\'),
+                            User.bio.ilike(pattern, escape='\\')))
+                .order_by(func.similarity(User.username, q).desc(), User.id)
+                .offset((page - 1) * per_page)
+                .limit(per_page + 1)
+                .all())
+        return SearchPage(rows[:per_page], page, len(rows) > per_page)
+
+    ids = fallback.users.search(q)
+    return _load_page(User, User.visible(), ids, page, per_page)
+
+
+def search_messages(q, page=1, per_page=MESSAGES_PER_PAGE):
+    """Messages containing every word of `q`, most relevant first."""
+
+    page = _clamp_page(page)
+
+    if _use_postgres():
+        vector = func.to_tsvector('english', Message.text)
+        query = func.plainto_tsquery('english', q)
+        rows = (Message
+                .visible()
+                .filter(vector.op('@@')(query))
+                .order_by(func.ts_rank(vector, query).desc(),
+                          Message.timestamp.desc())
+                .offset((page - 1) * per_page)
+                .limit(per_page + 1)
+                .all())
+        return SearchPage(rows[:per_page], page, len(rows) > per_page)
+
+    ids = fallback.messages.search(q)
+    return _load_page(Message, Message.visible(), ids, page, per_page)
+
+
+def _load_page(model, query, ranked_ids, page, per_page):
+    """Load one page of `ranked_ids` (those `query` finds), keeping their
+    order."""
+
+    start = (page - 1) * per_page
+    page_ids = ranked_ids[start:start + per_page]
+
+    found = {}
+    if page_ids:
+        found = {obj.id: obj
+                 for obj in query.filter(model.id.in_(page_ids))}
+
+    items = [found[i] for i in page_ids if i in found]
+    return SearchPage(items, page, len(ranked_ids) > start + per_page)
+
+
+##############################################################################
+# In-process fallback
+
+
+def words(text):
+    """Lower-cased word tokens of `text`."""
+
+    return set(re.findall(r'\w+', (text or '').lower()))
+
+
+def trigrams(text, pad=True):
+    """Trigrams of `text`, lower-cased.
+
+    Padded like pg_trgm (two leading spaces and one trailing space per word)
+    for similarity scoring; unpadded for substring candidate lookups.
+    """
+
+    grams = set()
+    if pad:
+        for word in words(text):
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    else:
+        text = (text or '').lower()
+        grams.update(text[i:i + 3] for i in range(len(text) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """pg_trgm `similarity()`: shared trigrams over all trigrams."""
+
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class WordIndex:
+    """Word -> message id postings; a match needs every query word."""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def add(self, doc_id, text):
+        with self.lock:
+            self._remove(doc_id)
+            self.docs[doc_id] = words(text)
+            for word in self.docs[doc_id]:
+                self.postings[word].add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for word in self.docs.pop(doc_id, ()):
+            self.postings[word].discard(doc_id)
+
+    def search(self, q):
+        """Ids containing every word of `q`; denser matches, then newer
+        ids, first."""
+
+        wanted = words(q)
+        if not wanted:
+            return []
+
+        with self.lock:
+            found = set.intersection(
+                *(self.postings.get(word, set()) for word in wanted))
+            ranked = [(len(wanted) / len(self.docs[doc_id]), doc_id)
+                      for doc_id in found]
+
+        ranked.sort(reverse=True)
+        return [doc_id for score, doc_id in ranked]
+
+
+class TrigramIndex:
+    """Trigram -> user id postings answering `ILIKE '%q%'`, the way a
+    pg_trgm GIN index does: candidates share every trigram of `q`, then get
+    rechecked and ranked by name similarity."""
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def add(self, doc_id, text, name):
+        with self.lock:
+            self._remove(doc_id)
+            text = text.lower()
+            self.docs[doc_id] = (text, name)
+            for gram in trigrams(text, pad=False):
+                self.postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        text, name = self.docs.pop(doc_id, ('', ''))
+        for gram in trigrams(text, pad=False):
+            self.postings[gram].discard(doc_id)
+
+    def search(self, q):
+        """Ids whose text contains `q`, most similar name first."""
+
+        q = q.lower()
+        if not q:
+            return []
+
+        with self.lock:
+            grams = trigrams(q, pad=False)
+            if grams:
+                candidates = set.intersection(
+                    *(self.postings.get(gram, set()) for gram in grams))
+            else:
+                candidates = set(self.docs)
+
+            ranked = [(-similarity(self.docs[doc_id][1], q), doc_id)
+                      for doc_id in candidates
+                      if q in self.docs[doc_id][0]]
+
+        ranked.sort()
+        return [doc_id for score, doc_id in ranked]
+
+
+class FallbackIndexes:
+    """The user and message indexes, built lazily from the database."""
+
+    def __init__(self):
+        self._users = None
+        self._messages = None
+
+    @staticmethod
+    def user_doc(user):
+        return (f"{user.username}\n{user.bio or ''}", user.username)
+
+    @property
+    def users(self):
+        if self._users is None:
+            index = TrigramIndex()
+            for user in User.query:
+                index.add(user.id, *self.user_doc(user))
+            self._users = index
+        return self._users
+
+    @property
+    def messages(self):
+        if self._messages is None:
+            index = WordIndex()
+            for msg in Message.query:
+                index.add(msg.id, msg.text)
+            self._messages = index
+        return self._messages
+
+    def reset(self):
+        self._users = None
+        self._messages = None
+
+    def changes(self, session):
+        """A flushed session's changes as (kind, id, doc or None) updates,
+        copied out now because the objects are expired by the commit."""
+
+        updates = []
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, User):
+                updates.append(('users', obj.id, self.user_doc(obj)))
+            elif isinstance(obj, Message):
+                updates.append(('messages', obj.id, (obj.text,)))
+
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                updates.append(('users', obj.id, None))
+            elif isinstance(obj, Message):
+                updates.append(('messages', obj.id, None))
+        return updates
+
+    def apply(self, updates):
+        """Apply committed `changes()` to any built index."""
+
+        for kind, doc_id, doc in updates:
+            index = self._users if kind == 'users' else self._messages
+            if index is None:
+                continue
+            if doc is None:
+                index.remove(doc_id)
+            else:
+                index.add(doc_id, *doc)
+
+
+fallback = FallbackIndexes()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_flush(session, flush_context):
+    if not _use_postgres():
+        session.info.setdefault('search_changes', []).extend(
+            fallback.changes(session))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_on_commit(session):
+    fallback.apply(session.info.pop('search_changes', ()))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _reset_on_rollback(session):
+    # an index built mid-transaction may have read the rolled-back rows
+    if session.info.pop('search_changes', None):
+        fallback.reset()
+
+
+@event.listens_for(db.session, 'after_bulk_delete')
+def _reset_on_bulk_delete(delete_context):
+    fallback.reset()
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def _reset_on_drop(target, connection, **kw):
+    fallback.reset()
@@ -0,0 +1,160 @@
+"""Serve Warbler from a pool of threads or from gevent.
+
+    python serve.py --mode threads --threads 16 --port 5000
+    python serve.py --mode gevent --connections 1000 --port 5000
+
+Most of a request's time is spent waiting: on Postgres for the home
+timeline, profiles, the user list and the like/follow toggles, and on the
+client sending its request and reading the response. In `threads` mode
+each of `--threads` threads serves one connection at a time (like
+gunicorn's gthread worker), so as many slow clients are enough to stall
+the process.
+
+In `gevent` mode one thread serves up to `--connections` connections, each
+in its own greenlet. The standard library is monkey-patched before the app
+is imported and psycopg2 is switched to asynchronous mode (psycogreen), so
+a greenlet waiting on a socket, on Postgres or in `time.sleep` lets the
+others run. Connections still come from SQLAlchemy's pool, sized by
+`DB_POOL_SIZE` and `DB_MAX_OVERFLOW`: hundreds of greenlets share a few
+dozen connections and queue (up to `DB_POOL_TIMEOUT`) when all are busy,
+so keep the pool below Postgres' `max_connections` divided by the number
+of processes, and run one process per core.
+
+Only waiting is overlapped. Views, templates and the ORM still run one at
+a time per process, and bcrypt goes to a pool of native threads instead of
+processes. Flask 1.0 has no async views, so this is how the app as it is
+gets an asynchronous serving mode. Under gunicorn the equivalent is
+`-k gevent --worker-connections 1000` with `patch_psycopg()` called from a
+`post_fork` hook.
+
+`--db-latency` delays every SQL statement, standing in for a database
+across a network when benchmarking against a local one (see
+`benchmark.py servers`).
+"""
+
+import argparse
+import sys
+import time
+
+MODES = ['threads', 'gevent']
+
+DEFAULT_THREADS = 16
+DEFAULT_CONNECTIONS = 1000
+
+
+def add_db_latency(seconds):
+    """Sleep for `seconds` before every statement."""
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def delay(*args):
+        time.sleep(seconds)
+
+
+def threaded_server(app, host, port, threads, quiet=False):
+    """Werkzeug's server with a fixed pool of request threads."""
+
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args):
+            pass
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return PooledWSGIServer(host, port, app,
+                            QuietHandler if quiet else None)
+
+
+def gevent_server(app, host, port, connections, quiet=False):
+    """gevent's WSGI server, a greenlet per connection."""
+
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    return WSGIServer((host, port), app, spawn=Pool(connections),
+                      log=None if quiet else 'default')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=MODES, default='threads')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                        help="request threads (threads mode)")
+    parser.add_argument('--connections', type=int,
+                        default=DEFAULT_CONNECTIONS,
+                        help="concurrent connections (gevent mode)")
+    parser.add_argument('--db-latency', type=float, default=0,
+                        help="milliseconds to add to every SQL statement")
+    parser.add_argument('--quiet', action='store_true',
+                        help="don't log requests")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # gevent has to patch the standard library before anything (the app,
+    # SQLAlchemy's pool, our caches' locks) takes a reference to it
+    if args.mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    from sqlalchemy.engine.url import make_url
+
+    from app import app
+    import hashing
+
+    if args.mode == 'gevent':
+        from gevent.threadpool import ThreadPoolExecutor
+
+        url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        if url.get_backend_name() == 'postgresql':
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+
+        hashing.configure(app.config['HASHING_WORKERS'],
+                          app.config['HASHING_MAX_PENDING'],
+                          app.config['BCRYPT_LOG_ROUNDS'],
+                          executor=ThreadPoolExecutor)
+
+    if args.db_latency:
+        add_db_latency(args.db_latency / 1000)
+
+    if args.mode == 'gevent':
+        server = gevent_server(app, args.host, args.port, args.connections,
+                               args.quiet)
+    else:
+        server = threaded_server(app, args.host, args.port, args.threads,
+                                 args.quiet)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Follow and like writes for Warbler.
+
+Shared by the HTML views, the JSON API and the write-behind buffer (see
+writes.py). Every write is idempotent: following or liking twice, or two
+racing double-clicks, leave one row and count it once, because the counters
+(counters.py), home timelines (timeline.py), follow suggestions
+(suggestions.py) and trending counts (trending.py) are only touched when
+the `INSERT ... ON CONFLICT DO NOTHING` or `DELETE` actually changed a row.
+Callers commit.
+
+Reads of a user's likes go through the `(user_id, created_at)` index:
+`liked_page()` pages through what they liked, newest like first, and
+`liked_ids()` answers which of a page of messages they liked in one query.
+"""
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, User, Follows, Likes, Message
+import counters
+import pagination
+import suggestions
+import timeline
+import trending
+
+# keyset for paging a user's likes; matches ix_likes_user_created
+LIKED_KEY = [Likes.created_at, Likes.id]
+
+
+def _insert_ignore(table, **values):
+    """Insert a row unless it already exists; did it insert one?"""
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = pg_insert(table).values(**values).on_conflict_do_nothing()
+    else:
+        stmt = table.insert().values(**values).prefix_with('OR IGNORE')
+
+    return db.session.execute(stmt).rowcount == 1
+
+
+def follow(user_id, followed_id):
+    """Make `user_id` follow `followed_id`; False if they already did."""
+
+    added = _insert_ignore(Follows.__table__,
+                           user_being_followed_id=followed_id,
+                           user_following_id=user_id)
+
+    if added:
+        counters.adjust_user(user_id, following_count=1)
+        counters.adjust_user(followed_id, followers_count=1)
+        timeline.backfill(user_id, followed_id)
+        suggestions.followed(user_id, followed_id)
+    return added
+
+
+def unfollow(user_id, followed_id):
+    """Stop `user_id` following `followed_id`; False if they weren't."""
+
+    removed = (Follows
+               .query
+               .filter(Follows.user_being_followed_id == followed_id,
+                       Follows.user_following_id == user_id)
+               .delete(synchronize_session=False))
+
+    if removed:
+        counters.adjust_user(user_id, following_count=-1)
+        counters.adjust_user(followed_id, followers_count=-1)
+        timeline.prune(user_id, followed_id)
+        suggestions.unfollowed(user_id, followed_id)
+    return bool(removed)
+
+
+def is_following(user_id, followed_id):
+    """Does `user_id` follow `followed_id`?"""
+
+    return Follows.query.get((followed_id, user_id)) is not None
+
+
+def set_follow(user_id, followed_id, following):
+    """Follow or unfollow, whichever leaves `following` true."""
+
+    if following:
+        return follow(user_id, followed_id)
+    return unfollow(user_id, followed_id)
+
+
+def like(user_id, message_id):
+    """Like `message_id`; False if `user_id` already did."""
+
+    added = _insert_ignore(Likes.__table__,
+                           user_id=user_id, message_id=message_id)
+
+    if added:
+        counters.adjust_user(user_id, likes_count=1)
+        counters.adjust_message_likes(message_id, 1)
+        trending.record_like(message_id, 1)
+    return added
+
+
+def unlike(user_id, message_id):
+    """Remove a like; False if there wasn't one."""
+
+    removed = (Likes
+               .query
+               .filter(Likes.user_id == user_id,
+                       Likes.message_id == message_id)
+               .delete(synchronize_session=False))
+
+    if removed:
+        counters.adjust_user(user_id, likes_count=-1)
+        counters.adjust_message_likes(message_id, -1)
+        trending.record_like(message_id, -1)
+    return bool(removed)
+
+
+def is_liked(user_id, message_id):
+    """Has `user_id` liked `message_id`?"""
+
+    return (db.session
+            .query(Likes.id)
+            .filter(Likes.user_id == user_id,
+                    Likes.message_id == message_id)
+            .first()) is not None
+
+
+def set_like(user_id, message_id, liked):
+    """Like or unlike, whichever leaves `liked` true."""
+
+    if liked:
+        return like(user_id, message_id)
+    return unlike(user_id, message_id)
+
+
+def toggle_like(user_id, message_id):
+    """Like `message_id`, or unlike it if already liked; returns whether
+    it is now liked."""
+
+    liked = not is_liked(user_id, message_id)
+    set_like(user_id, message_id, liked)
+    return liked
+
+
+def liked_ids(user_id, message_ids):
+    """The ids among `message_ids` that `user_id` has liked, as a set."""
+
+    if not message_ids:
+        return set()
+
+    return {row[0] for row in (db.session
+                               .query(Likes.message_id)
+                               .filter(Likes.user_id == user_id,
+                                       Likes.message_id.in_(message_ids)))}
+
+
+def _liked_key(row):
+    return (row.liked_at, row.like_id)
+
+
+def _liked_cursor(row):
+    """Cursor for a like's `(created_at, id)` key, in the message cursor
+    format so `pagination.parse_message_cursor()` reads it back."""
+
+    stamp = row.liked_at.strftime(pagination.CURSOR_TIME_FORMAT)
+    return f"{stamp}-{row.like_id}"
+
+
+def liked_page(user_id, before=None, after=None,
+               per_page=pagination.MESSAGES_PER_PAGE):
+    """One `pagination.Page` of the messages `user_id` liked, most recently
+    liked first, each with its author.
+
+    `before` / `after` are parsed `(created_at, id)` like cursors.
+    """
+
+    query = (db.session
+             .query(Message,
+                    Likes.created_at.label('liked_at'),
+                    Likes.id.label('like_id'))
+             .join(Likes, Likes.message_id == Message.id)
+             .join(User, User.id == Message.user_id)
+             .filter(Likes.user_id == user_id, User.deleted_at.is_(None)))
+
+    page = pagination.paginate(query, LIKED_KEY, _liked_key, _liked_cursor,
+                               before, after, per_page)
+    return page._replace(items=[row.Message for row in page.items])
@@ -0,0 +1,259 @@
+"""Who to follow: friends-of-friends suggestions for each user.
+
+A candidate for a user is someone followed by people the user follows and
+not (yet) by the user. Candidates are ranked by how many of the user's
+follows follow them (`mutuals`), plus a bonus for having posted in the
+last `ACTIVITY_DAYS`, so of two accounts equally known to your follows the
+active one comes first.
+
+`rebuild()` (`flask rebuild-suggestions`, e.g. nightly from cron) loads
+the follow graph as one sorted array of followed ids per user, counts
+every user's candidates from their follows' arrays, and replaces the
+`suggestions` table with each user's top `top_k`.
+
+Between rebuilds, social.py calls `followed()` and `unfollowed()` whenever
+a follow is added or removed, and a few set-based statements adjust just
+the pairs that changed. When `u` follows `f`:
+
+- `f` is no longer a suggestion for `u`;
+- everyone `f` follows gains a mutual for `u`;
+- `f` gains a mutual for everyone who follows `u`.
+
+Unfollowing takes the mutuals away again, dropping rows left with none,
+and `f` becomes a suggestion for `u` again if others `u` follows follow
+them.
+
+Rows added this way score on mutuals alone until the next rebuild, and a
+user's list may grow past `top_k` meanwhile; only the top is read. A side
+that would touch more than `INCREMENTAL_LIMIT` rows (following someone who
+follows thousands, or a popular account following anyone) is left to the
+next rebuild.
+
+`/users/suggested` reads a user's list with one range scan on
+`ix_suggestions_user_score`.
+"""
+
+import heapq
+import math
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, User, Follows, Message, Suggestion
+
+DEFAULT_TOP_K = 50
+DEFAULT_SHOWN = 12
+ACTIVITY_DAYS = 30
+ACTIVITY_WEIGHT = 0.5
+INCREMENTAL_LIMIT = 1000
+CHUNK_SIZE = 10000
+
+COLUMNS = ['user_id', 'candidate_id', 'mutuals', 'score']
+
+
+def for_user(user_id, limit=DEFAULT_SHOWN):
+    """`user_id`'s best suggestions as (user, mutuals) pairs."""
+
+    return (db.session
+            .query(User, Suggestion.mutuals)
+            .join(Suggestion, Suggestion.candidate_id == User.id)
+            .filter(Suggestion.user_id == user_id,
+                    User.deleted_at.is_(None))
+            .order_by(Suggestion.score.desc(), Suggestion.candidate_id.desc())
+            .limit(limit)
+            .all())
+
+
+##############################################################################
+# Batch
+
+
+def load_graph():
+    """Map each user id to the sorted array of ids they follow."""
+
+    rows = (db.session
+            .connection()
+            .execution_options(stream_results=True)
+            .execute(select([Follows.user_following_id,
+                             Follows.user_being_followed_id])
+                     .order_by(Follows.user_following_id,
+                               Follows.user_being_followed_id)))
+
+    following = {}
+    for follower, followed in rows:
+        ids = following.get(follower)
+        if ids is None:
+            ids = following[follower] = array('l')
+        ids.append(followed)
+    return following
+
+
+def activity(now=None):
+    """Score bonus per user id for messages posted in the last
+    `ACTIVITY_DAYS`."""
+
+    since = (now or datetime.utcnow()) - timedelta(days=ACTIVITY_DAYS)
+    rows = (db.session
+            .query(Message.user_id, func.count())
+            .filter(Message.timestamp >= since)
+            .group_by(Message.user_id))
+    return {user_id: ACTIVITY_WEIGHT * math.log1p(n) for user_id, n in rows}
+
+
+def candidates(user_id, following, bonus, top_k=DEFAULT_TOP_K):
+    """`user_id`'s top `top_k` candidates as (score, candidate id, mutuals),
+    best first."""
+
+    followed = following.get(user_id, ())
+
+    mutuals = Counter()
+    for followed_id in followed:
+        mutuals.update(following.get(followed_id, ()))
+
+    skip = set(followed)
+    skip.add(user_id)
+
+    return heapq.nlargest(top_k, (
+        (n + bonus.get(candidate_id, 0), candidate_id, n)
+        for candidate_id, n in mutuals.items() if candidate_id not in skip))
+
+
+def rebuild(top_k=DEFAULT_TOP_K):
+    """Recompute every user's suggestions; returns the number of rows.
+    Callers commit."""
+
+    following = load_graph()
+    bonus = activity()
+
+    Suggestion.query.delete(synchronize_session=False)
+
+    table = Suggestion.__table__
+    rows, written = [], 0
+    for user_id in following:
+        rows.extend(dict(user_id=user_id, candidate_id=candidate_id,
+                         mutuals=n, score=score)
+                    for score, candidate_id, n in
+                    candidates(user_id, following, bonus, top_k))
+
+        if len(rows) >= CHUNK_SIZE:
+            db.session.execute(table.insert(), rows)
+            written += len(rows)
+            rows = []
+
+    if rows:
+        db.session.execute(table.insert(), rows)
+        written += len(rows)
+
+    return written
+
+
+##############################################################################
+# Incremental updates
+
+
+def _insert_ignore_from(table, columns, query):
+    """Insert the rows of `query` that aren't there already."""
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = (pg_insert(table).from_select(columns, query)
+                .on_conflict_do_nothing())
+    else:
+        stmt = table.insert().from_select(columns, query).prefix_with(
+            'OR IGNORE')
+    db.session.execute(stmt)
+
+
+def _adjust(delta, match, new_pairs=None):
+    """Add `delta` mutuals to the rows matching `match`, then insert
+    `new_pairs` (a select of rows to add if missing) or, when taking
+    mutuals away, drop rows left with none."""
+
+    table = Suggestion.__table__
+
+    db.session.execute(table.update().where(match).values(
+        mutuals=table.c.mutuals + delta, score=table.c.score + delta))
+
+    if new_pairs is not None:
+        _insert_ignore_from(table, COLUMNS, new_pairs)
+    else:
+        db.session.execute(table.delete().where(
+            and_(match, table.c.mutuals <= 0)))
+
+
+def _within_limit(user_id, column):
+    count = db.session.query(column).filter(User.id == user_id).scalar()
+    return (count or 0) <= INCREMENTAL_LIMIT
+
+
+def _follows_of(user_id):
+    return select([Follows.user_being_followed_id]).where(
+        Follows.user_following_id == user_id)
+
+
+def _followers_of(user_id):
+    return select([Follows.user_following_id]).where(
+        Follows.user_being_followed_id == user_id)
+
+
+def followed(user_id, followed_id):
+    """`user_id` has just started following `followed_id`."""
+
+    table = Suggestion.__table__
+
+    (Suggestion
+     .query
+     .filter(Suggestion.user_id == user_id,
+             Suggestion.candidate_id == followed_id)
+     .delete(synchronize_session=False))
+
+    # whoever followed_id follows, for user_id
+    if _within_limit(followed_id, User.following_count):
+        candidate = Follows.user_being_followed_id
+        _adjust(1,
+                and_(table.c.user_id == user_id,
+                     table.c.candidate_id.in_(_follows_of(followed_id))),
+                select([literal(user_id), candidate, literal(1),
+                        literal(1.0)])
+                .where(and_(Follows.user_following_id == followed_id,
+                            candidate != user_id,
+                            ~candidate.in_(_follows_of(user_id)))))
+
+    # followed_id, for whoever follows user_id
+    if _within_limit(user_id, User.followers_count):
+        follower = Follows.user_following_id
+        _adjust(1,
+                and_(table.c.candidate_id == followed_id,
+                     table.c.user_id.in_(_followers_of(user_id))),
+                select([follower, literal(followed_id), literal(1),
+                        literal(1.0)])
+                .where(and_(Follows.user_being_followed_id == user_id,
+                            follower != followed_id,
+                            ~follower.in_(_followers_of(followed_id)))))
+
+
+def unfollowed(user_id, followed_id):
+    """`user_id` has just stopped following `followed_id`."""
+
+    table = Suggestion.__table__
+
+    # followed_id is a candidate again if others user_id follows follow them
+    mutuals = (db.session
+               .query(func.count())
+               .filter(Follows.user_being_followed_id == followed_id,
+                       Follows.user_following_id.in_(_follows_of(user_id)))
+               .scalar())
+    if mutuals:
+        _insert_ignore_from(table, COLUMNS, select([
+            literal(user_id), literal(followed_id), literal(mutuals),
+            literal(float(mutuals))]))
+
+    if _within_limit(followed_id, User.following_count):
+        _adjust(-1, and_(table.c.user_id == user_id,
+                         table.c.candidate_id.in_(_follows_of(followed_id))))
+
+    if _within_limit(user_id, User.followers_count):
+        _adjust(-1, and_(table.c.candidate_id == followed_id,
+                         table.c.user_id.in_(_followers_of(user_id))))
@@ -0,0 +1,119 @@
+"""Hashtags and mentions in warbles.
+
+`add()` runs when a message is posted: it pulls `#hashtags` and
+`@mentions` out of the text with `extract()`, stores them in
+`message_tags` (with the sigil, lowercased) and counts them for trending.
+`/tags/<tag>` pages through a tag's messages newest first along the
+`(tag, timestamp)` index, joined to `messages` on the timestamp as well so
+Postgres only visits the partitions it needs.
+
+Messages posted before this existed, or bulk loaded, get their tags from
+`flask rebuild-tags`.
+"""
+
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_
+
+from models import db, Message, MessageTag
+import pagination
+import partitions
+import trending
+
+MAX_LENGTH = 64
+CHUNK_SIZE = 5000
+
+TAG = re.compile(r'(?<![\w#@])([#@])(\w{1,%d})\b' % MAX_LENGTH)
+
+# keyset for paging a tag's messages; matches ix_message_tags_tag_timestamp
+TAG_KEY = [MessageTag.timestamp, MessageTag.message_id]
+
+
+def extract(text):
+    """Sorted distinct tags (`#tag`, `@username`) in `text`."""
+
+    return sorted({sigil + word.lower()
+                   for sigil, word in TAG.findall(text or '')})
+
+
+def normalize(tag):
+    """A tag as it appears in a URL (`python`, `@alice`) as it is stored."""
+
+    tag = tag.lower()
+    return tag if tag.startswith(('#', '@')) else '#' + tag
+
+
+def add(message):
+    """Store the tags of a new (flushed) message; returns them."""
+
+    found = extract(message.text)
+    if found:
+        db.session.execute(MessageTag.__table__.insert(), [
+            dict(tag=tag, message_id=message.id, timestamp=message.timestamp)
+            for tag in found
+        ])
+        trending.record_post(found)
+    return found
+
+
+def paginate(tag, before=None, after=None,
+             per_page=pagination.MESSAGES_PER_PAGE):
+    """One page of `tag`'s messages, newest first."""
+
+    query = (Message
+             .visible()
+             .join(MessageTag, and_(MessageTag.message_id == Message.id,
+                                    MessageTag.timestamp == Message.timestamp))
+             .filter(MessageTag.tag == tag))
+
+    return pagination.paginate(query, TAG_KEY, pagination.message_key,
+                               pagination.message_cursor, before, after,
+                               per_page, windows=partitions.windows())
+
+
+def linkify(text):
+    """`text`, escaped, with its tags linked to their pages (template
+    filter)."""
+
+    parts, end = [], 0
+    for match in TAG.finditer(text or ''):
+        sigil, word = match.groups()
+        path = word.lower() if sigil == '#' else sigil + word.lower()
+        parts.append(escape(text[end:match.start()]))
+        parts.append(Markup('<a href="/tags/{}">{}</a>').format(
+            path, match.group()))
+        end = match.end()
+    parts.append(escape((text or '')[end:]))
+
+    return Markup('').join(parts)
+
+
+def rebuild(report=print):
+    """Re-extract the tags of every message; returns how many rows.
+    Callers commit."""
+
+    MessageTag.query.delete(synchronize_session=False)
+
+    table = MessageTag.__table__
+    written = last_id = 0
+    while True:
+        chunk = (db.session
+                 .query(Message.id, Message.text, Message.timestamp)
+                 .filter(Message.id > last_id)
+                 .order_by(Message.id)
+                 .limit(CHUNK_SIZE)
+                 .all())
+        if not chunk:
+            break
+
+        rows = [dict(tag=tag, message_id=msg_id, timestamp=timestamp)
+                for msg_id, text, timestamp in chunk
+                for tag in extract(text)]
+        if rows:
+            db.session.execute(table.insert(), rows)
+        written += len(rows)
+        last_id = chunk[-1].id
+        report(f"tags: {last_id} messages read, {written} tags")
+
+    return written
@@ -0,0 +1,288 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_accounts.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import (db, User, Message, Follows, Likes, TimelineEntry,
+                    MessageTag, Suggestion, Job)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import accounts
+import fragments
+import jobs
+import social
+import tags
+import timeline
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class AccountsTestCase(TestCase):
+    """ann is deleted; bob follows and likes her, she follows and likes
+    cat."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('ann', 'bob', 'cat')]
+        db.session.add_all(users)
+        db.session.flush()
+        self.ann, self.bob, self.cat = (u.id for u in users)
+
+        social.follow(self.bob, self.ann)
+        social.follow(self.ann, self.cat)
+
+        self.ann_messages = []
+        for i in range(5):
+            msg = Message(text=f"ann #{i}", user_id=self.ann)
+            db.session.add(msg)
+            db.session.flush()
+            timeline.fan_out(msg)
+            tags.add(msg)
+            self.ann_messages.append(msg.id)
+        cat_msg = Message(text="cat", user_id=self.cat)
+        db.session.add(cat_msg)
+        db.session.flush()
+        timeline.fan_out(cat_msg)
+        self.cat_message = cat_msg.id
+
+        for msg_id in self.ann_messages[:3]:
+            social.like(self.bob, msg_id)
+        social.like(self.ann, self.ann_messages[0])
+        social.like(self.ann, self.cat_message)
+        db.session.add(Suggestion(user_id=self.ann, candidate_id=self.bob,
+                                  mutuals=1, score=1.0))
+        db.session.add(Suggestion(user_id=self.bob, candidate_id=self.ann,
+                                  mutuals=1, score=1.0))
+        db.session.commit()
+
+    def tearDown(self):
+        jobs.configure(jobs.INLINE)
+        db.session.rollback()
+
+    def assert_purged(self):
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(self.ann))
+        self.assertEqual(Message.query.filter_by(user_id=self.ann).count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(
+            [(like.user_id, like.message_id) for like in Likes.query], [])
+        self.assertEqual(
+            [(e.user_id, e.message_id) for e in TimelineEntry.query],
+            [(self.cat, self.cat_message)])
+        self.assertEqual(MessageTag.query.count(), 0)
+        self.assertEqual(
+            Suggestion.query.filter((Suggestion.user_id == self.ann) |
+                                    (Suggestion.candidate_id == self.ann))
+            .count(), 0)
+
+        bob, cat = User.query.get(self.bob), User.query.get(self.cat)
+        self.assertEqual((bob.following_count, bob.likes_count), (0, 0))
+        self.assertEqual(cat.followers_count, 0)
+        self.assertEqual(Message.query.get(self.cat_message).like_count, 0)
+
+    def test_purge_in_batches(self):
+        batches = 0
+        while not accounts.purge_batch(self.ann, limit=2):
+            db.session.commit()
+            batches += 1
+        db.session.commit()
+
+        # 1 following, 1 follower, 2 likes, 3 liked, 6 in her feed, 5 in
+        # bob's, 5 messages and the suggestions, at most 2 at a time
+        self.assertEqual(batches, 1 + 1 + 1 + 2 + 3 + 3 + 3 + 1)
+        self.assert_purged()
+
+    def test_purge_bounds_suggestions(self):
+        """Are a user's own suggestions deleted `limit` at a time too?"""
+
+        others = [User(email=f"s{i}@test.com", username=f"s{i}",
+                       password="HASHED_PASSWORD") for i in range(4)]
+        db.session.add_all(others)
+        db.session.flush()
+        db.session.add_all(Suggestion(user_id=self.ann, candidate_id=u.id,
+                                      mutuals=1, score=1.0) for u in others)
+        db.session.commit()
+
+        for step in accounts.STEPS[:-1]:
+            while step(self.ann, 2):
+                pass
+        self.assertEqual(
+            [accounts._suggestions(self.ann, 2) for i in range(4)],
+            [2, 2, 1, 0])
+
+    def test_purge(self):
+        self.assertEqual(accounts.purge(self.ann), 9)
+        self.assert_purged()
+
+    def test_purge_commits_each_batch(self):
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(db.session, 'after_commit', listener)
+        try:
+            accounts.configure(2)
+            batches = accounts.purge(self.ann)
+        finally:
+            accounts.configure(accounts.DEFAULT_BATCH_SIZE)
+            event.remove(db.session, 'after_commit', listener)
+
+        self.assertEqual(batches, 16)
+        self.assertEqual(len(commits), batches)
+        self.assert_purged()
+
+    def test_delete_view(self):
+        """Does the request (inline executor) only do the first step?"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ann
+
+        resp = client.post("/users/delete")
+        self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        self.assertIsNotNone(User.query.get(self.ann).deleted_at)
+        self.assertEqual(User.query.get(self.cat).followers_count, 0)
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(accounts.deleted_user_ids(), [self.ann])
+
+        result = app.test_cli_runner().invoke(args=['purge-users'])
+        self.assertIn(f"user {self.ann} purged", result.output)
+        self.assert_purged()
+
+    def test_soft_delete_then_purge(self):
+        jobs.configure(jobs.QUEUE)
+        accounts.configure(2)
+        try:
+            accounts.delete(self.ann)
+            db.session.commit()
+
+            # hidden straight away, purged by the worker
+            self.assertFalse(User.authenticate('ann', 'anything'))
+            self.assertIsNone(user_cache.get_snapshot(self.ann))
+            self.assertEqual(accounts.deleted_user_ids(), [self.ann])
+            self.assertIsNotNone(User.query.get(self.ann))
+
+            self.assertEqual(jobs.work(app, burst=True), 16)
+        finally:
+            accounts.configure(accounts.DEFAULT_BATCH_SIZE)
+
+        self.assert_purged()
+        self.assertEqual({job.status for job in Job.query}, {jobs.DONE})
+        self.assertEqual(accounts.deleted_user_ids(), [])
+
+    def test_soft_deleted_is_hidden(self):
+        """Is a user waiting to be purged gone from profiles, listings,
+        search and suggestions?"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.bob
+        self.assertIn(b"<p>@ann</p>", client.get("/search?q=ann").data)
+
+        jobs.configure(jobs.QUEUE)
+        accounts.delete(self.ann)
+        db.session.commit()
+
+        self.assertEqual(client.get(f"/users/{self.ann}").status_code, 404)
+        self.assertEqual(
+            client.get(f"/api/v1/users/{self.ann}").status_code, 404)
+        self.assertEqual(
+            client.get(f"/api/v1/users/{self.ann}/messages").status_code, 404)
+        self.assertEqual(
+            client.get(f"/api/v1/users/{self.cat}/followers").get_json()
+            ['items'], [])
+
+        self.assertNotIn(b"<p>@ann</p>", client.get("/users").data)
+        self.assertNotIn(b"<p>@ann</p>", client.get("/search?q=ann").data)
+        self.assertNotIn(b"<p>@ann</p>", client.get("/users/suggested").data)
+
+    def test_soft_deleted_follows_are_hidden(self):
+        """Is a user waiting to be purged gone from following/follower
+        lists, and can't be followed?"""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.cat
+        self.assertIn(b"<p>@ann</p>",
+                      client.get(f"/users/{self.cat}/followers").data)
+
+        jobs.configure(jobs.QUEUE)
+        accounts.delete(self.ann)
+        db.session.commit()
+
+        for path in ("following", "followers"):
+            self.assertEqual(
+                client.get(f"/users/{self.ann}/{path}").status_code, 404)
+        self.assertNotIn(b"<p>@ann</p>",
+                         client.get(f"/users/{self.cat}/followers").data)
+        self.assertNotIn(b"<p>@ann</p>",
+                         client.get(f"/users/{self.bob}/following").data)
+
+        resp = client.post(f"/users/follow/{self.ann}")
+        self.assertEqual(resp.status_code, 404)
+        self.assertFalse(social.is_following(self.cat, self.ann))
+        db.session.expire_all()
+        self.assertEqual(User.query.get(self.ann).followers_count, 1)
+
+    def test_soft_deleted_messages_are_hidden(self):
+        """Are the warbles of a user waiting to be purged gone from feeds,
+        message pages, search, tags and likes?"""
+
+        msg_id = self.ann_messages[0]
+        link = f'href="/messages/{msg_id}"'.encode()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.bob
+
+        paths = ["/", "/search?q=ann", "/tags/0", "/users/likes"]
+        for path in paths:
+            self.assertIn(link, client.get(path).data, path)
+
+        jobs.configure(jobs.QUEUE)
+        accounts.delete(self.ann)
+        db.session.commit()
+
+        for path in paths:
+            self.assertNotIn(link, client.get(path).data, path)
+        self.assertEqual(client.get(f"/messages/{msg_id}").status_code, 404)
+
+        feed = client.get("/api/v1/timeline").get_json()['items']
+        self.assertEqual([item['id'] for item in feed], [])
+        self.assertEqual(
+            client.post(f"/api/v1/messages/{msg_id}/like").status_code, 404)
+
+    def test_orm_delete_loads_nothing(self):
+        """Does session.delete() leave the children to the database?"""
+
+        db.session.delete(User.query.get(self.ann))
+        db.session.commit()
+
+        self.assertIsNone(User.query.get(self.ann))
+        self.assertEqual(Message.query.filter_by(user_id=self.ann).count(), 0)
@@ -0,0 +1,137 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import social
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.flush()
+        social.follow(self.reader.id, self.author.id)
+
+        start = datetime(2020, 1, 1)
+        for i in range(3):
+            msg = Message(text=f"warble {i}", user_id=self.author.id,
+                          timestamp=start + timedelta(minutes=i))
+            db.session.add(msg)
+            db.session.flush()
+            timeline.fan_out(msg)
+        db.session.commit()
+
+        self.author_id, self.reader_id = self.author.id, self.reader.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_timeline_requires_login(self):
+        """Is an anonymous timeline request a JSON 401?"""
+
+        res = self.client.get("/api/v1/timeline")
+        self.assertEqual(res.status_code, 401)
+        self.assertIn('error', res.get_json())
+
+    def test_timeline_pages(self):
+        """Can a client walk the timeline with cursors?"""
+
+        self.login(self.reader_id)
+
+        res = self.client.get("/api/v1/timeline",
+                              query_string={'fields': 'id,text,liked'})
+        data = res.get_json()
+        self.assertEqual([m['text'] for m in data['items']],
+                         ["warble 2", "warble 1", "warble 0"])
+        self.assertEqual(set(data['items'][0]), {'id', 'text', 'liked'})
+        self.assertFalse(data['items'][0]['liked'])
+        self.assertIsNone(data['before'])
+
+    def test_unknown_field(self):
+        """Is asking for a field that doesn't exist a 400?"""
+
+        res = self.client.get(f"/api/v1/users/{self.author_id}",
+                              query_string={'fields': 'id,password'})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('password', res.get_json()['error'])
+
+    def test_profile_and_follows(self):
+        """Do profile and follow lists report the viewer's follows?"""
+
+        self.login(self.reader_id)
+
+        data = self.client.get(f"/api/v1/users/{self.author_id}").get_json()
+        self.assertEqual(data['username'], "author")
+        self.assertTrue(data['is_following'])
+
+        data = self.client.get(
+            f"/api/v1/users/{self.reader_id}/following").get_json()
+        self.assertEqual([u['id'] for u in data['items']], [self.author_id])
+
+        data = self.client.get(
+            f"/api/v1/users/{self.author_id}/followers").get_json()
+        self.assertEqual([u['username'] for u in data['items']], ["reader"])
+
+        data = self.client.get(
+            f"/api/v1/users/{self.author_id}/messages",
+            query_string={'fields': 'text'}).get_json()
+        self.assertEqual(len(data['items']), 3)
+
+    def test_toggle_like(self):
+        """Does the like endpoint toggle and report the new count?"""
+
+        self.login(self.reader_id)
+        msg_id = Message.query.filter_by(text="warble 0").one().id
+
+        data = self.client.post(f"/api/v1/messages/{msg_id}/like").get_json()
+        self.assertEqual(data, {'id': msg_id, 'liked': True, 'like_count': 1})
+
+        data = self.client.post(f"/api/v1/messages/{msg_id}/like").get_json()
+        self.assertEqual(data, {'id': msg_id, 'liked': False,
+                                'like_count': 0})
+
+        self.login(self.author_id)
+        res = self.client.post(f"/api/v1/messages/{msg_id}/like")
+        self.assertEqual(res.status_code, 403)
+
+        res = self.client.post("/api/v1/messages/999999/like")
+        self.assertEqual(res.status_code, 404)
@@ -0,0 +1,112 @@
+"""Benchmark harness tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_benchmark.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import benchmark
+
+db.create_all()
+
+
+class BenchmarkTestCase(TestCase):
+    """Test the drivers, the report and comparing reports."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        for i in range(2):
+            u = User.signup(f"user{i}", f"u{i}@test.com",
+                            benchmark.BENCH_PASSWORD, None)
+            db.session.flush()
+            db.session.add(Message(text=f"warble {i}", user_id=u.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_run(self):
+        """Does each driver report every scenario without errors?"""
+
+        report = benchmark.run(['client', 'http'], list(benchmark.SCENARIOS),
+                               requests=4, concurrency=2, warmup=1,
+                               report=lambda line: None)
+
+        self.assertEqual(report['meta']['dataset']['users'], 2)
+        for driver in ('client', 'http'):
+            results = report['results'][driver]
+            self.assertEqual(set(results), set(benchmark.SCENARIOS))
+            for stats in results.values():
+                self.assertEqual(stats['requests'], 4)
+                self.assertEqual(stats['errors'], 0)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+                self.assertGreater(stats['queries_per_request'], 0)
+
+    def test_servers(self):
+        """Do both serving modes answer under slow clients?"""
+
+        report = benchmark.run_servers(
+            ['threads', 'gevent'], ['homepage', 'follow_toggle'],
+            requests=4, concurrency=2, warmup=1, threads=2, slow_clients=2,
+            slow_seconds=0.2, report=lambda line: None)
+
+        self.assertEqual(report['meta']['slow_clients'], 2)
+        for mode in ('threads', 'gevent'):
+            for stats in report['results'][mode].values():
+                self.assertEqual(stats['requests'], 4)
+                self.assertEqual(stats['errors'], 0)
+                self.assertIsNone(stats['queries_per_request'])
+
+    def test_deletes(self):
+        """Does each deletion method remove the user it adds?"""
+
+        report = benchmark.run_deletes([3, 6], followers=2, batch_size=2,
+                                       report=lambda line: None)
+
+        for method in benchmark.DELETE_METHODS:
+            self.assertEqual(set(report['results'][method]), {'3', '6'})
+        self.assertGreater(report['results']['purge']['6']['batches'],
+                           report['results']['purge']['3']['batches'])
+        self.assertEqual(report['results']['cascade']['6']['batches'], 1)
+        self.assertEqual(User.query.count(), 2)
+        self.assertEqual(Message.query.count(), 2)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+    def test_compare(self):
+        """Are slowdowns past the threshold and extra queries flagged?"""
+
+        def report(p95, queries):
+            return {'results': {'client': {'homepage': {
+                'p50_ms': 1.0, 'p95_ms': p95, 'p99_ms': p95,
+                'throughput_rps': 100.0, 'queries_per_request': queries}}}}
+
+        lines, regressions = benchmark.compare(report(10.0, 3),
+                                               report(11.0, 3))
+        self.assertEqual(regressions, [])
+
+        lines, regressions = benchmark.compare(report(10.0, 3),
+                                               report(15.0, 4))
+        self.assertEqual(len(regressions), 2)
@@ -0,0 +1,146 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import social
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class CountersTestCase(TestCase):
+    """Test that views keep counters in step with the source tables."""
+
+    def setUp(self):
+        """Create test client and two users."""
+
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        u1 = User(email="one@test.com", username="one", password="HASHED")
+        u2 = User(email="two@test.com", username="two", password="HASHED")
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_views_maintain_counters(self):
+        """Do posting, following and liking update the counters?"""
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post("/messages/new", data={"text": "counted"})
+            msg = Message.query.one()
+
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post(f"/users/add_like/{msg.id}", headers={"Referer": "/"})
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u1.followers_count, 1)
+        self.assertEqual(u2.following_count, 1)
+        self.assertEqual(u2.likes_count, 1)
+        self.assertEqual(Message.query.get(msg.id).like_count, 1)
+
+        with self.client as c:
+            self.login(c, self.u2_id)
+            c.post(f"/users/stop-following/{self.u1_id}")
+
+            self.login(c, self.u1_id)
+            c.post(f"/messages/{msg.id}/delete")
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual(u1.messages_count, 0)
+        self.assertEqual(u1.followers_count, 0)
+        self.assertEqual(u2.following_count, 0)
+        self.assertEqual(u2.likes_count, 0)
+
+    def test_adjust_users_invalidates(self):
+        """Do bulk counter changes show in cached snapshots straight
+        away?"""
+
+        for user_id in (self.u1_id, self.u2_id):
+            self.assertEqual(
+                user_cache.get_snapshot(user_id).followers_count, 0)
+
+        counters.adjust_users([self.u1_id, self.u2_id], followers_count=2)
+        db.session.commit()
+
+        for user_id in (self.u1_id, self.u2_id):
+            self.assertEqual(
+                user_cache.get_snapshot(user_id).followers_count, 2)
+
+    def test_message_deleted_invalidates_likers(self):
+        """Does deleting a liked message show in the likers' cached
+        snapshots straight away?"""
+
+        msg = Message(text="liked", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.flush()
+        social.like(self.u2_id, msg.id)
+        db.session.commit()
+        self.assertEqual(user_cache.get_snapshot(self.u2_id).likes_count, 1)
+
+        counters.message_deleted(msg)
+        db.session.delete(msg)
+        db.session.commit()
+
+        self.assertEqual(user_cache.get_snapshot(self.u2_id).likes_count, 0)
+
+    def test_reconcile_fixes_drift(self):
+        """Does reconcile() recompute counters from rows added directly?"""
+
+        msg = Message(text="raw", user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.add(Follows(user_being_followed_id=self.u1_id,
+                               user_following_id=self.u2_id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u2_id, message_id=msg.id))
+        db.session.commit()
+
+        counters.reconcile()
+        db.session.commit()
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u1.followers_count, 1)
+        self.assertEqual(u2.following_count, 1)
+        self.assertEqual(u2.likes_count, 1)
+        self.assertEqual(Message.query.get(msg.id).like_count, 1)
@@ -0,0 +1,156 @@
+"""Rendered-fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test eviction, versions and owner invalidation of the cache."""
+
+    def setUp(self):
+        self.cache = fragments.FragmentCache(maxsize=2)
+
+    def test_lru_eviction(self):
+        """Is the least recently used fragment evicted first?"""
+
+        self.cache.set('a', 1, 0, 'A')
+        self.cache.set('b', 1, 0, 'B')
+        self.cache.get('a', 0)
+        self.cache.set('c', 2, 0, 'C')
+
+        self.assertEqual(self.cache.get('a', 0), 'A')
+        self.assertIsNone(self.cache.get('b', 0))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_version_mismatch(self):
+        """Is a fragment for an older profile version a miss?"""
+
+        self.cache.set('a', 1, 0, 'A')
+
+        self.assertIsNone(self.cache.get('a', 1))
+        self.assertEqual(self.cache.get('a', 0), 'A')
+
+    def test_invalidate_owner(self):
+        """Are all of a user's fragments dropped together?"""
+
+        self.cache.set('a', 1, 0, 'A')
+        self.cache.set('b', 2, 0, 'B')
+        self.cache.invalidate_owner(1)
+
+        self.assertIsNone(self.cache.get('a', 0))
+        self.assertEqual(self.cache.get('b', 0), 'B')
+        self.assertNotIn(1, self.cache.owned)
+
+
+class FragmentViewsTestCase(TestCase):
+    """Test cached markup through the views."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.author = User.signup("author", "author@test.com", "password",
+                                  "/static/images/default-pic.png")
+        self.reader = User.signup("reader", "reader@test.com", "password",
+                                  "/static/images/default-pic.png")
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=self.author.id,
+                               user_following_id=self.reader.id))
+
+        self.msg = Message(text="first warble", user_id=self.author.id,
+                           timestamp=datetime(2020, 1, 1))
+        db.session.add(self.msg)
+        db.session.flush()
+        timeline.fan_out(self.msg)
+        db.session.commit()
+
+        self.author_id, self.reader_id = self.author.id, self.reader.id
+        self.msg_id = self.msg.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_buttons_not_cached(self):
+        """Does each viewer get their own like and follow buttons?"""
+
+        self.login(self.reader_id)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("first warble", html)
+        self.assertIn(f"/users/add_like/{self.msg_id}", html)
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertIn(f"/users/stop-following/{self.author_id}", html)
+
+        self.login(self.author_id)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("first warble", html)
+        self.assertNotIn(f"/users/add_like/{self.msg_id}", html)
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertNotIn(f"/users/stop-following/{self.author_id}", html)
+
+    def test_profile_edit_rerenders(self):
+        """Do cards and messages show a new username after an edit?"""
+
+        self.login(self.reader_id)
+        self.client.get("/")
+        self.client.get("/users")
+        self.assertGreater(fragments.stats()['size'], 0)
+
+        self.login(self.author_id)
+        self.client.post("/users/profile", data={
+            "username": "renamed",
+            "email": "author@test.com",
+            "image_url": "/static/images/default-pic.png",
+            "header_image_url": "/static/images/warbler-hero.jpg",
+            "bio": "",
+            "password": "password",
+        })
+
+        self.login(self.reader_id)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("@renamed", html)
+        html = self.client.get("/users").get_data(as_text=True)
+        self.assertIn("@renamed", html)
+        self.assertNotIn("@author", html)
+
+    def test_message_delete_invalidates(self):
+        """Is a deleted message's markup dropped?"""
+
+        self.login(self.author_id)
+        self.client.get(f"/users/{self.author_id}")
+        self.assertIsNotNone(
+            fragments.cache.get(('message', self.msg_id), 0))
+
+        self.client.post(f"/messages/{self.msg_id}/delete")
+        self.assertIsNone(fragments.cache.get(('message', self.msg_id), 0))
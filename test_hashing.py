@@ -0,0 +1,142 @@
+"""Password hashing service tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import hashing
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class HashingServiceTestCase(TestCase):
+    """Test the service on its own, inline and pooled."""
+
+    def test_hash_and_check(self):
+        """Does a hash verify the right password only, at the set cost?"""
+
+        service = hashing.HashingService(workers=0, rounds=4)
+        pw_hash = service.generate_password_hash("secret")
+
+        self.assertTrue(pw_hash.startswith("$2b$04$"))
+        self.assertTrue(service.check_password_hash(pw_hash, "secret"))
+        self.assertFalse(service.check_password_hash(pw_hash, "wrong"))
+
+    def test_pool(self):
+        """Do calls work when run in worker processes?"""
+
+        service = hashing.HashingService(workers=1, rounds=4)
+        try:
+            pw_hash = service.generate_password_hash("secret")
+            self.assertTrue(service.check_password_hash(pw_hash, "secret"))
+        finally:
+            service.shutdown()
+
+    def test_needs_rehash(self):
+        """Are hashes below the current cost flagged?"""
+
+        old = hashing.HashingService(workers=0, rounds=4)
+        new = hashing.HashingService(workers=0, rounds=5)
+        pw_hash = old.generate_password_hash("secret")
+
+        self.assertTrue(new.needs_rehash(pw_hash))
+        self.assertFalse(old.needs_rehash(pw_hash))
+        self.assertFalse(new.needs_rehash("not a bcrypt hash"))
+
+    def test_busy(self):
+        """Is a call refused once the queue is full?"""
+
+        service = hashing.HashingService(workers=0, max_pending=1, rounds=4)
+        service.slots.acquire()
+
+        with self.assertRaises(hashing.HashingBusy):
+            service.generate_password_hash("secret")
+
+        service.slots.release()
+        self.assertTrue(service.generate_password_hash("secret"))
+
+
+    def test_timeout(self):
+        """Does a call that takes too long raise HashingBusy, and keep its
+        slot until it really finishes?"""
+
+        service = hashing.HashingService(workers=1, max_pending=1,
+                                         timeout=0.05,
+                                         executor=ThreadPoolExecutor)
+        done = threading.Event()
+        try:
+            with self.assertRaises(hashing.HashingBusy):
+                service._run(done.wait, 5)
+            with self.assertRaises(hashing.HashingBusy):
+                service._run(done.wait, 5)
+        finally:
+            done.set()
+            service.shutdown()
+
+        self.assertTrue(service._run(done.wait, 5))
+        service.shutdown()
+
+
+class HashingViewsTestCase(TestCase):
+    """Test rehash-on-login and backpressure through the app."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        self.saved = hashing.service
+        hashing.service = hashing.HashingService(workers=0, rounds=4)
+
+        User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        hashing.service = self.saved
+        db.session.rollback()
+
+    def test_rehash_on_login(self):
+        """Is a low-cost hash upgraded when its owner logs in?"""
+
+        hashing.service = hashing.HashingService(workers=0, rounds=5)
+
+        resp = self.client.post("/login", data={"username": "testuser",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        pw_hash = User.query.filter_by(username="testuser").one().password
+        self.assertTrue(pw_hash.startswith("$2b$05$"))
+        self.assertTrue(User.authenticate("testuser", "password"))
+
+    def test_login_when_busy(self):
+        """Does a saturated service answer 429?"""
+
+        hashing.service = hashing.HashingService(workers=0, max_pending=0)
+
+        resp = self.client.post("/login", data={"username": "testuser",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers['Retry-After'], '1')
@@ -0,0 +1,157 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import counters
+import http_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class HttpCacheTestCase(TestCase):
+    """Test Cache-Control policies, ETags and static fingerprints."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.flush()
+
+        self.msg = Message(text="a warble", user_id=self.author.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+        self.author_id, self.reader_id = self.author.id, self.reader.id
+        self.msg_id = self.msg.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_static_fingerprint(self):
+        """Are linked static files fingerprinted and cached for long?"""
+
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn("/static/stylesheets/style.css?v=", html)
+
+        url = html.split('href="/static/stylesheets/style.css')[1]
+        url = "/static/stylesheets/style.css" + url.split('"')[0]
+        res = self.client.get(url)
+        self.assertIn("immutable", res.headers['Cache-Control'])
+
+        res = self.client.get("/static/stylesheets/style.css")
+        self.assertEqual(res.headers['Cache-Control'], "public, no-cache")
+
+    def test_release_covers_static(self):
+        """Does changing a static file (and so its `?v=`) change the ETags
+        of pages that link it?"""
+
+        static_folder = app.static_folder
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'style.css')
+            try:
+                app.static_folder = folder
+                releases = []
+                for css, mtime in (("a {}", 1000), ("b {}", 2000)):
+                    with open(path, 'w') as f:
+                        f.write(css)
+                    os.utime(path, (mtime, mtime))
+                    http_cache._release = None
+                    with app.app_context():
+                        releases.append(http_cache.release())
+            finally:
+                app.static_folder = static_folder
+                http_cache._release = None
+
+        self.assertNotEqual(releases[0], releases[1])
+
+    def test_anonymous_public(self):
+        """Can shared caches keep a message page for anonymous visitors?"""
+
+        res = self.client.get(f"/messages/{self.msg_id}")
+        self.assertEqual(res.headers['Cache-Control'], "public, max-age=300")
+        self.assertIn("Cookie", res.headers['Vary'])
+
+        self.login(self.reader_id)
+        res = self.client.get(f"/messages/{self.msg_id}")
+        self.assertEqual(res.headers['Cache-Control'], "private, no-cache")
+        self.assertIn("Cookie", res.headers['Vary'])
+
+    def test_message_not_modified(self):
+        """Is a repeat request answered 304, until the author changes?"""
+
+        self.login(self.reader_id)
+        url = f"/messages/{self.msg_id}"
+
+        res = self.client.get(url)
+        etag = res.headers['ETag']
+
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.get_data(), b"")
+        self.assertEqual(res.headers['ETag'], etag)
+
+        self.client.post(f"/users/follow/{self.author_id}")
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+        etag = res.headers['ETag']
+        User.query.filter_by(id=self.author_id).update(
+            {User.profile_version: User.profile_version + 1})
+        db.session.commit()
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+
+    def test_profile_not_modified(self):
+        """Does a new message change the profile page's ETag?"""
+
+        url = f"/users/{self.author_id}"
+        etag = self.client.get(url).headers['ETag']
+
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+        db.session.add(Message(text="another", user_id=self.author_id))
+        counters.adjust_user(self.author_id, messages_count=1)
+        db.session.commit()
+
+        res = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("another", res.get_data(as_text=True))
+
+    def test_missing_message(self):
+        """Is a missing message a 404 rather than an error?"""
+
+        self.assertEqual(self.client.get("/messages/999999").status_code, 404)
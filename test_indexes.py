@@ -0,0 +1,101 @@
+"""Query plan tests: hot queries must be served by indexes."""
+
+# run these tests like:
+#
+#    python -m unittest test_indexes.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Likes, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import pagination
+import timeline
+
+db.create_all()
+
+
+def explain(query):
+    """Return the database's query plan for `query` as one string.
+
+    Postgres would happily sequential-scan the tiny test tables, so sequential
+    scans are switched off: if the plan still has one, no index could serve
+    the query.
+    """
+
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == 'sqlite':
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+        else:
+            trans = conn.begin()
+            conn.execute('SET LOCAL enable_seqscan = off')
+            rows = conn.execute('EXPLAIN ' + str(compiled), params)
+            trans.rollback()
+        return "\n".join(str(row[-1]) for row in rows)
+
+
+class IndexTestCase(TestCase):
+    """Test that timeline, profile, follow and like queries use indexes."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def assertUsesIndex(self, query, index_name):
+        plan = explain(query)
+
+        self.assertIn(index_name, plan)
+        self.assertNotIn("Seq Scan", plan)
+        for line in plan.splitlines():
+            if line.startswith("SCAN"):
+                self.assertIn("USING", line, plan)
+
+    def test_homepage_feed(self):
+        """Is a feed page one range scan on the timeline index?"""
+
+        before = (datetime(2020, 1, 1), 10)
+        for cursor in (None, before):
+            query = pagination.keyset_query(timeline.feed_query(1),
+                                            timeline.FEED_KEY, before=cursor)
+            self.assertUsesIndex(query, "ix_timeline_entries_user_timestamp")
+
+    def test_profile_messages(self):
+        """Are a user's messages read newest-first from an index?"""
+
+        query = pagination.keyset_query(
+            Message.query.filter(Message.user_id == 1),
+            [Message.timestamp, Message.id])
+        self.assertUsesIndex(query, "ix_messages_user_timestamp")
+
+    def test_following_lookup(self):
+        """Does "who does X follow" use the reverse follows index?"""
+
+        query = (db.session
+                 .query(Follows.user_being_followed_id)
+                 .filter(Follows.user_following_id == 1))
+        self.assertUsesIndex(query, "ix_follows_user_following_id")
+
+    def test_like_toggle_lookup(self):
+        """Is the like_warble() lookup served by the unique likes index?"""
+
+        query = Likes.query.filter(Likes.user_id == 1, Likes.message_id == 2)
+        self.assertUsesIndex(query, "uq_likes_user_message")
@@ -0,0 +1,214 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Job, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import jobs
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+calls = []
+
+
+@jobs.task('test_record')
+def record(value):
+    calls.append(value)
+
+
+@jobs.task('test_chain')
+def chain(n):
+    calls.append(n)
+    if n:
+        jobs.enqueue('test_chain', n=n - 1)
+
+
+@jobs.task('test_fail')
+def fail(times):
+    calls.append('try')
+    if len(calls) <= times:
+        raise RuntimeError("not yet")
+
+
+class JobsTestCase(TestCase):
+    """Test queueing, running, retrying and measuring jobs."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+        calls.clear()
+        jobs.configure(jobs.QUEUE, attempts=3, backoff_seconds=10,
+                       lease_seconds=60)
+
+    def tearDown(self):
+        jobs.configure(jobs.INLINE)
+        db.session.rollback()
+
+    def test_inline(self):
+        jobs.configure(jobs.INLINE)
+        self.assertTrue(jobs.enqueue('test_record', value=1))
+        self.assertEqual(calls, [1])
+        self.assertEqual(Job.query.count(), 0)
+
+    def test_inline_chain(self):
+        """Does a task that enqueues its next step run it without
+        recursing?"""
+
+        jobs.configure(jobs.INLINE)
+        jobs.enqueue('test_chain', n=2000)
+        self.assertEqual(len(calls), 2001)
+        self.assertEqual(calls[-1], 0)
+
+    def test_enqueue_and_run(self):
+        self.assertTrue(jobs.enqueue('test_record', key='k', value=1))
+        self.assertFalse(jobs.enqueue('test_record', key='k', value=2))
+        self.assertTrue(jobs.enqueue('test_record', value=3))
+        db.session.commit()
+        self.assertEqual(calls, [])
+
+        self.assertEqual(jobs.work(app, burst=True), 2)
+        self.assertEqual(calls, [1, 3])
+        self.assertEqual({job.status for job in Job.query}, {jobs.DONE})
+
+        # the key is remembered until the job is pruned
+        self.assertFalse(jobs.enqueue('test_record', key='k', value=4))
+        Job.query.update({Job.finished_at: datetime(2000, 1, 1)})
+        self.assertEqual(jobs.prune(7), 2)
+        self.assertTrue(jobs.enqueue('test_record', key='k', value=4))
+
+    def test_unknown_task(self):
+        with self.assertRaises(KeyError):
+            jobs.enqueue('no_such_task')
+
+    def test_delayed(self):
+        jobs.enqueue('test_record', delay=60, value=1)
+        db.session.commit()
+        self.assertIsNone(jobs.run_next())
+        self.assertIsNotNone(jobs.claim(now=datetime.utcnow()
+                                        + timedelta(seconds=61)))
+
+    def test_retry_then_succeed(self):
+        jobs.enqueue('test_fail', times=1)
+        db.session.commit()
+
+        self.assertEqual(jobs.run_next(), jobs.QUEUED)
+        job = Job.query.one()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("not yet", job.error)
+        # first retry waits backoff +-50%
+        wait = (job.run_at - datetime.utcnow()).total_seconds()
+        self.assertTrue(4 < wait <= 15, wait)
+        self.assertIsNone(jobs.run_next())
+
+        job = jobs.claim(now=job.run_at)
+        self.assertEqual(jobs.run(job), jobs.DONE)
+        self.assertEqual(Job.query.one().attempts, 2)
+        self.assertIsNone(Job.query.one().error)
+
+    def test_gives_up(self):
+        jobs.enqueue('test_fail', times=10)
+        db.session.commit()
+
+        later = datetime.utcnow()
+        for attempt in range(3):
+            later += timedelta(hours=1)
+            jobs.run(jobs.claim(now=later))
+
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), (jobs.FAILED, 3))
+        self.assertEqual(calls, ['try'] * 3)
+        self.assertIsNone(jobs.claim(now=later + timedelta(days=1)))
+
+    def test_reclaims_stale(self):
+        jobs.enqueue('test_record', value=1)
+        db.session.commit()
+        job = jobs.claim()
+        self.assertEqual(job.status, jobs.RUNNING)
+
+        # its worker died: nobody else takes it until the lease is up
+        self.assertIsNone(jobs.claim())
+        job = jobs.claim(now=datetime.utcnow() + timedelta(seconds=61))
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(jobs.run(job), jobs.DONE)
+
+    def test_stats(self):
+        jobs.enqueue('test_record', value=1)
+        jobs.enqueue('test_record', value=2)
+        jobs.enqueue('test_record', delay=60, value=3)
+        db.session.commit()
+        jobs.run_next()
+
+        stats = jobs.stats(now=datetime.utcnow() + timedelta(seconds=10))
+        self.assertEqual((stats['queued'], stats['done'], stats['recent_done']),
+                         (2, 1, 1))
+        self.assertGreaterEqual(stats['oldest_due_seconds'], 10)
+
+    def test_delete_user_is_queued(self):
+        user = User(email="t@test.com", username="leaving",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        resp = client.post("/users/delete")
+        self.assertEqual(resp.status_code, 302)
+
+        self.assertIsNotNone(User.query.get(user_id))
+        self.assertEqual(jobs.work(app, burst=True), 1)
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(user_id))
+
+    def test_fan_out_is_queued(self):
+        author = User(email="a@test.com", username="author",
+                      password="HASHED_PASSWORD")
+        reader = User(email="r@test.com", username="reader",
+                      password="HASHED_PASSWORD")
+        db.session.add_all([author, reader])
+        db.session.flush()
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=reader.id))
+        db.session.commit()
+        author_id, reader_id = author.id, reader.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = author_id
+        client.post("/messages/new", data={"text": "queued"})
+
+        msg_id = Message.query.one().id
+        self.assertEqual(
+            [e.user_id for e in TimelineEntry.query], [author_id])
+
+        jobs.work(app, burst=True)
+        db.session.expire_all()
+        self.assertEqual(
+            sorted(e.user_id for e in TimelineEntry.query
+                   if e.message_id == msg_id),
+            sorted([author_id, reader_id]))
@@ -6,6 +6,7 @@
 
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, User, Message, Follows, Likes
@@ -22,7 +23,10 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 
-from app import app
+from app import app, CURR_USER_KEY
+import pagination
+import social
+import timeline
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -73,3 +77,85 @@ class LikeModelTestCase(TestCase):
         db.session.add(l)
         db.session.commit()
         self.assertEqual(len(u.likes), 1)
+
+
+class LikedPageTestCase(TestCase):
+    """Test the liked-messages page and the bulk liked lookup."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        fan = User(email="fan@test.com", username="fan",
+                   password="HASHED_PASSWORD")
+        author = User(email="author@test.com", username="author",
+                      password="HASHED_PASSWORD")
+        db.session.add_all([fan, author])
+        db.session.flush()
+        self.fan_id = fan.id
+
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=fan.id))
+        messages = [Message(text=f"warble {i}", user_id=author.id)
+                    for i in range(4)]
+        db.session.add_all(messages)
+        db.session.flush()
+        for msg in messages:
+            timeline.fan_out(msg)
+        self.ids = [m.id for m in messages]
+
+        # liked in the order 2, 0, 3 (newest last); 1 is not liked
+        start = datetime(2020, 1, 1)
+        for minutes, i in enumerate([2, 0, 3]):
+            db.session.add(Likes(user_id=fan.id, message_id=self.ids[i],
+                                 created_at=start + timedelta(minutes=minutes)))
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_liked_ids(self):
+        self.assertEqual(social.liked_ids(self.fan_id, self.ids),
+                         {self.ids[0], self.ids[2], self.ids[3]})
+        self.assertEqual(social.liked_ids(self.fan_id, [self.ids[1]]), set())
+        self.assertEqual(social.liked_ids(self.fan_id, []), set())
+
+    def test_liked_page(self):
+        """Are likes listed most recent first, a page at a time?"""
+
+        page = social.liked_page(self.fan_id, per_page=2)
+        self.assertEqual([m.id for m in page.items],
+                         [self.ids[3], self.ids[0]])
+        self.assertIsNone(page.after)
+
+        page = social.liked_page(
+            self.fan_id, per_page=2,
+            before=pagination.parse_message_cursor(page.before))
+        self.assertEqual([m.id for m in page.items], [self.ids[2]])
+        self.assertIsNone(page.before)
+
+        page = social.liked_page(
+            self.fan_id, per_page=2,
+            after=pagination.parse_message_cursor(page.after))
+        self.assertEqual([m.id for m in page.items],
+                         [self.ids[3], self.ids[0]])
+
+    def test_liked_view(self):
+        resp = self.client.get("/users/likes")
+        self.assertEqual(resp.status_code, 302)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.fan_id
+        html = self.client.get("/users/likes").get_data(as_text=True)
+        self.assertLess(html.index("warble 3"), html.index("warble 0"))
+        self.assertLess(html.index("warble 0"), html.index("warble 2"))
+        self.assertNotIn("warble 1", html)
+
+    def test_homepage_marks_likes(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.fan_id
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertEqual(html.count("btn-primary"), 3)
+        self.assertEqual(html.count("btn-secondary"), 1)
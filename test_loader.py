@@ -0,0 +1,118 @@
+"""Bulk CSV loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+from models import (db, User, Message, Follows, TimelineEntry, MessageTag,
+                    Suggestion)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import loader
+
+db.create_all()
+
+
+class LoaderTestCase(TestCase):
+    """Test streaming CSVs into an empty database."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.dir = tempfile.mkdtemp()
+        self.write('users.csv',
+                   ['email', 'username', 'image_url', 'password', 'bio',
+                    'header_image_url', 'location'],
+                   [[f"u{i}@test.com", f"user{i}", "", "HASHED_PASSWORD",
+                     "", "", "Nowhere"] for i in range(5)])
+        self.write('messages.csv', ['text', 'timestamp', 'user_id'],
+                   [[f"warble {i}", f"2020-01-0{i + 1} 10:00:00.000001",
+                     i % 2 + 1] for i in range(7)])
+        self.write('follows.csv',
+                   ['user_being_followed_id', 'user_following_id'],
+                   [[1, 3], [2, 3], [1, 4]])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        db.session.rollback()
+
+    def write(self, name, header, rows):
+        with open(os.path.join(self.dir, name), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    def test_load(self):
+        """Are rows, counters, timelines and indexes all in place?"""
+
+        lines = []
+        total = loader.load_csvs(self.dir, chunk_size=2, report=lines.append)
+
+        self.assertEqual(total, 15)
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Message.query.count(), 7)
+        self.assertEqual(Follows.query.count(), 3)
+        self.assertTrue(any(line.startswith("messages.csv: 7 rows")
+                            for line in lines))
+
+        u1 = User.query.get(1)
+        self.assertEqual((u1.messages_count, u1.followers_count), (4, 2))
+        self.assertEqual(User.query.get(3).following_count, 2)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=3).count(), 7)
+
+        names = {ix['name'] for ix in inspect(db.engine).get_indexes('messages')}
+        self.assertIn('ix_messages_user_timestamp', names)
+        names = {ix['name']
+                 for ix in inspect(db.engine).get_indexes('timeline_entries')}
+        self.assertIn('ix_timeline_entries_user_timestamp', names)
+
+    def test_derived_tables(self):
+        """Are tags and suggestions rebuilt from the loaded rows?"""
+
+        self.write('messages.csv', ['text', 'timestamp', 'user_id'],
+                   [["#hello @user2", "2020-01-01 10:00:00.000001", 1]])
+        self.write('follows.csv',
+                   ['user_being_followed_id', 'user_following_id'],
+                   [[1, 3], [2, 3], [3, 4]])
+
+        lines = []
+        loader.load_csvs(self.dir, report=lines.append)
+
+        self.assertEqual(sorted(t.tag for t in MessageTag.query),
+                         ['#hello', '@user2'])
+        self.assertEqual(
+            sorted((s.user_id, s.candidate_id) for s in Suggestion.query),
+            [(4, 1), (4, 2)])
+        self.assertTrue(any(line.startswith("tags: 2 rows")
+                            for line in lines))
+
+    def test_new_rows_after_load(self):
+        """Do ids for new rows continue past the loaded ones?"""
+
+        loader.load_csvs(self.dir, report=lambda line: None)
+
+        u = User(email="new@test.com", username="new",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.id, 6)
@@ -0,0 +1,124 @@
+"""Request instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import metrics
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class MetricsTestCase(TestCase):
+    """Test per-request recording, /metrics and the warnings."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u = User.signup("testuser", "test@test.com", "password", None)
+        db.session.commit()
+        self.user_id = u.id
+
+        metrics.reset()
+        app.config['EXPOSE_STATS'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['EXPOSE_STATS'] = False
+        metrics.configure(True, metrics.DEFAULT_SLOW_MS,
+                          metrics.DEFAULT_REPEAT_LIMIT)
+        db.session.rollback()
+
+    def series(self, name, endpoint):
+        histogram = metrics.registry.histograms[name]
+        counts = histogram.series[endpoint]
+        return sum(counts[:-1]), counts[-1]
+
+    def test_records_requests(self):
+        """Are statements, db, template and bcrypt time all recorded?"""
+
+        self.client.post('/login', data={'username': 'testuser',
+                                         'password': 'password'})
+        self.client.get(f"/users/{self.user_id}")
+
+        requests, statements = self.series('statements', 'users_show')
+        self.assertEqual(requests, 1)
+        self.assertGreater(statements, 0)
+        self.assertGreater(self.series('db_seconds', 'users_show')[1], 0)
+        self.assertGreater(self.series('template_seconds', 'users_show')[1], 0)
+
+        self.assertGreater(self.series('bcrypt_seconds', 'login')[1], 0)
+        self.assertEqual(self.series('bcrypt_seconds', 'users_show')[1], 0)
+
+    def test_metrics_page(self):
+        """Is /metrics Prometheus text, and hidden unless EXPOSE_STATS?"""
+
+        self.client.get('/users')
+        res = self.client.get('/metrics')
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn("# TYPE warbler_request_seconds histogram", text)
+        self.assertIn('warbler_request_seconds_count{endpoint="list_users"} 1',
+                      text)
+        self.assertIn('warbler_request_seconds_bucket{endpoint="list_users",'
+                      'le="+Inf"} 1', text)
+        self.assertIn("warbler_user_cache_hits", text)
+
+        app.config['EXPOSE_STATS'] = False
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_slow_request_logged(self):
+        metrics.configure(True, 0, metrics.DEFAULT_REPEAT_LIMIT)
+
+        with self.assertLogs('metrics', 'WARNING') as logs:
+            self.client.get('/users')
+
+        self.assertIn("slow request GET /users", logs.output[0])
+        self.assertEqual(metrics.registry.slow['list_users'], 1)
+
+    def test_repeated_statements_flagged(self):
+        """Is a statement run once per row reported as a likely N+1?"""
+
+        for i in range(3):
+            db.session.add(Message(text=f"warble {i}", user_id=self.user_id))
+        db.session.commit()
+        metrics.configure(True, metrics.DEFAULT_SLOW_MS, 3)
+
+        with app.test_request_context('/'):
+            metrics.start_request()
+            for m in Message.query.all():
+                db.session.expire(m)
+                m.text
+            with self.assertLogs('metrics', 'WARNING') as logs:
+                metrics.finish_request()
+
+        self.assertIn("same statement 3 times", logs.output[0])
+        self.assertEqual(metrics.registry.repeated['homepage'], 1)
+
+    def test_disabled(self):
+        metrics.configure(False, metrics.DEFAULT_SLOW_MS,
+                          metrics.DEFAULT_REPEAT_LIMIT)
+        self.client.get('/users')
+        self.assertEqual(metrics.registry.histograms['seconds'].series, {})
@@ -0,0 +1,112 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import pagination
+
+db.create_all()
+
+
+class PaginationTestCase(TestCase):
+    """Test cursor pages over messages and users."""
+
+    def setUp(self):
+        """Create a user with five messages a minute apart."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        u = User(email="test@test.com", username="testuser",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+
+        start = datetime(2020, 1, 1)
+        for i in range(5):
+            db.session.add(Message(text=f"warble {i}", user_id=u.id,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_message_pages_walk_back_and_forth(self):
+        """Do before/after cursors page newest-first without overlap?"""
+
+        query = Message.query.filter(Message.user_id == self.user_id)
+
+        first = pagination.paginate_messages(query, per_page=2)
+        self.assertEqual([m.text for m in first.items],
+                         ["warble 4", "warble 3"])
+        self.assertIsNone(first.after)
+
+        second = pagination.paginate_messages(
+            query, before=pagination.parse_message_cursor(first.before),
+            per_page=2)
+        self.assertEqual([m.text for m in second.items],
+                         ["warble 2", "warble 1"])
+
+        last = pagination.paginate_messages(
+            query, before=pagination.parse_message_cursor(second.before),
+            per_page=2)
+        self.assertEqual([m.text for m in last.items], ["warble 0"])
+        self.assertIsNone(last.before)
+
+        back = pagination.paginate_messages(
+            query, after=pagination.parse_message_cursor(second.after),
+            per_page=2)
+        self.assertEqual([m.text for m in back.items],
+                         ["warble 4", "warble 3"])
+        self.assertIsNone(back.after)
+
+    def test_user_pages(self):
+        """Are users paged in id order with an `after` cursor?"""
+
+        for i in range(3):
+            db.session.add(User(email=f"u{i}@test.com", username=f"user{i}",
+                                password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        first = pagination.paginate_users(User.query, per_page=3)
+        self.assertEqual(len(first.items), 3)
+        self.assertIsNone(first.before)
+
+        rest = pagination.paginate_users(
+            User.query, after=pagination.parse_user_cursor(first.after),
+            per_page=3)
+        self.assertEqual([u.username for u in rest.items], ["user2"])
+        self.assertIsNone(rest.after)
+
+    def test_profile_load_more_link(self):
+        """Does the profile page link to the next page of messages?"""
+
+        res = self.client.get(f"/users/{self.user_id}")
+        html = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Load more", html)
+
+        res = self.client.get(f"/users/{self.user_id}?before=garbage")
+        self.assertEqual(res.status_code, 400)
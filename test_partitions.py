@@ -0,0 +1,129 @@
+"""Message partition helper tests.
+
+Partitions themselves need Postgres; these cover the month arithmetic and
+reading recent months first, which work on any database.
+"""
+
+# run these tests like:
+#
+#    python -m unittest test_partitions.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+from query_counter import QueryCounter
+import pagination
+import partitions
+import timeline
+
+db.create_all()
+
+
+class MonthsTestCase(TestCase):
+    """Test month arithmetic and partition names."""
+
+    def test_add_months(self):
+        jan = datetime(2020, 1, 1)
+        self.assertEqual(partitions.add_months(jan, 1), datetime(2020, 2, 1))
+        self.assertEqual(partitions.add_months(jan, -1), datetime(2019, 12, 1))
+        self.assertEqual(partitions.add_months(jan, 23), datetime(2021, 12, 1))
+
+    def test_names(self):
+        month = partitions.month_start(datetime(2020, 3, 17, 12, 30))
+        self.assertEqual(partitions.partition_name(month), "messages_y2020m03")
+        self.assertEqual(partitions.partition_month("messages_y2020m03"),
+                         month)
+        self.assertIsNone(partitions.partition_month("messages_archive"))
+
+    def test_window_start(self):
+        """Does a window of n months end with the newest row's month?"""
+
+        newest = datetime(2020, 3, 17)
+        self.assertEqual(partitions.window_start(newest, 1),
+                         datetime(2020, 3, 1))
+        self.assertEqual(partitions.window_start(newest, 3),
+                         datetime(2020, 1, 1))
+
+
+class RecentFirstTestCase(TestCase):
+    """Test paging newest first through widening windows."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.author = User(email="a@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="r@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.flush()
+
+        db.session.add(Follows(user_being_followed_id=self.author.id,
+                               user_following_id=self.reader.id))
+
+        now = datetime.utcnow()
+        for days in (0, 60, 180, 720):
+            msg = Message(text=f"{days} days old", user_id=self.author.id,
+                          timestamp=now - timedelta(days=days))
+            db.session.add(msg)
+            db.session.flush()
+            timeline.fan_out(msg)
+        db.session.commit()
+
+        partitions.configure(True)
+
+    def tearDown(self):
+        partitions.configure(False)
+        db.session.rollback()
+
+    def texts(self, page):
+        return [m.text for m in page.items]
+
+    def test_widens_until_page_is_full(self):
+        """Is a short window followed by wider ones, then everything?"""
+
+        query = Message.query.filter_by(user_id=self.author.id)
+
+        with QueryCounter() as counter:
+            page = pagination.paginate_messages(query, per_page=2)
+        self.assertEqual(self.texts(page), ["0 days old", "60 days old"])
+        self.assertIsNotNone(page.before)
+        # 1 month, 3 months, then 12 months held more than a page
+        self.assertEqual(counter.count, 3)
+
+        page = pagination.paginate_messages(
+            query, before=pagination.parse_message_cursor(page.before),
+            per_page=2)
+        self.assertEqual(self.texts(page), ["180 days old", "720 days old"])
+        self.assertIsNone(page.before)
+
+    def test_same_pages_as_unpartitioned(self):
+        query = Message.query.filter_by(user_id=self.author.id)
+        windowed = self.texts(pagination.paginate_messages(query, per_page=3))
+
+        partitions.configure(False)
+        plain = self.texts(pagination.paginate_messages(query, per_page=3))
+
+        self.assertEqual(windowed, plain)
+
+    def test_home_timeline(self):
+        page = timeline.home_timeline(self.reader.id, per_page=3)
+        self.assertEqual(self.texts(page),
+                         ["0 days old", "60 days old", "180 days old"])
+        self.assertIsNotNone(page.before)
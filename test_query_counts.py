@@ -0,0 +1,99 @@
+"""Query-count tests: pages render in a constant number of queries."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from query_counter import QueryCountAssertions
+import timeline
+
+db.create_all()
+
+
+class QueryCountTestCase(QueryCountAssertions, TestCase):
+    """Adding rows to a page must not add queries to it."""
+
+    def setUp(self):
+        """Create a logged-in viewer."""
+
+        db.drop_all()
+        db.create_all()
+
+        viewer = User(email="viewer@test.com", username="viewer",
+                      password="HASHED_PASSWORD")
+        db.session.add(viewer)
+        db.session.commit()
+        self.viewer_id = viewer.id
+        self.made = 0
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer_id
+
+        self.add_authors(1)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_user(self):
+        self.made += 1
+        u = User(email=f"u{self.made}@test.com", username=f"user{self.made}",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.flush()
+        return u
+
+    def add_authors(self, n):
+        """Add `n` of each: a followed author posting to the viewer's
+        timeline, an unfollowed author whose message the viewer liked, and
+        a follower of the viewer."""
+
+        for _ in range(n):
+            followed, liked, follower = (self.add_user() for _ in range(3))
+
+            db.session.add_all([
+                Follows(user_being_followed_id=followed.id,
+                        user_following_id=self.viewer_id),
+                Follows(user_being_followed_id=self.viewer_id,
+                        user_following_id=follower.id),
+            ])
+
+            posted = Message(text=f"warble {self.made}", user_id=followed.id)
+            favourite = Message(text=f"liked {self.made}", user_id=liked.id)
+            db.session.add_all([posted, favourite])
+            db.session.flush()
+
+            timeline.fan_out(posted)
+            db.session.add(Likes(user_id=self.viewer_id,
+                                 message_id=favourite.id))
+
+        db.session.commit()
+
+    def test_views_are_constant(self):
+        """Do list pages stay at the same query count as they grow?"""
+
+        for url in ["/",
+                    "/users",
+                    "/users/likes",
+                    f"/users/{self.viewer_id}/following",
+                    f"/users/{self.viewer_id}/followers",
+                    "/users/2"]:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, lambda: self.add_authors(5))
@@ -0,0 +1,97 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_routing.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+REPLICA_URL = "postgresql:///warbler-test-replica"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import routing
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['SQLALCHEMY_BINDS'] = {'replica0': REPLICA_URL}
+
+db.create_all()
+
+
+class RoutingTestCase(TestCase):
+    """Two databases holding different copies of the same users."""
+
+    def setUp(self):
+        self.replica = db.get_engine(app, 'replica0')
+
+        for engine, suffix in [(db.engine, ""), (self.replica, "-lagging")]:
+            db.metadata.drop_all(bind=engine)
+            db.metadata.create_all(bind=engine)
+            engine.execute(User.__table__.insert(), [
+                dict(id=i, email=f"u{i}@test.com", username=f"user{i}{suffix}",
+                     password="HASHED_PASSWORD")
+                for i in (1, 2)
+            ])
+
+        user_cache.clear()
+        fragments.clear()
+        routing.configure(['replica0'], 60)
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def tearDown(self):
+        routing.configure([], routing.DEFAULT_STICKY_SECONDS)
+        db.session.rollback()
+        db.metadata.drop_all(bind=self.replica)
+
+    def page(self, url):
+        return self.client.get(url).get_data(as_text=True)
+
+    def test_read_only_view_uses_replica(self):
+        self.assertIn("@user2-lagging", self.page("/users/2"))
+
+    def test_other_views_use_primary(self):
+        html = self.page("/users/profile")
+        self.assertIn('value="user1"', html)
+        self.assertNotIn("user1-lagging", html)
+
+    def test_reads_stick_to_primary_after_write(self):
+        """After following, does the next page come from the primary?"""
+
+        self.client.post("/users/follow/2")
+        self.assertEqual(
+            db.engine.execute("SELECT count(*) FROM follows").scalar(), 1)
+        self.assertEqual(
+            self.replica.execute("SELECT count(*) FROM follows").scalar(), 0)
+
+        self.assertIn("@user2<", self.page("/users/2"))
+
+        with self.client.session_transaction() as sess:
+            sess[routing.STICKY_KEY] = 0
+        self.assertIn("@user2-lagging", self.page("/users/2"))
+
+    def test_without_replicas(self):
+        """With no replicas configured, is everything on the primary?"""
+
+        routing.configure([], 60)
+
+        self.client.post("/users/follow/2")
+        self.assertIn("@user2<", self.page("/users/2"))
+        with self.client.session_transaction() as sess:
+            self.assertNotIn(routing.STICKY_KEY, sess)
@@ -0,0 +1,113 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import search
+
+db.create_all()
+
+
+class SearchTestCase(TestCase):
+    """Test user and message search and the /search page."""
+
+    def setUp(self):
+        """Create two users with a message each."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        alice = User(email="alice@test.com", username="alice",
+                     bio="birdwatcher", password="HASHED_PASSWORD")
+        bob = User(email="bob@test.com", username="bob",
+                   bio="likes coffee", password="HASHED_PASSWORD")
+        db.session.add_all([alice, bob])
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text="spotted a heron by the river", user_id=alice.id),
+            Message(text="coffee then river walk", user_id=bob.id),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_search_users(self):
+        """Are users found by part of their username or their bio?"""
+
+        found = search.search_users("alic")
+        self.assertEqual([u.username for u in found.items], ["alice"])
+        self.assertFalse(found.has_next)
+
+        found = search.search_users("coffee")
+        self.assertEqual([u.username for u in found.items], ["bob"])
+
+    def test_search_messages(self):
+        """Must a message contain every word searched for?"""
+
+        found = search.search_messages("river")
+        self.assertEqual(len(found.items), 2)
+
+        found = search.search_messages("heron river")
+        self.assertEqual([m.text for m in found.items],
+                         ["spotted a heron by the river"])
+
+    def test_index_follows_new_rows(self):
+        """Do rows added after the first search show up?"""
+
+        self.assertEqual(search.search_messages("kingfisher").items, [])
+
+        db.session.add(Message(text="a kingfisher!", user_id=1))
+        db.session.commit()
+
+        found = search.search_messages("kingfisher")
+        self.assertEqual([m.text for m in found.items], ["a kingfisher!"])
+
+    def test_index_ignores_rolled_back_rows(self):
+        """Do rows added or changed in a rolled-back transaction stay out
+        of the index?"""
+
+        self.assertEqual(len(search.search_messages("river").items), 2)
+
+        heron = Message.query.filter_by(user_id=1).one()
+        heron.text = "spotted an osprey"
+        db.session.add(Message(text="a kingfisher!", user_id=1))
+        db.session.flush()
+        db.session.rollback()
+
+        self.assertEqual(search.fallback.messages.search("kingfisher"), [])
+        self.assertEqual(search.fallback.messages.search("osprey"), [])
+        self.assertEqual(len(search.search_messages("heron").items), 1)
+
+    def test_search_page(self):
+        """Does /search render users and warbles, and /users?q= forward?"""
+
+        res = self.client.get("/search?q=river")
+        html = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("spotted a heron", html)
+
+        res = self.client.get("/users?q=bob")
+        self.assertEqual(res.status_code, 302)
+        self.assertIn("/search?q=bob", res.location)
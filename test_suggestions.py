@@ -0,0 +1,145 @@
+"""Who-to-follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Suggestion
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import social
+import suggestions
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class SuggestionsTestCase(TestCase):
+    """ann follows bob and cat, who between them follow dan and eve."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.ids = {}
+        for name in ('ann', 'bob', 'cat', 'dan', 'eve', 'fay'):
+            user = User(email=f"{name}@test.com", username=name,
+                        password="HASHED_PASSWORD")
+            db.session.add(user)
+            db.session.flush()
+            self.ids[name] = user.id
+
+        for follower, followed in [('ann', 'bob'), ('ann', 'cat'),
+                                   ('bob', 'ann'), ('bob', 'cat'),
+                                   ('bob', 'dan'), ('cat', 'dan'),
+                                   ('cat', 'eve'), ('dan', 'eve'),
+                                   ('fay', 'ann')]:
+            self.follow(follower, followed)
+
+        db.session.add(Message(text="still here", user_id=self.ids['eve']))
+        db.session.commit()
+
+        suggestions.rebuild()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def follow(self, follower, followed):
+        db.session.add(Follows(user_following_id=self.ids[follower],
+                               user_being_followed_id=self.ids[followed]))
+
+    def suggested(self, name):
+        return [(user.username, mutuals) for user, mutuals in
+                suggestions.for_user(self.ids[name])]
+
+    def stored(self):
+        return {(s.user_id, s.candidate_id, s.mutuals)
+                for s in Suggestion.query}
+
+    def test_friends_of_friends(self):
+        """Are follows of follows ranked by mutuals, without anyone already
+        followed or the user themselves?"""
+
+        self.assertEqual(self.suggested('ann'), [('dan', 2), ('eve', 1)])
+        self.assertEqual(self.suggested('fay'), [('cat', 1), ('bob', 1)])
+        self.assertEqual(self.suggested('eve'), [])
+
+    def test_activity_breaks_ties(self):
+        self.assertEqual(self.suggested('bob'), [('eve', 2)])
+
+        db.session.add(Message(text="me too", user_id=self.ids['bob']))
+        db.session.commit()
+        suggestions.rebuild()
+
+        # fay: bob and cat both have one mutual, but bob posts
+        self.assertEqual(self.suggested('fay'), [('bob', 1), ('cat', 1)])
+
+    def test_top_k(self):
+        suggestions.rebuild(top_k=1)
+        self.assertEqual(self.suggested('ann'), [('dan', 2)])
+
+    def test_follow(self):
+        """Following dan drops him, adds his follows, and makes him a
+        suggestion for ann's followers."""
+
+        social.follow(self.ids['ann'], self.ids['dan'])
+        db.session.commit()
+
+        self.assertEqual(self.suggested('ann'), [('eve', 2)])
+        self.assertEqual(self.suggested('fay'),
+                         [('dan', 1), ('cat', 1), ('bob', 1)])
+        # bob already follows dan
+        self.assertNotIn('dan', [name for name, n in self.suggested('bob')])
+
+    def test_unfollow(self):
+        social.unfollow(self.ids['ann'], self.ids['cat'])
+        db.session.commit()
+
+        # bob still follows cat
+        self.assertEqual(self.suggested('ann'), [('dan', 1), ('cat', 1)])
+        self.assertEqual(self.suggested('fay'), [('bob', 1)])
+
+    def test_incremental_matches_rebuild(self):
+        """Do follows applied as they happen leave what a rebuild would?"""
+
+        for follower, followed in [('eve', 'bob'), ('fay', 'eve'),
+                                   ('dan', 'fay'), ('eve', 'dan')]:
+            social.follow(self.ids[follower], self.ids[followed])
+        social.unfollow(self.ids['dan'], self.ids['eve'])
+        db.session.commit()
+
+        incremental = self.stored()
+        suggestions.rebuild()
+        self.assertEqual(incremental, self.stored())
+
+    def test_page(self):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids['ann']
+
+        html = client.get("/users/suggested").get_data(as_text=True)
+        self.assertIn("@dan", html)
+        self.assertIn("Followed by 2 people you follow", html)
+        self.assertNotIn("@bob", html)
+
+    def test_page_logged_out(self):
+        res = app.test_client().get("/users/suggested")
+        self.assertEqual(res.status_code, 302)
@@ -0,0 +1,131 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_tags.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, MessageTag
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import tags
+import trending
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class ExtractTestCase(TestCase):
+    """Test finding and linking tags in text."""
+
+    def test_extract(self):
+        self.assertEqual(
+            tags.extract("#Flask and @Alice, #flask again; mail a@b.com #"),
+            ['#flask', '@alice'])
+        self.assertEqual(tags.extract("no tags here"), [])
+
+    def test_normalize(self):
+        self.assertEqual(tags.normalize("Python"), '#python')
+        self.assertEqual(tags.normalize("@Alice"), '@alice')
+
+    def test_linkify(self):
+        html = tags.linkify("don't <b>#Flask</b> @Alice")
+        self.assertEqual(
+            html,
+            'don&#39;t &lt;b&gt;<a href="/tags/flask">#Flask</a>&lt;/b&gt; '
+            '<a href="/tags/@alice">@Alice</a>')
+
+
+class TagViewsTestCase(TestCase):
+    """Test tagging new messages and the tag pages."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+        trending.configure(True, interval=0)
+
+        self.user = User(email="t@test.com", username="tagger",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        trending.configure(False)
+        db.session.rollback()
+
+    def post(self, text):
+        return self.client.post("/messages/new", data={"text": text})
+
+    def test_new_message_is_tagged(self):
+        self.post("Hello #Flask world, hi @tagger")
+
+        msg = Message.query.one()
+        self.assertEqual(
+            sorted((t.tag, t.message_id) for t in MessageTag.query),
+            [('#flask', msg.id), ('@tagger', msg.id)])
+        self.assertEqual(trending.tag_count('#flask'), 1)
+
+    def test_tag_page(self):
+        self.post("first #flask")
+        self.post("no tag")
+        self.post("second #Flask")
+
+        html = self.client.get("/tags/Flask").get_data(as_text=True)
+        self.assertIn("#flask", html)
+        self.assertIn("2 warbles in the last 24 hours", html)
+        self.assertLess(html.index("second"), html.index("first"))
+        self.assertNotIn("no tag", html)
+
+    def test_tag_page_pages(self):
+        now = datetime.utcnow()
+        for i in range(3):
+            msg = Message(text=f"old #news {i}", user_id=self.user_id,
+                          timestamp=now - timedelta(days=i))
+            db.session.add(msg)
+            db.session.flush()
+            tags.add(msg)
+        db.session.commit()
+
+        page = tags.paginate('#news', per_page=2)
+        self.assertEqual([m.text for m in page.items],
+                         ["old #news 0", "old #news 1"])
+        self.assertIsNotNone(page.before)
+
+    def test_rebuild(self):
+        db.session.add(Message(text="loaded #bulk", user_id=self.user_id))
+        db.session.commit()
+        self.assertEqual(MessageTag.query.count(), 0)
+
+        self.assertEqual(tags.rebuild(report=lambda line: None), 1)
+        self.assertEqual(MessageTag.query.one().tag, '#bulk')
+
+    def test_deleting_message_deletes_tags(self):
+        self.post("gone soon #temp")
+        msg_id = Message.query.one().id
+
+        self.client.post(f"/messages/{msg_id}/delete")
+        self.assertEqual(MessageTag.query.count(), 0)
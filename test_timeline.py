@@ -0,0 +1,129 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out, backfill and pruning of home timelines."""
+
+    def setUp(self):
+        """Create test client and two users."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.author = User(email="author@test.com", username="author",
+                           password="HASHED_PASSWORD")
+        self.reader = User(email="reader@test.com", username="reader",
+                           password="HASHED_PASSWORD")
+        db.session.add_all([self.author, self.reader])
+        db.session.commit()
+
+        self.author_id = self.author.id
+        self.reader_id = self.reader.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT_LIMIT'] = timeline.DEFAULT_FANOUT_LIMIT
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_post_fans_out_to_followers(self):
+        """Does posting a message write it into followers' feeds?"""
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "fresh warble"})
+
+        feed = timeline.home_timeline(self.reader_id).items
+        self.assertEqual([m.text for m in feed], ["fresh warble"])
+        self.assertEqual(TimelineEntry.query.count(), 2)
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Does following copy old messages in, and unfollowing remove them?"""
+
+        db.session.add(Message(text="old warble", user_id=self.author_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+            self.assertEqual(
+                len(timeline.home_timeline(self.reader_id).items), 1)
+
+            res = c.get("/")
+            self.assertIn("old warble", res.get_data(as_text=True))
+
+            c.post(f"/users/stop-following/{self.author_id}")
+            self.assertEqual(timeline.home_timeline(self.reader_id).items, [])
+
+    def test_popular_author_is_pulled(self):
+        """Are authors over the fan-out limit merged in at read time?"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f"/users/follow/{self.author_id}")
+            self.login(c, self.author_id)
+            c.post("/messages/new", data={"text": "celebrity warble"})
+
+        entries = TimelineEntry.query.filter_by(user_id=self.reader_id).count()
+        self.assertEqual(entries, 0)
+
+        feed = timeline.home_timeline(self.reader_id).items
+        self.assertEqual([m.text for m in feed], ["celebrity warble"])
+
+    def test_rebuild(self):
+        """Does a rebuild keep own messages and the newest per author?"""
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        for i in range(3):
+            db.session.add(Message(text=f"warble {i}", user_id=self.author_id,
+                                   timestamp=datetime(2020, 1, 1 + i)))
+        db.session.add(Message(text="mine", user_id=self.reader_id))
+        db.session.commit()
+
+        timeline.rebuild(limit=2)
+        db.session.commit()
+
+        feed = timeline.home_timeline(self.reader_id).items
+        self.assertEqual([m.text for m in feed],
+                         ["mine", "warble 2", "warble 1"])
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.author_id).count(), 3)
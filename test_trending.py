@@ -0,0 +1,148 @@
+"""Trending counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, TrendCount
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import fragments
+import social
+import trending
+import user_cache
+
+db.create_all()
+
+HOUR = 3600
+
+
+class WindowTestCase(TestCase):
+    """Test the ring buffer."""
+
+    def test_sliding(self):
+        """Do buckets fall out of the window as time moves on?"""
+
+        window = trending.Window(size=3, bucket_seconds=HOUR)
+        for hour in range(5):
+            window.add(window.bucket(hour * HOUR), 'tag', '#a', hour + 1)
+
+        # hours 2, 3 and 4 are left, in slots reused from hours 0 and 1
+        self.assertEqual(window.count('tag', '#a', 4 * HOUR), 3 + 4 + 5)
+        self.assertEqual(window.totals('tag', 5 * HOUR)['#a'], 4 + 5)
+        self.assertEqual(window.count('tag', '#a', 9 * HOUR), 0)
+        self.assertEqual(window.count('tag', '#b', 4 * HOUR), 0)
+
+
+class TrendsTestCase(TestCase):
+    """Test snapshots, rankings and the trending page."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragments.clear()
+
+        self.user = User(email="t@test.com", username="trender",
+                         password="HASHED_PASSWORD")
+        db.session.add(self.user)
+        db.session.flush()
+        self.messages = [Message(text=f"warble {i}", user_id=self.user.id)
+                         for i in range(3)]
+        db.session.add_all(self.messages)
+        db.session.commit()
+
+        trending.configure(True, bucket_seconds=HOUR, window=24, interval=0,
+                           size=2)
+        self.trends = trending.trends
+
+    def tearDown(self):
+        trending.configure(False)
+        db.session.rollback()
+
+    def test_snapshot_saves_and_ranks(self):
+        for tag, n in [('#a', 1), ('#b', 3), ('#c', 2)]:
+            for i in range(n):
+                self.trends.record(trending.TAG, tag, now=10 * HOUR)
+
+        rankings = self.trends.snapshot(now=10 * HOUR)
+        self.assertEqual(rankings.tags, [('#b', 3), ('#c', 2)])
+        self.assertEqual(
+            {(row.bucket, row.name, row.count) for row in TrendCount.query},
+            {(10, '#a', 1), (10, '#b', 3), (10, '#c', 2)})
+
+        # a snapshot adds to what is saved rather than replacing it
+        self.trends.record(trending.TAG, '#a', 3, now=11 * HOUR)
+        rankings = self.trends.snapshot(now=11 * HOUR)
+        self.assertEqual(rankings.tags, [('#a', 4), ('#b', 3)])
+
+        # and a day later it has all gone
+        rankings = self.trends.snapshot(now=35 * HOUR)
+        self.assertEqual(rankings.tags, [])
+        self.assertEqual(TrendCount.query.count(), 0)
+
+    def test_processes_share_counts(self):
+        """Does a snapshot pick up counts saved by another process?"""
+
+        other = trending.Trends(HOUR, 24, 0, 2)
+        other.record(trending.TAG, '#shared', 2, now=10 * HOUR)
+        other.snapshot(now=10 * HOUR)
+
+        self.trends.record(trending.TAG, '#shared', now=10 * HOUR)
+        rankings = self.trends.snapshot(now=10 * HOUR)
+        self.assertEqual(rankings.tags, [('#shared', 3)])
+
+    def test_likes(self):
+        first, second, third = (m.id for m in self.messages)
+        other = User(email="o@test.com", username="other",
+                     password="HASHED_PASSWORD")
+        db.session.add(other)
+        db.session.flush()
+
+        for user_id in (self.user.id, other.id):
+            social.like(user_id, second)
+        social.like(other.id, third)
+        social.like(self.user.id, first)
+        social.unlike(self.user.id, first)
+        db.session.commit()
+
+        self.assertEqual(self.trends.snapshot().messages,
+                         [(second, 2), (third, 1)])
+
+    def test_cancelled_counts(self):
+        """Does a snapshot cope with counts that add up to nothing?"""
+
+        self.trends.record(trending.LIKE, '1', now=10 * HOUR)
+        self.trends.record(trending.LIKE, '1', -1, now=10 * HOUR)
+        self.assertEqual(self.trends.snapshot(now=10 * HOUR).messages, [])
+        self.assertEqual(TrendCount.query.count(), 0)
+
+    def test_page(self):
+        social.like(self.user.id, self.messages[1].id)
+        db.session.commit()
+        self.trends.record(trending.TAG, '#hot')
+        self.trends.snapshot()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user.id
+
+        html = client.get("/trending").get_data(as_text=True)
+        self.assertIn('<a href="/tags/hot">#hot</a>', html)
+        self.assertIn("warble 1", html)
+        self.assertIn("1 like", html)
+        self.assertNotIn("warble 0", html)
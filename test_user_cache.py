@@ -0,0 +1,140 @@
+"""User snapshot cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_user_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from query_counter import QueryCounter
+import counters
+import user_cache
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class TTLCacheTestCase(TestCase):
+    """Test eviction, expiry and stats of the cache itself."""
+
+    def setUp(self):
+        self.now = 0
+        self.cache = user_cache.TTLCache(maxsize=2, ttl=10,
+                                         clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        """Is the least recently used entry evicted first?"""
+
+        self.cache.set(1, 'a')
+        self.cache.set(2, 'b')
+        self.cache.get(1)
+        self.cache.set(3, 'c')
+
+        self.assertEqual(self.cache.get(1), 'a')
+        self.assertIsNone(self.cache.get(2))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_expiry_and_stats(self):
+        """Do entries expire after the TTL, counting as misses?"""
+
+        self.cache.set(1, 'a')
+        self.assertEqual(self.cache.get(1), 'a')
+
+        self.now = 11
+        self.assertIsNone(self.cache.get(1))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['size'], 0)
+
+
+class CurrentUserTestCase(TestCase):
+    """Test g.user served from the cache."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u = User(email="test@test.com", username="testuser",
+                 password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_warm_cache_skips_user_query(self):
+        """Once cached, does rendering a page skip loading the user?"""
+
+        self.client.get("/messages/new")
+
+        with QueryCounter() as counter:
+            res = self.client.get("/messages/new")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("testuser", res.get_data(as_text=True))
+        self.assertEqual(counter.count, 0)
+
+    def test_counters_invalidate_on_commit(self):
+        """Is a snapshot forgotten only once a counter change commits, or
+        when it is rolled back?"""
+
+        user_cache.clear()
+        self.assertEqual(user_cache.get_snapshot(self.user_id).likes_count, 0)
+
+        counters.adjust_user(self.user_id, likes_count=1)
+        self.assertIsNotNone(user_cache.cache.get(self.user_id))
+        db.session.commit()
+        self.assertEqual(user_cache.get_snapshot(self.user_id).likes_count, 1)
+
+        # this transaction caches its own uncommitted count, then rolls back
+        counters.adjust_users([self.user_id], likes_count=1)
+        user_cache.invalidate(self.user_id)
+        self.assertEqual(user_cache.get_snapshot(self.user_id).likes_count, 2)
+        db.session.rollback()
+        self.assertEqual(user_cache.get_snapshot(self.user_id).likes_count, 1)
+
+    def test_deleted_user_is_logged_out(self):
+        """Is g.user falsy once the user is gone?"""
+
+        self.client.post("/users/delete")
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+        res = self.client.get("/messages/new")
+        self.assertEqual(res.status_code, 302)
+
+    def test_stats_endpoint(self):
+        """Are stats only served when enabled?"""
+
+        self.assertEqual(self.client.get("/stats/user-cache").status_code, 404)
+
+        app.config['EXPOSE_STATS'] = True
+        try:
+            res = self.client.get("/stats/user-cache")
+        finally:
+            app.config['EXPOSE_STATS'] = False
+
+        self.assertIn('hit_rate', res.get_json())
@@ -208,4 +208,19 @@ class UserModelTestCase(TestCase):
         db.session.commit()
         
         ua=User.authenticate(username="test2", password="hashedpassword22")
-        self.assertEqual(ua,False)
\ No newline at end of file
+        self.assertEqual(ua,False)
+
+    def test_following_status(self):
+        """Does following_status answer for many users in one call?"""
+        u = User(email="a@test.com", username="a", password="HASHED_PASSWORD")
+        u2 = User(email="b@test.com", username="b", password="HASHED_PASSWORD")
+        u3 = User(email="c@test.com", username="c", password="HASHED_PASSWORD")
+        db.session.add_all([u, u2, u3])
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=u2.id, user_following_id=u.id))
+        db.session.commit()
+
+        status = u.following_status([u2.id, u3.id])
+        self.assertEqual(status, {u2.id: True, u3.id: False})
+        self.assertEqual(u.following_status([]), {})
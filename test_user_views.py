@@ -274,7 +274,7 @@ class UserViewsTestCase(TestCase):
                     'image_url':User.image_url.default.arg}, follow_redirects=True)
         u=User.query.get(2)
         res=self.client.post('/users/follow/1', data={'follow_id':1,'g.user':u}, follow_redirects=True)
-        res=self.client.post('/users/stop-following/1', data={'follow_id':1,'g.user':u}, follow_redirects=True)
+        res=self.client.post('/users/stop-following/1', data={'follow_id':1,'g.user':2}, follow_redirects=True)
         html=res.get_data(as_text=True)
         
         self.assertNotIn('test',html)
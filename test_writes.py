@@ -0,0 +1,200 @@
+"""Like/follow write path tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_writes.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import social
+import trending
+import writes
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class WritesTestCase(TestCase):
+    """Test idempotent writes and the write-behind buffer."""
+
+    def setUp(self):
+        # a fresh session: objects left over from earlier tests would clash
+        # with the ids the recreated tables hand out again
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+        self.u1 = User(email="u1@test.com", username="u1",
+                       password="HASHED_PASSWORD")
+        self.u2 = User(email="u2@test.com", username="u2",
+                       password="HASHED_PASSWORD")
+        db.session.add_all([self.u1, self.u2])
+        db.session.flush()
+
+        self.msgs = [Message(text=f"warble {i}", user_id=self.u2.id)
+                     for i in range(3)]
+        db.session.add_all(self.msgs)
+        db.session.commit()
+
+        self.u1_id, self.u2_id = self.u1.id, self.u2.id
+        self.msg_ids = [m.id for m in self.msgs]
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        writes.configure(False)
+        db.session.rollback()
+        # and leave none behind for the next test case either
+        db.session.remove()
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        u = User.query.get(user_id)
+        return (u.following_count, u.followers_count, u.likes_count)
+
+    def test_idempotent_follow(self):
+        """Does following twice leave one row, counted once?"""
+
+        self.assertTrue(social.follow(self.u1_id, self.u2_id))
+        self.assertFalse(social.follow(self.u1_id, self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 1, 0))
+
+        self.assertTrue(social.unfollow(self.u1_id, self.u2_id))
+        self.assertFalse(social.unfollow(self.u1_id, self.u2_id))
+        db.session.commit()
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 0))
+
+    def test_idempotent_like(self):
+        """Does liking twice leave one row, counted once?"""
+
+        msg_id = self.msg_ids[0]
+
+        self.assertTrue(social.like(self.u1_id, msg_id))
+        self.assertFalse(social.like(self.u1_id, msg_id))
+        db.session.commit()
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 1))
+        self.assertEqual(Message.query.get(msg_id).like_count, 1)
+
+        self.assertTrue(social.unlike(self.u1_id, msg_id))
+        self.assertFalse(social.unlike(self.u1_id, msg_id))
+        db.session.commit()
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0))
+
+    def test_buffer_coalesces(self):
+        """Do repeated toggles collapse into the final state?"""
+
+        writes.configure(True, interval=3600)
+
+        for i in range(3):
+            writes.toggle_like(self.u1_id, self.msg_ids[0])
+        writes.follow(self.u1_id, self.u2_id)
+        writes.unfollow(self.u1_id, self.u2_id)
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(writes.buffer.stats()['pending'], 2)
+        self.assertEqual(writes.buffer.stats()['coalesced'], 3)
+
+        self.assertEqual(writes.buffer.flush(), 2)
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 1))
+
+    def test_buffer_flushes_when_full(self):
+        """Does reaching the size threshold flush without waiting?"""
+
+        writes.configure(True, interval=3600, max_pending=2)
+
+        writes.toggle_like(self.u1_id, self.msg_ids[0])
+        writes.toggle_like(self.u1_id, self.msg_ids[1])
+
+        deadline = time.time() + 5
+        while writes.buffer.stats()['flushes'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+        db.session.rollback()
+        self.assertEqual(Likes.query.count(), 2)
+
+    def test_buffer_drops_only_bad_entries(self):
+        """Is an entry for a deleted message dropped, keeping the rest?"""
+
+        writes.configure(True, interval=3600)
+
+        writes.toggle_like(self.u1_id, self.msg_ids[0])
+        writes.toggle_like(self.u1_id, self.msg_ids[1])
+
+        Message.query.filter_by(id=self.msg_ids[0]).delete()
+        db.session.commit()
+
+        writes.buffer.flush()
+        self.assertEqual([l.message_id for l in Likes.query],
+                         [self.msg_ids[1]])
+        self.assertEqual(writes.buffer.stats()['dropped'], 1)
+
+    def test_buffer_side_effects_once(self):
+        """Does a batch that fails part way count each like once?"""
+
+        trending.configure(True, interval=0)
+        writes.configure(True, interval=3600)
+        try:
+            writes.toggle_like(self.u1_id, self.msg_ids[1])
+            writes.toggle_like(self.u1_id, self.msg_ids[0])
+
+            Message.query.filter_by(id=self.msg_ids[0]).delete()
+            db.session.commit()
+
+            writes.buffer.flush()
+            self.assertEqual(
+                trending.trends.total(trending.LIKE, str(self.msg_ids[1])), 1)
+            self.assertEqual(
+                trending.trends.total(trending.LIKE, str(self.msg_ids[0])), 0)
+        finally:
+            trending.configure(False)
+
+        self.assertEqual(writes.buffer.stats()['dropped'], 1)
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 1))
+
+    def test_stop_flushes(self):
+        """Is anything still buffered written on shutdown?"""
+
+        writes.configure(True, interval=3600)
+        writes.follow(self.u1_id, self.u2_id)
+
+        writes.configure(False)
+        self.assertEqual(Follows.query.count(), 1)
+
+    def test_views(self):
+        """Do the like and follow views go through the write path?"""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        self.client.post(f"/users/follow/{self.u2_id}")
+        self.client.post(f"/users/follow/{self.u2_id}")
+        self.client.post(f"/users/add_like/{self.msg_ids[0]}",
+                         headers={'Referer': '/'})
+
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 1))
+        self.assertEqual(self.counts(self.u2_id), (0, 1, 0))
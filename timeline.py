@@ -0,0 +1,224 @@
+"""Materialized home timelines for Warbler.
+
+Each user's home feed is stored in `timeline_entries` and kept up to date
+as messages are posted and follows change (fan-out-on-write), so rendering
+the homepage is a single indexed range scan instead of an `IN (...)` query
+over every followed user's messages.
+
+Authors with at least `TIMELINE_FANOUT_LIMIT` followers are not fanned out;
+their messages are pulled at read time and merged into the feed, which keeps
+a single post from writing millions of rows.
+
+Only the author's own entry is written in the request; copying the message
+into followers' feeds is the `fan_out` job (see jobs.py), so with a queue
+executor posting doesn't wait on it.
+"""
+
+from sqlalchemy import func, literal, select, and_, exists
+
+from models import db, User, Follows, Message, TimelineEntry
+import jobs
+import pagination
+import partitions
+
+DEFAULT_FANOUT_LIMIT = 10000
+BACKFILL_LIMIT = 100
+
+# keyset for paging a feed; matches ix_timeline_entries_user_timestamp
+FEED_KEY = [TimelineEntry.timestamp, TimelineEntry.message_id]
+
+
+def fanout_limit():
+    """Follower count at which an author switches from push to pull."""
+
+    return db.get_app().config.get('TIMELINE_FANOUT_LIMIT',
+                                   DEFAULT_FANOUT_LIMIT)
+
+
+def is_pulled(user_id):
+    """Is `user_id` popular enough that their messages are read-time pulled?"""
+
+    count = (db.session
+             .query(User.followers_count)
+             .filter(User.id == user_id)
+             .scalar())
+    return (count or 0) >= fanout_limit()
+
+
+def pulled_following_ids(user_id):
+    """Ids of users that `user_id` follows whose messages are pulled."""
+
+    rows = (db.session
+            .query(Follows.user_being_followed_id)
+            .join(User, User.id == Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id,
+                    User.followers_count >= fanout_limit(),
+                    User.deleted_at.is_(None))
+            .all())
+
+    return [r[0] for r in rows]
+
+
+def fan_out(message):
+    """Write `message` into its author's feed and queue it for their
+    followers' feeds.
+
+    The message must already be flushed so it has an id and timestamp.
+    """
+
+    db.session.execute(TimelineEntry.__table__.insert().values(
+        user_id=message.user_id,
+        message_id=message.id,
+        author_id=message.user_id,
+        timestamp=message.timestamp,
+    ))
+
+    jobs.enqueue('fan_out', key=f"fan_out:{message.id}",
+                 message_id=message.id)
+
+
+@jobs.task('fan_out')
+def fan_out_followers(message_id):
+    """Write a message into its author's followers' feeds.
+
+    Popular authors are skipped; followers pull their messages instead.
+    Does nothing if the message is gone or was already fanned out.
+    """
+
+    message = (db.session
+               .query(Message.id, Message.user_id, Message.timestamp)
+               .filter(Message.id == message_id)
+               .first())
+    if message is None or is_pulled(message.user_id):
+        return
+
+    already = exists().where(and_(
+        TimelineEntry.message_id == message.id,
+        TimelineEntry.user_id == Follows.user_following_id,
+    ))
+    followers = select([
+        Follows.user_following_id,
+        literal(message.id),
+        literal(message.user_id),
+        literal(message.timestamp),
+    ]).where(and_(Follows.user_being_followed_id == message.user_id,
+                  ~already))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'], followers))
+
+
+def backfill(follower_id, followed_id, limit=BACKFILL_LIMIT):
+    """Copy `followed_id`'s recent messages into `follower_id`'s feed."""
+
+    if is_pulled(followed_id):
+        return
+
+    already = exists().where(and_(
+        TimelineEntry.user_id == follower_id,
+        TimelineEntry.message_id == Message.id,
+    ))
+
+    recent = (select([
+        literal(follower_id),
+        Message.id,
+        Message.user_id,
+        Message.timestamp,
+    ])
+        .where(and_(Message.user_id == followed_id, ~already))
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'author_id', 'timestamp'], recent))
+
+
+def prune(follower_id, followed_id):
+    """Remove `followed_id`'s messages from `follower_id`'s feed."""
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.author_id == followed_id)
+     .delete(synchronize_session=False))
+
+
+def feed_query(user_id):
+    """Messages materialized on `user_id`'s feed (unordered), leaving out
+    those of deleted accounts still waiting to be purged."""
+
+    # the timestamp lets Postgres prune message partitions (partitions.py)
+    return (Message
+            .visible()
+            .join(TimelineEntry,
+                  and_(TimelineEntry.message_id == Message.id,
+                       TimelineEntry.timestamp == Message.timestamp))
+            .filter(TimelineEntry.user_id == user_id))
+
+
+def home_timeline(user_id, before=None, after=None,
+                  per_page=pagination.MESSAGES_PER_PAGE):
+    """Return one `pagination.Page` of `user_id`'s home feed, newest first.
+
+    `before` / `after` are parsed `(timestamp, id)` message cursors.
+    """
+
+    rows = pagination.fetch(feed_query(user_id), FEED_KEY, before, after,
+                            per_page, windows=partitions.windows())
+
+    pulled_ids = pulled_following_ids(user_id)
+    if pulled_ids:
+        pulled = Message.query.filter(Message.user_id.in_(pulled_ids))
+        rows += pagination.fetch(pulled, [Message.timestamp, Message.id],
+                                 before, after, per_page,
+                                 windows=partitions.windows())
+
+        # re-sort the merged rows into travel order, away from the cursor
+        merged = {m.id: m for m in rows}
+        rows = sorted(merged.values(), key=pagination.message_key,
+                      reverse=after is None)
+
+    return pagination.make_page(rows, pagination.message_key,
+                                pagination.message_cursor, before, after,
+                                per_page)
+
+
+def rebuild(limit=BACKFILL_LIMIT):
+    """Recompute every feed from `messages` and `follows`.
+
+    Use after bulk loads (see loader.py) or to repair drift; run
+    `counters.reconcile()` first so popular authors are recognised. Each feed
+    gets the user's own messages plus up to `limit` recent messages per
+    followed author who is not pulled at read time. Both are single
+    `INSERT ... SELECT`s, so this stays fast on large snapshots.
+    """
+
+    TimelineEntry.query.delete(synchronize_session=False)
+
+    table = TimelineEntry.__table__
+    columns = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+    own = select([Message.user_id, Message.id,
+                  Message.user_id.label('author_id'), Message.timestamp])
+    db.session.execute(table.insert().from_select(columns, own))
+
+    # each author's messages numbered newest first, to keep the top `limit`
+    ranked = select([
+        Message.id,
+        Message.user_id,
+        Message.timestamp,
+        func.row_number().over(
+            partition_by=Message.user_id,
+            order_by=[Message.timestamp.desc(), Message.id.desc()],
+        ).label('rank'),
+    ]).alias('ranked')
+
+    pushed = select([User.id]).where(User.followers_count < fanout_limit())
+
+    followed = (select([Follows.user_following_id, ranked.c.id,
+                        ranked.c.user_id, ranked.c.timestamp])
+                .where(and_(Follows.user_being_followed_id == ranked.c.user_id,
+                            Follows.user_following_id != ranked.c.user_id,
+                            ranked.c.rank <= limit,
+                            ranked.c.user_id.in_(pushed))))
+    db.session.execute(table.insert().from_select(columns, followed))
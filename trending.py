@@ -0,0 +1,283 @@
+"""Trending tags and warbles over a sliding window.
+
+Posts per tag (tags.py) and likes per message (social.py) are counted in
+time buckets `bucket_seconds` wide; the window is the last `window` of
+them (5 minutes x 288 = 24 hours by default).
+
+Each process holds the window in a ring buffer (`Window`): one Counter per
+bucket, in slot `bucket % window`, so a slot is simply emptied when its
+turn comes round again and nothing has to be scanned to expire old
+counts. New counts also wait in `pending`.
+
+Every `interval` seconds a background thread (started on first use, like
+the write-behind buffer's) takes a snapshot:
+
+1. `pending` is added to `trend_counts` (a row per bucket, kind and name),
+   so every process's counts are shared and survive restarts;
+2. buckets that have left the window are deleted;
+3. the ring is reloaded from the table and ranked: the top `size` tags by
+   posts and messages by likes become `rankings()`.
+
+/trending renders the last rankings, so it never aggregates over `likes`
+or `message_tags`, and they are up to `interval` seconds old. Likes taken
+back count -1 in their bucket; counts of a transaction that rolled back
+are not taken back, so treat the numbers as approximate.
+"""
+
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+
+from sqlalchemy import text
+
+from models import db, TrendCount
+
+DEFAULT_BUCKET_SECONDS = 300
+DEFAULT_WINDOW = 288
+DEFAULT_INTERVAL = 30.0
+DEFAULT_SIZE = 20
+
+TAG = 'tag'
+LIKE = 'like'
+
+UPSERT = text("""
+    INSERT INTO trend_counts (bucket, kind, name, count)
+    VALUES (:bucket, :kind, :name, :count)
+    ON CONFLICT (bucket, kind, name)
+    DO UPDATE SET count = trend_counts.count + excluded.count
+""")
+
+Rankings = namedtuple('Rankings', ['tags', 'messages', 'updated'])
+
+EMPTY = Rankings([], [], None)
+
+logger = logging.getLogger(__name__)
+
+
+class Window:
+    """Counts per (kind, name) in the last `size` buckets, as a ring."""
+
+    def __init__(self, size=DEFAULT_WINDOW,
+                 bucket_seconds=DEFAULT_BUCKET_SECONDS):
+        self.size = size
+        self.bucket_seconds = bucket_seconds
+        self.slots = [Counter() for i in range(size)]
+        self.buckets = [None] * size
+
+    def bucket(self, now=None):
+        """Number of the bucket `now` (default: the current time) is in."""
+
+        return int((time.time() if now is None else now)
+                   // self.bucket_seconds)
+
+    def _slot(self, bucket):
+        i = bucket % self.size
+        if self.buckets[i] != bucket:
+            self.slots[i].clear()
+            self.buckets[i] = bucket
+        return self.slots[i]
+
+    def add(self, bucket, kind, name, n=1):
+        self._slot(bucket)[kind, name] += n
+
+    def totals(self, kind, now=None):
+        """Counter of `kind`'s names over the window ending `now`."""
+
+        oldest = self.bucket(now) - self.size + 1
+        totals = Counter()
+        for bucket, counts in zip(self.buckets, self.slots):
+            if bucket is not None and bucket >= oldest:
+                for (k, name), n in counts.items():
+                    if k == kind:
+                        totals[name] += n
+        return totals
+
+    def count(self, kind, name, now=None):
+        """`name`'s total over the window ending `now`."""
+
+        oldest = self.bucket(now) - self.size + 1
+        return sum(counts[kind, name]
+                   for bucket, counts in zip(self.buckets, self.slots)
+                   if bucket is not None and bucket >= oldest)
+
+    def load(self, rows):
+        """Replace the contents with (bucket, kind, name, count) rows."""
+
+        for counts in self.slots:
+            counts.clear()
+        self.buckets = [None] * self.size
+        for bucket, kind, name, n in rows:
+            self.add(bucket, kind, name, n)
+
+
+class Trends:
+    """A process's window, its unsaved counts and the last rankings."""
+
+    def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 window=DEFAULT_WINDOW, interval=DEFAULT_INTERVAL,
+                 size=DEFAULT_SIZE):
+        self.window = Window(window, bucket_seconds)
+        self.interval = interval
+        self.size = size
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.rankings = EMPTY
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def _start(self):
+        # started on first use, so each forked web worker gets its own
+        if self.thread is None and self.interval:
+            self.thread = threading.Thread(target=self._run, name='trending',
+                                           daemon=True)
+            self.thread.start()
+
+    def record(self, kind, name, n=1, now=None):
+        with self.lock:
+            bucket = self.window.bucket(now)
+            self.window.add(bucket, kind, name, n)
+            self.pending[bucket, kind, name] += n
+            self._start()
+
+    def total(self, kind, name, now=None):
+        with self.lock:
+            return self.window.count(kind, name, now)
+
+    def _run(self):
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("trending snapshot failed")
+
+    def snapshot(self, now=None):
+        """Save pending counts, drop old buckets, reload and rank the
+        window."""
+
+        with self.lock:
+            batch, self.pending = self.pending, Counter()
+            oldest = self.window.bucket(now) - self.window.size + 1
+
+        # a like and unlike between snapshots cancel out to nothing to save
+        changes = [dict(bucket=bucket, kind=kind, name=name, count=n)
+                   for (bucket, kind, name), n in batch.items() if n]
+
+        try:
+            with db.engine.begin() as connection:
+                if changes:
+                    connection.execute(UPSERT, changes)
+                connection.execute(TrendCount.__table__.delete().where(
+                    TrendCount.bucket < oldest))
+                rows = connection.execute(
+                    TrendCount.__table__.select().where(
+                        TrendCount.bucket >= oldest)).fetchall()
+        except Exception:
+            # keep the counts for the next try
+            with self.lock:
+                self.pending.update(batch)
+            raise
+
+        with self.lock:
+            self.window.load((row.bucket, row.kind, row.name, row.count)
+                             for row in rows)
+            # counted while we were away
+            for (bucket, kind, name), n in self.pending.items():
+                self.window.add(bucket, kind, name, n)
+
+            self.rankings = Rankings(
+                tags=self._top(TAG, now),
+                messages=[(int(name), n) for name, n in self._top(LIKE, now)],
+                updated=time.time() if now is None else now)
+
+        return self.rankings
+
+    def _top(self, kind, now):
+        totals = self.window.totals(kind, now)
+        return heapq.nlargest(self.size,
+                              ((name, n) for name, n in totals.items()
+                               if n > 0),
+                              key=lambda item: (item[1], item[0]))
+
+    def current(self):
+        """The last rankings, taking a first snapshot if there are none."""
+
+        with self.lock:
+            rankings = self.rankings
+            self._start()
+        if rankings is EMPTY:
+            rankings = self.snapshot()
+        return rankings
+
+    def stop(self):
+        """Stop the snapshot thread and save what is pending."""
+
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.pending:
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("trending: could not save pending counts")
+
+
+trends = None
+
+
+def configure(enabled, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+              window=DEFAULT_WINDOW, interval=DEFAULT_INTERVAL,
+              size=DEFAULT_SIZE):
+    """Turn trending on or off (from app config)."""
+
+    global trends
+    if trends is not None:
+        trends.stop()
+    trends = (Trends(bucket_seconds, window, interval, size)
+              if enabled else None)
+
+
+@atexit.register
+def _save_at_exit():
+    if trends is not None:
+        trends.stop()
+
+
+def record_post(tags):
+    """Count a new message's tags."""
+
+    if trends is not None:
+        for tag in tags:
+            trends.record(TAG, tag)
+
+
+def record_like(message_id, delta=1):
+    """Count a like (or, with -1, an unlike) of `message_id`."""
+
+    if trends is not None:
+        trends.record(LIKE, str(message_id), delta)
+
+
+def window_hours():
+    """Length of the window, in hours."""
+
+    if trends is None:
+        return 0
+    return trends.window.size * trends.window.bucket_seconds / 3600
+
+
+def tag_count(tag):
+    """Posts with `tag` in the window, as this process knows them."""
+
+    return trends.total(TAG, tag) if trends is not None else 0
+
+
+def rankings():
+    """Top tags and messages as of the last snapshot."""
+
+    return trends.current() if trends is not None else EMPTY
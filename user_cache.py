@@ -0,0 +1,224 @@
+"""Cache of logged-in user snapshots, so `g.user` rarely costs a query.
+
+Most pages only need the current user's id, name, images and counters (the
+navbar and stat blocks). `CurrentUser` serves those from a bounded LRU cache
+with a TTL and only loads the full `User` row when a view touches anything
+else (a relationship, a model method, or a write).
+
+The cache is per process: `invalidate()` is called wherever a user's row
+changes (profile edits, signup, deletion), and the TTL bounds how stale
+another worker's copy can get. Counter updates happen inside a larger
+transaction, so they use `invalidate_on_commit()`: forgetting a snapshot
+before the commit would let a concurrent request cache the old row again.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+
+from models import db, User
+
+DEFAULT_MAXSIZE = 10000
+DEFAULT_TTL = 60
+
+SNAPSHOT_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+                   'location', 'profile_version', 'messages_count',
+                   'following_count', 'followers_count', 'likes_count')
+
+UserSnapshot = namedtuple('UserSnapshot', SNAPSHOT_FIELDS)
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL,
+                 clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        """Cached value for `key`, or None on a miss."""
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and occupancy, for sizing the cache."""
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+
+cache = TTLCache()
+
+
+def configure(maxsize, ttl):
+    """Resize the cache (from app config); drops anything cached."""
+
+    global cache
+    cache = TTLCache(maxsize, ttl)
+
+
+def invalidate(user_id):
+    """Forget the snapshot for `user_id` after their row changes."""
+
+    cache.invalidate(user_id)
+
+
+def invalidate_on_commit(user_id):
+    """Forget the snapshot for `user_id` once the current transaction
+    commits (or rolls back, in case it cached its own uncommitted row)."""
+
+    db.session.info.setdefault('user_cache_pending', set()).add(user_id)
+
+
+def clear():
+    """Forget every snapshot (after bulk changes to `users`)."""
+
+    cache.clear()
+
+
+def stats():
+    return cache.stats()
+
+
+def get_snapshot(user_id):
+    """Snapshot for `user_id`, from the cache or one narrow query.
+
+    Returns None if there is no such user, or they were deleted.
+    """
+
+    snapshot = cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+
+    columns = [getattr(User, name) for name in SNAPSHOT_FIELDS]
+    row = (db.session
+           .query(*columns)
+           .filter(User.id == user_id, User.deleted_at.is_(None))
+           .first())
+    if row is None:
+        return None
+
+    snapshot = UserSnapshot(*row)
+    cache.set(user_id, snapshot)
+    return snapshot
+
+
+class CurrentUser:
+    """Stand-in for the logged-in `User` stored on `g.user`.
+
+    Snapshot fields are read from the cache; anything else (relationships,
+    model methods, email/password, attribute writes) goes to the real row,
+    loaded on first use and available as `.model`. It is falsy if the user
+    no longer exists, like the None `User.query.get()` would return.
+    """
+
+    def __init__(self, user_id):
+        object.__setattr__(self, '_id', user_id)
+        object.__setattr__(self, '_snapshot', None)
+        object.__setattr__(self, '_model', None)
+
+    def _snap(self):
+        if self._model is not None:
+            return self._model
+
+        if self._snapshot is None:
+            object.__setattr__(self, '_snapshot', get_snapshot(self._id))
+        return self._snapshot
+
+    @property
+    def model(self):
+        """The full `User` row for this request."""
+
+        if self._model is None:
+            object.__setattr__(self, '_model', User.query.get(self._id))
+        return self._model
+
+    def __bool__(self):
+        return self._snap() is not None
+
+    def __getattr__(self, name):
+        if name == 'id':
+            return self._id
+
+        if name in SNAPSHOT_FIELDS:
+            snapshot = self._snap()
+            if snapshot is not None:
+                return getattr(snapshot, name)
+
+        return getattr(self.model, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.model, name, value)
+
+    def __eq__(self, other):
+        return getattr(other, 'id', None) == self._id
+
+    def __hash__(self):
+        return hash(self._id)
+
+    def __repr__(self):
+        return f"<CurrentUser #{self._id}>"
+
+
+def _invalidate_pending(session):
+    for user_id in session.info.pop('user_cache_pending', ()):
+        invalidate(user_id)
+
+
+event.listen(db.session, 'after_commit', _invalidate_pending)
+event.listen(db.session, 'after_rollback', _invalidate_pending)
+
+
+@event.listens_for(db.session, 'after_bulk_delete')
+def _clear_on_bulk_delete(delete_context):
+    if delete_context.mapper.class_ is User:
+        clear()
+
+
+@event.listens_for(db.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    clear()
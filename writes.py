@@ -0,0 +1,212 @@
+"""Write path for likes and follows.
+
+Views call `toggle_like()`, `follow()` and `unfollow()` here. The writes
+themselves are idempotent (see social.py). By default each one commits
+immediately.
+
+With `WRITE_BUFFER=1` they go through a per-process write-behind buffer
+instead. It keeps only the latest intended state per `(user, target)`, so
+a like toggled on and off between flushes costs nothing. It applies
+everything waiting in one transaction every `interval` seconds, or as soon
+as `max_pending` entries are waiting.
+
+Durability when buffering:
+
+- A write is acknowledged before it is committed. Whatever is still
+  buffered when a process is killed is lost: at most `interval` seconds'
+  or `max_pending` entries' worth. A normal interpreter exit flushes first
+  (atexit).
+- Until the flush, pages read from the database don't show the write yet.
+  The JSON API answers with the intended state.
+- An entry whose user or target was deleted in the meantime is dropped
+  without losing the rest of its batch: each entry is applied in a
+  SAVEPOINT, so only its own writes are rolled back.
+
+Leave buffering off wherever an acknowledged like or follow must survive a
+crash.
+"""
+
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db
+import routing
+import social
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_MAX_PENDING = 500
+
+LIKE = 'like'
+FOLLOW = 'follow'
+
+APPLY = {
+    LIKE: social.set_like,
+    FOLLOW: social.set_follow,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Coalesces like/follow states and applies them in batches."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.flushes = self.written = self.coalesced = self.dropped = 0
+
+    def set(self, kind, user_id, target_id, state):
+        """Record that `user_id`'s `kind` of `target_id` should be `state`."""
+
+        key = (kind, user_id, target_id)
+
+        with self.lock:
+            if key in self.pending:
+                self.coalesced += 1
+                del self.pending[key]
+            self.pending[key] = state
+            full = len(self.pending) >= self.max_pending
+
+            # started on first use, so each forked web worker gets its own
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,
+                                               name='write-behind',
+                                               daemon=True)
+                self.thread.start()
+
+        if full:
+            self.wake.set()
+
+    def get(self, kind, user_id, target_id):
+        """Buffered state for this pair, or None if nothing is waiting."""
+
+        with self.lock:
+            return self.pending.get((kind, user_id, target_id))
+
+    def _run(self):
+        while not self.stopping:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("write-behind flush failed")
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """Apply and commit everything waiting; returns how many entries."""
+
+        with self.lock:
+            batch, self.pending = self.pending, OrderedDict()
+
+        if not batch:
+            return 0
+
+        # each entry in its own SAVEPOINT: one bad entry (its message or
+        # user is gone) is rolled back alone, and the rest are applied, with
+        # their side effects (trending counts, cache invalidation), once
+        for (kind, user_id, target_id), state in batch.items():
+            try:
+                with db.session.begin_nested():
+                    APPLY[kind](user_id, target_id, state)
+            except SQLAlchemyError:
+                self.dropped += 1
+                logger.warning("dropped buffered %s %s -> %s",
+                               kind, user_id, target_id)
+        db.session.commit()
+
+        self.flushes += 1
+        self.written += len(batch)
+        return len(batch)
+
+    def stop(self):
+        """Stop the flusher thread and flush what is left."""
+
+        self.stopping = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending': len(self.pending),
+                'flushes': self.flushes,
+                'written': self.written,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+            }
+
+
+buffer = None
+
+
+def configure(enabled, interval=DEFAULT_INTERVAL,
+              max_pending=DEFAULT_MAX_PENDING):
+    """Turn the write-behind buffer on or off (from app config)."""
+
+    global buffer
+    if buffer is not None:
+        buffer.stop()
+    buffer = WriteBehindBuffer(interval, max_pending) if enabled else None
+
+
+@atexit.register
+def _flush_at_exit():
+    if buffer is not None:
+        buffer.stop()
+
+
+def _current(kind, user_id, target_id, lookup):
+    state = buffer.get(kind, user_id, target_id)
+    if state is None:
+        state = lookup(user_id, target_id)
+    return state
+
+
+def toggle_like(user_id, message_id):
+    """Like or unlike `message_id`; returns whether it is now liked."""
+
+    if buffer is None:
+        liked = social.toggle_like(user_id, message_id)
+        db.session.commit()
+        return liked
+
+    liked = not _current(LIKE, user_id, message_id, social.is_liked)
+    buffer.set(LIKE, user_id, message_id, liked)
+    routing.stick_to_primary()
+    return liked
+
+
+def follow(user_id, followed_id):
+    """Make `user_id` follow `followed_id`."""
+
+    if buffer is None:
+        if social.follow(user_id, followed_id):
+            db.session.commit()
+    else:
+        buffer.set(FOLLOW, user_id, followed_id, True)
+        routing.stick_to_primary()
+
+
+def unfollow(user_id, followed_id):
+    """Stop `user_id` following `followed_id`."""
+
+    if buffer is None:
+        if social.unfollow(user_id, followed_id):
+            db.session.commit()
+    else:
+        buffer.set(FOLLOW, user_id, followed_id, False)
+        routing.stick_to_primary()